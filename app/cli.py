@@ -1,6 +1,12 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import typer
+from app.configs.config import settings
 from app.fixtures.seed import seed_database
-from app.configs.database import SessionLocal
+from app.configs.database import SessionLocal, engine
 from app.fixtures.alembic_flush import  alembic_flush
 from app.core.cybersource_create_webhook import create_wallet_webhook
 
@@ -40,5 +46,204 @@ def webhook(create: bool = typer.Option(True, help="create webhook or get")):
    return
 
  typer.echo("*"*10 + "LIST OR GET WEBHOOK" + "*"*100)
+@app.command()
+def bench_pin(
+    payments: int = typer.Option(200, help="Number of PIN verifications to run."),
+    rounds: int = typer.Option(settings.BCRYPT_ROUNDS, help="bcrypt cost factor of the PIN hash."),
+    workers: int = typer.Option(settings.BCRYPT_WORKERS, help="bcrypt threads of the offloaded run."),
+):
+    """
+    Benchmark the PIN check of a payment: bcrypt inline on the event loop (before)
+    against the dedicated bcrypt threads (after). Prints payments/sec, payments/sec
+    per core and the longest event loop stall, i.e. the latency added to every other
+    request of the worker.
+    """
+    from app.core.hashing import HashingQueue
+    from app.core.utils import pwd_context
+
+    pin_hash = pwd_context.handler("bcrypt").using(rounds=rounds).hash("12345")
+
+    async def inline_verify():
+        return pwd_context.verify("12345", pin_hash)
+
+    async def run(verify, cores):
+        stalls = []
+
+        async def ticker():
+            while True:
+                started = time.perf_counter()
+                await asyncio.sleep(0.001)
+                stalls.append(time.perf_counter() - started - 0.001)
+
+        tick = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        await asyncio.gather(*(verify() for _ in range(payments)))
+        elapsed = time.perf_counter() - started
+        # let the ticker record the stall it is still waiting on
+        await asyncio.sleep(0.01)
+        tick.cancel()
+        rate = payments / elapsed
+        return rate, rate / cores, max(stalls, default=0.0) * 1000
+
+    async def bench():
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        queue = HashingQueue(max_pending=payments, executor=executor)
+        try:
+            yield "inline", await run(inline_verify, 1)
+            yield f"offloaded ({workers} threads)", await run(
+                lambda: queue.run(pwd_context.verify, "12345", pin_hash), min(workers, os.cpu_count() or 1))
+        finally:
+            executor.shutdown()
+
+    async def main():
+        typer.echo(f"{payments} PIN verifications, bcrypt cost {rounds}")
+        async for name, (rate, per_core, stall) in bench():
+            typer.echo(f"{name:<24} {rate:8.1f} payments/s {per_core:8.1f} payments/s/core   max loop stall {stall:8.1f} ms")
+
+    asyncio.run(main())
+
+@app.command()
+def bench_fees(
+    bands: int = typer.Option(10000, help="Fee bands of the generated grid."),
+    lookups: int = typer.Option(200000, help="Fee lookups to run."),
+):
+    """
+    Benchmark fee lookups on a generated grid of contiguous bands: linear scan of the
+    bands (what a query-free lookup costs without the index) against TariffIndex.
+    Prints lookups/sec and the time per lookup.
+    """
+    import random
+    from decimal import Decimal
+    from app.core.tariff_index import TariffIndex
+
+    width = Decimal(1000)
+    rows = [("transfer", "XAF", width * i, width * (i + 1) - 1, Decimal(i)) for i in range(bands)]
+    amounts = [Decimal(random.randrange(0, bands * 1000)) for _ in range(lookups)]
+
+    def linear_fee(amount):
+        for _, _, min_amount, max_amount, fee in rows:
+            if min_amount <= amount <= max_amount:
+                return fee
+
+    index = TariffIndex(rows)
+    # the scan is O(bands), a sample keeps the run short on large grids
+    sample = amounts[:max(1, min(lookups, 2000000 // max(bands, 1)))]
+
+    for name, fee, runs in (("linear scan", linear_fee, sample),
+                            ("interval index", lambda amount: index.fee("transfer", "XAF", amount), amounts)):
+        started = time.perf_counter()
+        for amount in runs:
+            fee(amount)
+        elapsed = time.perf_counter() - started
+        typer.echo(f"{name:<16} {len(runs) / elapsed:12.0f} lookups/s {elapsed / len(runs) * 1e6:10.3f} us/lookup   ({len(runs)} lookups, {bands} bands)")
+
+@app.command()
+def explain_history(
+    user_id: int = typer.Option(None, help="User whose history is explained, all the transactions when omitted (admin view)."),
+    days: int = typer.Option(30, help="Length of the explained period."),
+):
+    """
+    EXPLAIN the transaction history query on the configured database and fail when
+    it reads the transactions table without an index. tests/test_history_query.py
+    runs the same check when TEST_MYSQL_URL is set.
+    """
+    from datetime import datetime, timedelta
+    import app.models.user_model  # noqa: F401, registers the User mapper
+    from app.models.transaction_model import history_full_scans, history_page_query
+
+    end_date = datetime.now()
+    query = history_page_query(user_id, end_date - timedelta(days=days), end_date)
+    compiled = query.compile(dialect=engine.dialect)
+
+    db = SessionLocal()
+    try:
+        plan = db.connection().exec_driver_sql(f"EXPLAIN {compiled}", compiled.params).mappings().all()
+    finally:
+        db.close()
+
+    for row in plan:
+        typer.echo(f"{row['id']!s:>3} {row['select_type']:<20} {row['table']!s:<14} {row['type']!s:<8} {row['key']!s:<40} {row['rows']!s:>8}  {row['Extra'] or ''}")
+
+    full_scans = history_full_scans(plan)
+    if full_scans:
+        typer.echo(f"{len(full_scans)} full scan(s) of transactions, check the history indexes", err=True)
+        raise typer.Exit(code=1)
+    typer.echo("Every read of transactions uses an index.")
+
+@app.command()
+def reconcile(checkpoint: bool = typer.Option(False, help="Checkpoint the balances first.")):
+    """
+    Compare every wallet balance with the one rebuilt from the ledger (latest checkpoint
+    plus the entries after it) and fail on any difference.
+    """
+    from app.core.tasks import checkpoint_balances
+    from app.models.ledger_model import reconciliation_query
+
+    db = SessionLocal()
+    try:
+        if checkpoint:
+            checkpoint_balances(db)
+        # Both sides read in a single transaction, so from the same snapshot
+        rows = db.execute(reconciliation_query()).all()
+    finally:
+        db.close()
+
+    # Exact decimals on both sides, any difference is a real one
+    mismatches = [(wallet_id, balance, ledger_balance) for wallet_id, balance, ledger_balance in rows
+                  if balance != ledger_balance]
+    for wallet_id, balance, ledger_balance in mismatches:
+        typer.echo(f"wallet {wallet_id}: balance {balance} ledger {ledger_balance}", err=True)
+
+    if mismatches:
+        typer.echo(f"{len(mismatches)} of {len(rows)} wallet(s) do not match the ledger", err=True)
+        raise typer.Exit(code=1)
+    typer.echo(f"{len(rows)} wallet(s) match the ledger.")
+
+@app.command()
+def backfill_statements(
+    since: str = typer.Option(None, help="First day to rebuild (YYYY-MM-DD), the whole history otherwise."),
+    until: str = typer.Option(None, help="Day to stop before (YYYY-MM-DD), today by default."),
+):
+    """
+    Rebuild the daily wallet statements from the ledger. Today is left to the live
+    updates by default, rebuild it (--until tomorrow) only while the API is stopped.
+    """
+    from datetime import date
+    from app.models.statement_model import rebuild_wallet_stats
+
+    since_day = date.fromisoformat(since) if since else None
+    until_day = date.fromisoformat(until) if until else date.today()
+
+    db = SessionLocal()
+    try:
+        count = rebuild_wallet_stats(db, since_day, until_day)
+    finally:
+        db.close()
+    typer.echo(f"Rebuilt {count} wallet day(s) before {until_day}.")
+
+@app.command()
+def snapshot_analytics(
+    since: str = typer.Option(..., help="First day to snapshot (YYYY-MM-DD)."),
+    until: str = typer.Option(None, help="Day to stop before (YYYY-MM-DD), tomorrow by default."),
+):
+    """
+    Write the Parquet snapshots of the transactions of past days, read by the analytics
+    endpoints. The scheduler only keeps the last ANALYTICS_SNAPSHOT_DAYS up to date.
+    """
+    from datetime import date, timedelta
+    from app.services.analytics import transaction_snapshots
+
+    since_day = date.fromisoformat(since)
+    until_day = date.fromisoformat(until) if until else date.today() + timedelta(days=1)
+
+    db = SessionLocal()
+    start = time.perf_counter()
+    try:
+        rows = transaction_snapshots.snapshot(db, since_day, until_day)
+    finally:
+        db.close()
+    typer.echo(f"Snapshotted {rows} transactions from {since_day} to {until_day} in {time.perf_counter() - start:.1f}s "
+               f"into {transaction_snapshots.path}.")
+
 if __name__ == "__main__":
     app()
@@ -1,4 +1,5 @@
 import os
+from typing import List
 from pydantic_settings import BaseSettings
 from fastapi.security.api_key import APIKeyHeader
 from fastapi_babel import Babel, BabelConfigs
@@ -16,10 +17,78 @@ class Settings(BaseSettings):
     MYSQL_PORT: str
     MYSQL_DATABASE: str
 
+    # Connection pool, sized per uvicorn worker
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: int = 30  # seconds to wait for a connection before failing
+    DB_POOL_RECYCLE: int = 1800  # seconds, must stay below MySQL's wait_timeout
+    DB_POOL_PRE_PING: bool = True
+    # Pool of the synchronous engine, only used by the scheduler jobs and the CLI
+    DB_SYNC_POOL_SIZE: int = 2
+    DB_SYNC_MAX_OVERFLOW: int = 3
+
+    # Outbound HTTP calls (SMS provider, Paycool, currency provider), one keep-alive pool per upstream
+    HTTP_CONNECT_TIMEOUT: float = 5.0
+    HTTP_READ_TIMEOUT: float = 15.0
+    HTTP_MAX_CONNECTIONS_PER_HOST: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0  # seconds an idle connection is kept open
+
     SMS_ENDPOINT: str
     SMS_API_KEY: str
     SMS_SENDER: str
     SMS_PASSWORD: str
+    SMS_BACKEND: str = "http"  # http | file | memory
+    SMS_WORKERS: int = 4
+    SMS_QUEUE_SIZE: int = 10000
+    SMS_MAX_RETRIES: int = 3
+    SMS_RETRY_BACKOFF: float = 1.0  # seconds, doubled on every retry
+    SMS_FILE_BACKEND_PATH: str = "logs/sms_outbox.jsonl"
+    SMS_DEAD_LETTER_FILE: str = "logs/sms_dead_letters.jsonl"
+
+    # USSD sessions: database | redis | memory (memory only works with a single worker)
+    USSD_SESSION_BACKEND: str = "database"
+    USSD_SESSION_TTL: int = 60  # seconds of inactivity before a USSD session expires
+    REDIS_URL: str = "redis://localhost:6379/0"
+    USSD_SESSION_SWEEP_INTERVAL: int = 300  # seconds between two purges of the expired sessions
+    USSD_SESSION_SWEEP_BATCH: int = 1000  # rows deleted per statement by the purge
+
+    LEDGER_CHECKPOINT_INTERVAL: int = 3600  # seconds between two balance checkpoints
+    LEDGER_CHECKPOINT_LAG: int = 60  # seconds a ledger entry waits before being checkpointed
+
+    IDEMPOTENCY_KEY_TTL: int = 86400  # seconds a response is replayed for a retry with the same Idempotency-Key
+    IDEMPOTENCY_CACHE_SIZE: int = 10000  # responses kept in memory by each worker
+    IDEMPOTENCY_WAIT_TIMEOUT: float = 10  # seconds a duplicate waits for the request in progress
+    IDEMPOTENCY_CLAIM_TIMEOUT: int = 60  # seconds before a retry takes over a key whose request never completed
+
+    STRIPE_EVENTS_BATCH_SIZE: int = 50  # Stripe events applied per transaction
+    STRIPE_EVENTS_POLL_INTERVAL: float = 5  # seconds between two looks for events recorded by the other workers
+    STRIPE_EVENTS_MAX_ATTEMPTS: int = 5  # before an event that keeps failing is marked failed
+
+    # Outbox: side effects committed with the balance changes, relayed to their sinks afterwards
+    OUTBOX_BATCH_SIZE: int = 100  # messages taken per relay transaction
+    OUTBOX_POLL_INTERVAL: float = 5  # seconds between two looks for messages committed by the other workers
+    OUTBOX_MAX_ATTEMPTS: int = 8  # before a message that keeps failing is marked failed
+    OUTBOX_RETRY_BACKOFF: float = 5  # seconds before the first retry, doubled on every retry
+    OUTBOX_LEASE: float = 60  # seconds a relay holds the messages it sends, longer than the slowest sink
+    OUTBOX_RETENTION: int = 604800  # seconds the relayed messages are kept
+    OUTBOX_WEBHOOK_URL: str = ""  # transaction events are also POSTed there when set
+    ANALYTICS_EVENTS_FILE: str = "logs/analytics_events.jsonl"
+
+    BULK_TRANSFER_MAX_ROWS: int = 5000  # payments accepted in one bulk transfer
+    BULK_TRANSFER_CHUNK_SIZE: int = 200  # payments applied per database transaction
+    EXPORT_BATCH_SIZE: int = 1000  # rows fetched from the cursor and written at a time by the exports
+
+    # Analytics: Parquet snapshots of the transactions, read by the /analytics endpoints
+    ANALYTICS_SNAPSHOT_DIR: str = "data/analytics"
+    ANALYTICS_SNAPSHOT_INTERVAL: int = 900  # seconds between two snapshots, the reports lag by as much
+    ANALYTICS_SNAPSHOT_DAYS: int = 2  # days rewritten by every snapshot, today included
+    ANALYTICS_SNAPSHOT_BATCH_SIZE: int = 10000  # rows fetched from the cursor per Parquet row group
+
+    SUPPORTED_CURRENCIES: List[str] = ["USD", "EUR", "XAF"]
+    CURRENCY_RATES_BASE_CURRENCY: str = "USD"  # the other pairs are derived from this currency's rates
+    CURRENCY_RATES_CACHE_TTL: int = 600  # seconds before a worker reloads the exchange rates
+    TARIFF_CACHE_TTL: int = 600  # seconds before a worker reloads the fee grid
+    CURRENCY_CONVERTER_ENDPOINT: str = "https://www.google.com/finance/converter"
 
     PAYCOOL_ENPOINT: str
     PAYCOOL_EMAIL: str
@@ -28,11 +97,19 @@ class Settings(BaseSettings):
     STRIPE_SECRET_KEY: str
     STRIPE_ENDPOINT_SECRET: str
 
+    # PIN/password hashing, run on dedicated threads
+    BCRYPT_ROUNDS: int = 12  # cost factor, existing hashes are rehashed on login when it changes
+    BCRYPT_WORKERS: int = 2  # hashing threads per uvicorn worker, about one per core
+    BCRYPT_MAX_PENDING: int = 64  # hashes allowed to wait before answering 503
+
     SECRET_KEY: str
+    MERCHANT_CODE_PEPPER: str  # HMAC key of the merchant codes, changing it invalidates every code
     REFRESH_SECRET_KEY: str
     JWT_ALGORITHM: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
     REFRESH_TOKEN_EXPIRE_MINUTES: int
+    PRINCIPAL_CACHE_TTL: int = 60  # seconds an authenticated user's id/roles are reused without a query
+    PRINCIPAL_CACHE_SIZE: int = 10000
 
     STATIC_FOLDER: str
 
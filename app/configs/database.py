@@ -1,22 +1,45 @@
-
 from app.configs.config import settings
+from app.core.pool_metrics import PoolMetrics
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 
 SQLALCHEMY_DATABASE_URL = f"mysql+pymysql://{settings.MYSQL_USER}:{settings.MYSQL_PASSWORD}@{settings.MYSQL_HOST}:{settings.MYSQL_PORT}/{settings.MYSQL_DATABASE}"
+ASYNC_SQLALCHEMY_DATABASE_URL = f"mysql+aiomysql://{settings.MYSQL_USER}:{settings.MYSQL_PASSWORD}@{settings.MYSQL_HOST}:{settings.MYSQL_PORT}/{settings.MYSQL_DATABASE}"
+
+POOL_OPTIONS = {
+    "pool_size": settings.DB_POOL_SIZE,
+    "max_overflow": settings.DB_MAX_OVERFLOW,
+    "pool_timeout": settings.DB_POOL_TIMEOUT,
+    "pool_recycle": settings.DB_POOL_RECYCLE,
+    "pool_pre_ping": settings.DB_POOL_PRE_PING,
+}
+
+sync_pool_metrics = PoolMetrics("sync")
+async_pool_metrics = PoolMetrics("async")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# Synchronous engine, used by the CLI, the fixtures and the scheduler jobs: every worker
+# runs the scheduler, a few connections are enough next to the async pool
+SYNC_POOL_OPTIONS = dict(POOL_OPTIONS, pool_size=settings.DB_SYNC_POOL_SIZE, max_overflow=settings.DB_SYNC_MAX_OVERFLOW)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=sync_pool_metrics.pool_class(QueuePool), **SYNC_POOL_OPTIONS)
+sync_pool_metrics.attach(engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Asynchronous engine, used by the API routers through get_db
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=async_pool_metrics.pool_class(AsyncAdaptedQueuePool), **POOL_OPTIONS)
+async_pool_metrics.attach(async_engine.sync_engine)
+
+# expire_on_commit is disabled so that ORM objects can still be read after a
+# commit without triggering an implicit (and forbidden) lazy load
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 metadata = Base.metadata
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
@@ -0,0 +1,52 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+from app.configs.config import settings
+from app.core.utils import pwd_context
+
+# bcrypt releases the GIL while hashing, so a few dedicated threads use as many cores
+# without ever running on the event loop or competing with the default threadpool
+hashing_executor = ThreadPoolExecutor(max_workers=settings.BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+
+
+class HashingQueue:
+    """
+    Bound the number of hash computations waiting for the bcrypt threads.
+    Past the limit the request is refused with a 503 right away, so a burst of
+    brute-force logins cannot queue minutes of work in front of the payments.
+    """
+
+    def __init__(self, max_pending: int, executor: ThreadPoolExecutor = hashing_executor):
+        self.max_pending = max_pending
+        self.executor = executor
+        self.pending = 0
+
+    async def run(self, func, *args):
+        if self.pending >= self.max_pending:
+            raise HTTPException(status_code=503, detail="Server busy, please try again later", headers={"Retry-After": "1"})
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
+
+
+hashing_queue = HashingQueue(settings.BCRYPT_MAX_PENDING)
+
+
+async def asecure_pwd(raw_password) -> str:
+    return await hashing_queue.run(pwd_context.hash, raw_password)
+
+
+async def averify_pwd(plain, hash) -> bool:
+    return await hashing_queue.run(pwd_context.verify, plain, hash)
+
+
+async def averify_and_update(plain, hash):
+    """
+    Verify and, when the hash was made with another cost factor than BCRYPT_ROUNDS,
+    return a new hash to store in its place. Returns (valid, new_hash or None).
+    """
+    return await hashing_queue.run(pwd_context.verify_and_update, plain, hash)
@@ -0,0 +1,125 @@
+import bisect
+import threading
+import time
+
+import httpx
+
+from app.configs.config import settings
+
+# Upper bounds (in ms) of the latency histogram buckets, the last bucket is open-ended
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.requests = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms: float, error: bool = False):
+        with self._lock:
+            self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+            self.requests += 1
+            self.errors += int(error)
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            labels = [f"le_{bound}ms" for bound in LATENCY_BUCKETS_MS] + ["gt_10000ms"]
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "avg_ms": self.total_ms / self.requests if self.requests else 0.0,
+                "max_ms": self.max_ms,
+                "buckets": dict(zip(labels, self.counts)),
+            }
+
+
+class HttpClients:
+    """
+    One keep-alive httpx client per upstream (SMS provider, Paycool, currency
+    provider...), created on first use with the pool limits and the timeouts from
+    Settings, so calls reuse their TCP+TLS connections and can never hang forever.
+    Every call goes through `request`/`arequest`, which record its latency.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sync_clients = {}
+        self._async_clients = {}
+        self.histograms = {}
+
+    def _options(self) -> dict:
+        return {
+            "timeout": httpx.Timeout(
+                settings.HTTP_READ_TIMEOUT,
+                connect=settings.HTTP_CONNECT_TIMEOUT,
+                pool=settings.HTTP_CONNECT_TIMEOUT,
+            ),
+            "limits": httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONNECTIONS_PER_HOST,
+                max_keepalive_connections=settings.HTTP_MAX_CONNECTIONS_PER_HOST,
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            ),
+        }
+
+    def histogram(self, upstream: str) -> LatencyHistogram:
+        with self._lock:
+            if upstream not in self.histograms:
+                self.histograms[upstream] = LatencyHistogram()
+            return self.histograms[upstream]
+
+    def sync_client(self, upstream: str) -> httpx.Client:
+        with self._lock:
+            if upstream not in self._sync_clients:
+                self._sync_clients[upstream] = httpx.Client(**self._options())
+            return self._sync_clients[upstream]
+
+    def async_client(self, upstream: str) -> httpx.AsyncClient:
+        with self._lock:
+            if upstream not in self._async_clients:
+                self._async_clients[upstream] = httpx.AsyncClient(**self._options())
+            return self._async_clients[upstream]
+
+    def request(self, upstream: str, method: str, url: str, **kwargs) -> httpx.Response:
+        histogram = self.histogram(upstream)
+        started = time.perf_counter()
+        try:
+            response = self.sync_client(upstream).request(method, url, **kwargs)
+        except httpx.HTTPError:
+            histogram.observe((time.perf_counter() - started) * 1000, error=True)
+            raise
+        histogram.observe((time.perf_counter() - started) * 1000, error=response.is_server_error)
+        return response
+
+    async def arequest(self, upstream: str, method: str, url: str, **kwargs) -> httpx.Response:
+        histogram = self.histogram(upstream)
+        started = time.perf_counter()
+        try:
+            response = await self.async_client(upstream).request(method, url, **kwargs)
+        except httpx.HTTPError:
+            histogram.observe((time.perf_counter() - started) * 1000, error=True)
+            raise
+        histogram.observe((time.perf_counter() - started) * 1000, error=response.is_server_error)
+        return response
+
+    async def aclose(self):
+        with self._lock:
+            sync_clients, self._sync_clients = self._sync_clients, {}
+            async_clients, self._async_clients = self._async_clients, {}
+        for client in sync_clients.values():
+            client.close()
+        for client in async_clients.values():
+            await client.aclose()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            histograms = dict(self.histograms)
+        return {upstream: histogram.snapshot() for upstream, histogram in histograms.items()}
+
+
+http_clients = HttpClients()
@@ -0,0 +1,251 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from fastapi import HTTPException, Response
+from pydantic import BaseModel
+
+from app.configs.config import settings
+from app.configs.database import AsyncSessionLocal
+from app.models.idempotency_model import (
+    claim_idempotency_key, complete_idempotency_key, get_idempotency_key, release_idempotency_key,
+    take_over_idempotency_key,
+)
+
+logger = logging.getLogger(__name__)
+
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    endpoint: str
+    request_hash: str
+    status_code: Optional[int]  # None while the request runs
+    body: Optional[str]  # replayed as is
+    claimed_at: Optional[datetime] = None
+
+
+class IdempotencyClaim:
+    """
+    The key held by a running request, handed to its handler. A handler that commits
+    calls complete() right before its commit: the response is then stored by the same
+    transaction as the payment, a payment cannot commit without it nor the other way round.
+    """
+
+    def __init__(self, user_id: int, key: str, claimed_at: datetime, serialize: Callable[[Any], str]):
+        self.user_id = user_id
+        self.key = key
+        self.claimed_at = claimed_at
+        self.serialize = serialize
+        self.body = None
+        self.kept = False
+
+    async def complete(self, db, result):
+        body = self.serialize(result)
+        if not await complete_idempotency_key(db, self.user_id, self.key, self.claimed_at, 200, body):
+            # Taken over by a retry after IDEMPOTENCY_CLAIM_TIMEOUT, the caller rolls back
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is in progress")
+        self.body = body
+
+    def keep(self):
+        """
+        For handlers committing in several transactions: from now on the key is not
+        released when the handler fails, a retry would redo what was committed.
+        """
+        self.kept = True
+
+
+class IdempotencyStore:
+    """
+    Responses of the requests sent with an Idempotency-Key, keyed by (user id, key).
+
+    The idempotency_keys table is the reference: a worker inserts the key before
+    running the request and the unique index lets only one of them do so. The response
+    is written by the transaction of the payment (see IdempotencyClaim), so a key is
+    pending exactly as long as nothing was committed: a failed request releases it,
+    and a retry takes over a key left pending for claim_timeout by a dead worker.
+    Completed responses are also kept in a process-local LRU, a retry is then answered
+    without any query. A duplicate arriving while the first request runs waits for its
+    response: on the in-flight future in the same worker, by polling the table in
+    another one.
+    """
+
+    def __init__(self, ttl: int, max_size: int, wait_timeout: float, claim_timeout: float = 60,
+                 poll_interval: float = 0.1, session_factory=AsyncSessionLocal):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+        self.claim_timeout = claim_timeout
+        self.poll_interval = poll_interval
+        self.session_factory = session_factory
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._in_flight = {}
+
+    def _cached(self, cache_key) -> Optional[StoredResponse]:
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return None
+            response, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[cache_key]
+                return None
+            self._entries.move_to_end(cache_key)
+            return response
+
+    def _cache(self, cache_key, response: StoredResponse):
+        with self._lock:
+            self._entries[cache_key] = (response, time.monotonic())
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def _replay(response: StoredResponse, endpoint: str, request_hash: str) -> StoredResponse:
+        if response.endpoint != endpoint or response.request_hash != request_hash:
+            raise HTTPException(status_code=422, detail="Idempotency-Key already used for another request")
+        return response
+
+    async def _stored(self, user_id: int, key: str) -> Optional[StoredResponse]:
+        async with self.session_factory() as db:
+            record = await get_idempotency_key(db, user_id, key)
+        if record is None:
+            return None
+        return StoredResponse(record.endpoint, record.request_hash, record.status_code, record.response, record.claimed_at)
+
+    def _stale(self, response: StoredResponse) -> bool:
+        return response.claimed_at is None or response.claimed_at <= datetime.utcnow() - timedelta(seconds=self.claim_timeout)
+
+    async def _claim(self, user_id: int, key: str, endpoint: str, request_hash: str,
+                     takeover: bool) -> Tuple[Optional[datetime], Optional[StoredResponse]]:
+        """
+        Claim the key: (claimed_at, None), or (None, the response) once the request
+        holding it in another worker completed.
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            async with self.session_factory() as db:
+                claimed_at = await claim_idempotency_key(db, user_id, key, endpoint, request_hash)
+            if claimed_at is not None:
+                return claimed_at, None
+
+            response = await self._stored(user_id, key)
+            if response is None:
+                continue  # released after a failure, this request may run under the key
+            self._replay(response, endpoint, request_hash)
+            if response.status_code is not None:
+                return None, response
+
+            if takeover and self._stale(response):
+                async with self.session_factory() as db:
+                    claimed_at = await take_over_idempotency_key(db, user_id, key, response.claimed_at)
+                if claimed_at is not None:
+                    logger.warning(f"Idempotency-Key of user {user_id} taken over, claimed at {response.claimed_at}")
+                    return claimed_at, None
+                continue
+            if time.monotonic() >= deadline:
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is in progress")
+            await asyncio.sleep(self.poll_interval)
+
+    async def run(self, user_id: int, key: str, endpoint: str, request_hash: str,
+                  handler: Callable[[IdempotencyClaim], Awaitable], serialize: Callable[[Any], str],
+                  takeover: bool = True) -> Tuple[StoredResponse, bool]:
+        """
+        The response of the request, from `handler` the first time, and whether it is a replay.
+        """
+        cache_key = (user_id, key)
+        while True:
+            response = self._cached(cache_key)
+            if response is not None:
+                return self._replay(response, endpoint, request_hash), True
+
+            in_flight = self._in_flight.get(cache_key)
+            if in_flight is None:
+                break
+            try:
+                await asyncio.wait_for(asyncio.shield(in_flight), self.wait_timeout)
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is in progress")
+
+        in_flight = asyncio.get_running_loop().create_future()
+        self._in_flight[cache_key] = in_flight
+        try:
+            claimed_at, response = await self._claim(user_id, key, endpoint, request_hash, takeover)
+            if response is not None:
+                self._cache(cache_key, response)
+                return response, True
+
+            claim = IdempotencyClaim(user_id, key, claimed_at, serialize)
+            try:
+                result = await handler(claim)
+                if claim.body is None:
+                    # Nothing committed by the handler, the response is stored on its own
+                    body = serialize(result)
+                    async with self.session_factory() as db:
+                        await complete_idempotency_key(db, user_id, key, claimed_at, 200, body)
+                        await db.commit()
+                    claim.body = body
+            except BaseException:
+                # A completed key is left as is: the payment committed with its response
+                if not claim.kept:
+                    async with self.session_factory() as db:
+                        await release_idempotency_key(db, user_id, key, claimed_at)
+                raise
+
+            response = StoredResponse(endpoint, request_hash, 200, claim.body, claimed_at)
+            self._cache(cache_key, response)
+            return response, False
+        finally:
+            del self._in_flight[cache_key]
+            in_flight.set_result(None)
+
+
+idempotency_store = IdempotencyStore(
+    ttl=settings.IDEMPOTENCY_KEY_TTL,
+    max_size=settings.IDEMPOTENCY_CACHE_SIZE,
+    wait_timeout=settings.IDEMPOTENCY_WAIT_TIMEOUT,
+    claim_timeout=settings.IDEMPOTENCY_CLAIM_TIMEOUT,
+)
+
+
+def request_hash(request) -> str:
+    # A request model, or the raw bytes of an upload
+    data = request.model_dump_json().encode() if isinstance(request, BaseModel) else request
+    return hashlib.sha256(data).hexdigest()
+
+
+async def idempotent(key: Optional[str], user_id: int, endpoint: str, request,
+                     handler: Callable[[Optional[IdempotencyClaim]], Awaitable], response_model=None,
+                     serialize: Callable = None, media_type: str = "application/json", takeover: bool = True):
+    """
+    Run `handler` once per Idempotency-Key, its result serialized with `response_model`
+    (or `serialize`, for another media type). The handler gets the claim of the key, to
+    complete before it commits, None when the request came without a key. Handlers whose
+    work spans several transactions pass takeover=False: a key they left pending is
+    never run again.
+    """
+    if not key:
+        if serialize is None:
+            return await handler(None)
+        return Response(content=serialize(await handler(None)), media_type=media_type)
+
+    serialize = serialize or (lambda result: response_model.model_validate(result).model_dump_json())
+    response, replayed = await idempotency_store.run(user_id, key, endpoint, request_hash(request), handler, serialize, takeover)
+    return Response(
+        content=response.body,
+        status_code=response.status_code,
+        media_type=media_type,
+        headers={REPLAYED_HEADER: "true"} if replayed else None,
+    )
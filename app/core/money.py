@@ -0,0 +1,66 @@
+from decimal import Decimal, ROUND_HALF_EVEN
+from typing import Annotated
+
+from pydantic import PlainSerializer
+from sqlalchemy import Numeric
+
+# Decimals of each currency (ISO 4217), amounts of unknown currencies keep DEFAULT_SCALE
+CURRENCY_SCALES = {"XAF": 0, "XOF": 0, "USD": 2, "EUR": 2}
+DEFAULT_SCALE = 2
+# Banker's rounding: ties go to the even digit, so rounding errors do not pile up one way
+ROUNDING = ROUND_HALF_EVEN
+
+# Column types: amounts hold the largest currency scale, rates keep enough digits for XAF -> EUR
+MoneyColumn = Numeric(18, 2, asdecimal=True)
+RateColumn = Numeric(18, 8, asdecimal=True)
+RATE_SCALE = 8
+
+# Amount in a schema: parsed into a Decimal, still written as a JSON number for the clients
+Amount = Annotated[Decimal, PlainSerializer(float, return_type=float, when_used="json")]
+
+
+def currency_scale(currency: str) -> int:
+    return CURRENCY_SCALES.get(currency, DEFAULT_SCALE)
+
+
+def to_decimal(value) -> Decimal:
+    """
+    Decimal of an amount or a rate, floats through their shortest repr (0.1 -> Decimal("0.1")).
+    """
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, float):
+        return Decimal(repr(value))
+    return Decimal(value)
+
+
+def quantize(amount, currency: str) -> Decimal:
+    """
+    `amount` rounded to the decimals of the currency, the only rounding applied to money.
+    """
+    return to_decimal(amount).quantize(Decimal(1).scaleb(-currency_scale(currency)), rounding=ROUNDING)
+
+
+def format_amount(amount, currency: str) -> str:
+    """
+    Amount as shown to the users: 1000 XAF, 12.50 EUR.
+    """
+    return f"{quantize(amount, currency)} {currency}"
+
+
+def to_minor_units(amount, currency: str) -> int:
+    """
+    Amount in the smallest unit of the currency (cents, or francs for XAF), as payment providers expect.
+    """
+    return int(quantize(amount, currency).scaleb(currency_scale(currency)))
+
+
+def from_minor_units(units: int, currency: str) -> Decimal:
+    return quantize(Decimal(int(units)).scaleb(-currency_scale(currency)), currency)
+
+
+def quantize_rate(rate) -> Decimal:
+    """
+    Exchange rate rounded like the database stores it, so every worker converts with the same rate.
+    """
+    return to_decimal(rate).quantize(Decimal(1).scaleb(-RATE_SCALE), rounding=ROUNDING)
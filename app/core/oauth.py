@@ -3,11 +3,16 @@ from datetime import datetime, timedelta
 from fastapi import HTTPException, Depends, status, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.configs.config import settings
 from app.configs.database import get_db
-from app.models.user_model import User
+from app.core.principal_cache import Principal, PrincipalCache
+from app.models.roles_model import Merchant, Client, Admin, Partner
+from app.models.user_model import User, Wallet
+
+principal_cache = PrincipalCache(ttl=settings.PRINCIPAL_CACHE_TTL, max_size=settings.PRINCIPAL_CACHE_SIZE)
 
 
 # oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
@@ -98,26 +103,69 @@ def jwt_decode(token:str):
         raise credentials_exception
     return token_data
 
-def get_current_user(token: str = Depends(JWTBearer()), db: Session = Depends(get_db)):
+async def load_principal(db: AsyncSession, phone_number: str):
+    # A single query for the user id, wallet id and roles, no ORM objects
+    result = await db.execute(
+        select(User.id, User.phone_number, Wallet.id, Merchant.id, Client.id, Admin.id, Partner.id)
+        .outerjoin(Wallet, Wallet.owner_id == User.id)
+        .outerjoin(Merchant, Merchant.owner_id == User.id)
+        .outerjoin(Client, Client.owner_id == User.id)
+        .outerjoin(Admin, Admin.owner_id == User.id)
+        .outerjoin(Partner, Partner.owner_id == User.id)
+        .filter(User.phone_number == phone_number)
+        .limit(1)
+    )
+    row = result.first()
+    if row is None:
+        return None
+    user_id, phone, wallet_id, merchant_id, client_id, admin_id, partner_id = row
+    roles = {
+        role for role, role_id in
+        (("merchant", merchant_id), ("client", client_id), ("admin", admin_id), ("partner", partner_id))
+        if role_id is not None
+    }
+    return Principal(id=user_id, phone_number=phone, roles=frozenset(roles), wallet_id=wallet_id)
+
+def invalidate_principal(phone_number: str):
+    """
+    Drop the cached principal after a profile, PIN or role change.
+    """
+    principal_cache.invalidate(phone_number)
+
+async def get_current_principal(token: str = Depends(JWTBearer()), db: AsyncSession = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     token_data = verify_token(token, credentials_exception)
-    user = db.query(User).filter(User.phone_number == token_data["phone_number"]).first()
+    phone_number = token_data["phone_number"]
+
+    principal = principal_cache.get(phone_number)
+    if principal is None:
+        principal = await load_principal(db, phone_number)
+        if principal is None:
+            raise credentials_exception
+        principal_cache.set(phone_number, principal)
+    return principal
+
+async def get_current_user(principal: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_db)):
+    """
+    The full User, for the handlers that read or change it (balance, PIN...).
+    The handlers that only need the identity or the roles use get_current_principal.
+    """
+    user = await db.get(User, principal.id)
     if user is None:
-        raise credentials_exception
+        invalidate_principal(principal.phone_number)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
-def verify_role(user: User, allowed_roles: list):
-    if user.merchant and "merchant" in allowed_roles:
-        return True
-    if user.client and "client" in allowed_roles:
-        return True
-    if user.admin and "admin" in allowed_roles:
-        return True
-    if user.partner and "partner" in allowed_roles:
+def verify_role(principal: Principal, allowed_roles: list):
+    if principal.has_role(*allowed_roles):
         return True
     raise HTTPException(
         status_code=status.HTTP_403_FORBIDDEN, 
@@ -125,7 +173,7 @@ def verify_role(user: User, allowed_roles: list):
     )
 
 def role_required(allowed_roles: list):
-    def role_verifier(user: User = Depends(get_current_user)):
-        verify_role(user, allowed_roles)
-        return user
+    async def role_verifier(principal: Principal = Depends(get_current_principal)):
+        verify_role(principal, allowed_roles)
+        return principal
     return role_verifier
@@ -0,0 +1,44 @@
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(created_at: datetime, id: int) -> str:
+    """
+    Opaque cursor pointing right after the (created_at, id) of the last item of a page.
+    """
+    raw = json.dumps([created_at.isoformat(), id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_page(query, created_at_column, id_column, cursor: str = None, size: int = 50):
+    """
+    Restrict a query to the page after the cursor, newest first. The seek on
+    (created_at, id) lets the database start right at the page, so every page
+    costs the same whatever its position. One extra row tells if there is a next page.
+    """
+    if cursor:
+        created_at, id = decode_cursor(cursor)
+        query = query.filter(or_(
+            created_at_column < created_at,
+            and_(created_at_column == created_at, id_column < id),
+        ))
+    return query.order_by(created_at_column.desc(), id_column.desc()).limit(size + 1)
+
+
+def cursor_page_response(rows: list, size: int, total: int = None) -> dict:
+    items = rows[:size]
+    next_cursor = encode_cursor(items[-1].created_at, items[-1].id) if len(rows) > size else None
+    return {"items": items, "next_cursor": next_cursor, "total": total}
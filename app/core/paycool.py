@@ -1,6 +1,6 @@
 import uuid
-import requests
 from app.configs.config import settings
+from app.core.http_client import http_clients
 
 def paycool(amount: float, client_phone: str, customer_name = settings.PROJECT_NAME) -> dict:
     url = settings.PAYCOOL_ENPOINT
@@ -16,5 +16,5 @@ def paycool(amount: float, client_phone: str, customer_name = settings.PROJECT_N
         "customer_lang": "fr"
     }
     headers = {"Content-Type": "application/json", "Accept": "application/json"}
-    response = requests.post(url, data=payload, headers=headers)
+    response = http_clients.request("paycool", "POST", url, data=payload, headers=headers)
     return response.json()
\ No newline at end of file
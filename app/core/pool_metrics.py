@@ -0,0 +1,110 @@
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+
+class PoolMetrics:
+    """
+    Connection pool counters for one engine.
+    Checkouts, checkins, new connections and invalidations are counted through the
+    pool events, the time spent waiting for a connection is measured by the pool
+    class returned by `pool_class`.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.engine = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.checkins = 0
+            self.connects = 0
+            self.invalidations = 0
+            self.timeouts = 0
+            self.wait_count = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+
+    def pool_class(self, base):
+        """
+        Return a subclass of the `base` pool class that records how long each
+        checkout waited. It is stored on the class (not the instance) so that it
+        survives `engine.dispose()`, which recreates the pool from its class.
+        """
+        metrics = self
+
+        class InstrumentedPool(base):
+            def connect(self):
+                started = time.perf_counter()
+                try:
+                    connection = super().connect()
+                except PoolTimeoutError:
+                    metrics.record_timeout(time.perf_counter() - started)
+                    raise
+                metrics.record_wait(time.perf_counter() - started)
+                return connection
+
+        InstrumentedPool.__name__ = f"Instrumented{base.__name__}"
+        return InstrumentedPool
+
+    def attach(self, engine):
+        """
+        Register the pool event listeners on a (sync) engine.
+        """
+        self.engine = engine
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+        event.listen(engine, "invalidate", self._on_invalidate)
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def record_timeout(self, seconds: float):
+        with self._lock:
+            self.timeouts += 1
+            self.wait_max = max(self.wait_max, seconds)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checkins += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def snapshot(self) -> dict:
+        pool = self.engine.pool if self.engine is not None else None
+        with self._lock:
+            return {
+                "name": self.name,
+                "pool_size": pool.size() if pool is not None else 0,
+                "checked_in": pool.checkedin() if pool is not None else 0,
+                "checked_out": pool.checkedout() if pool is not None else 0,
+                # QueuePool.overflow() counts from -pool_size, only the part above the pool size is overflow
+                "overflow": max(pool.overflow(), 0) if pool is not None else 0,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "wait_count": self.wait_count,
+                "wait_avg_ms": (self.wait_total / self.wait_count * 1000) if self.wait_count else 0.0,
+                "wait_max_ms": self.wait_max * 1000,
+            }
@@ -0,0 +1,61 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import FrozenSet, Optional
+
+
+@dataclass(frozen=True)
+class Principal:
+    """
+    What authorization needs to know about the authenticated user, without any ORM object.
+    """
+    id: int
+    phone_number: str
+    roles: FrozenSet[str]
+    wallet_id: Optional[int] = None
+
+    def has_role(self, *roles) -> bool:
+        return any(role in self.roles for role in roles)
+
+
+class PrincipalCache:
+    """
+    Process-local principals keyed by token subject (the phone number), least
+    recently used ones evicted past max_size. Entries are dropped explicitly when a
+    profile, PIN or role changes, the TTL bounds how long the other workers can
+    serve a stale one.
+    """
+
+    def __init__(self, ttl: int, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, subject: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(subject)
+            if entry is None:
+                return None
+            principal, loaded_at = entry
+            if time.monotonic() - loaded_at > self.ttl:
+                del self._entries[subject]
+                return None
+            self._entries.move_to_end(subject)
+            return principal
+
+    def set(self, subject: str, principal: Principal):
+        with self._lock:
+            self._entries[subject] = (principal, time.monotonic())
+            self._entries.move_to_end(subject)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, subject: str):
+        with self._lock:
+            self._entries.pop(subject, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,15 @@
+from types import MappingProxyType
+
+
+class RateSnapshot:
+    """
+    Immutable table of exchange rates keyed by (from_currency, to_currency).
+    A snapshot is never modified after creation, readers can keep using the one
+    they hold while a newer one is swapped in.
+    """
+
+    def __init__(self, rows):
+        self.rates = MappingProxyType({(from_currency, to_currency): rate for from_currency, to_currency, rate in rows})
+
+    def get(self, from_currency: str, to_currency: str):
+        return self.rates.get((from_currency, to_currency))
@@ -1,21 +1,27 @@
-import requests
 from app.configs.config import settings
+from app.core.http_client import http_clients
 
-def sendsms(to: str, message: str) -> str:
-    sender = settings.SMS_SENDER
-    url = settings.SMS_ENDPOINT
-    payload = {
+SMS_HEADERS = {"Content-Type": "application/x-www-form-urlencoded;charset=utf-8"}
+
+def sms_payload(to: str, message: str) -> dict:
+    return {
         "api_key": settings.SMS_API_KEY,
         "password": settings.SMS_PASSWORD,
-        "sender": sender,
+        "sender": settings.SMS_SENDER,
         "message": message,
         "phone": to,
         "flag": "short_sms"
     }
-    
-    headers = {"Content-Type": "application/x-www-form-urlencoded;charset=utf-8"}
 
-    response = requests.post(url, data=payload, headers=headers)
-    
+def sendsms(to: str, message: str) -> str:
+    """
+    Send an SMS synchronously. The API handlers go through the notification queue
+    (app.services.notifications.enqueue_sms) instead.
+    """
+    url = settings.SMS_ENDPOINT
+    payload = sms_payload(to, message)
+
+    response = http_clients.request("sms", "POST", url, data=payload, headers=SMS_HEADERS)
+
     result = response.json()
-    return result.get("status") == "success"
\ No newline at end of file
+    return result.get("status") == "success"
@@ -0,0 +1,41 @@
+import time
+from typing import Any, Awaitable, Callable
+
+
+class SnapshotCache:
+    """
+    Process-local snapshot of a small table that barely changes (exchange rates, fee grid).
+    `load(db)` reads the rows, `build(rows)` turns them into an immutable snapshot:
+    readers keep using the one they hold while a newer one is swapped in. The worker that
+    changes the table swaps the new snapshot in right away, the TTL only matters for the
+    other workers, which pick the change up on expiry.
+    """
+
+    def __init__(self, build: Callable[[Any], Any], load: Callable[[Any], Awaitable[Any]], ttl: int):
+        self.build = build
+        self.load = load
+        self.ttl = ttl
+        self._entry = None
+
+    @property
+    def snapshot(self):
+        entry = self._entry
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            return None
+        return entry[0]
+
+    def swap(self, rows):
+        # Building the snapshot first and assigning it in one step keeps the swap atomic
+        snapshot = self.build(rows)
+        self._entry = (snapshot, time.monotonic())
+        return snapshot
+
+    async def reload(self, db):
+        return self.swap(await self.load(db))
+
+    async def get(self, db):
+        # The database is only queried when the snapshot is missing or expired
+        return self.snapshot or await self.reload(db)
+
+    def invalidate(self):
+        self._entry = None
@@ -0,0 +1,40 @@
+from bisect import bisect_right
+from decimal import Decimal
+from types import MappingProxyType
+
+
+class TariffIndex:
+    """
+    Immutable fee grid: for each (transaction_type, currency) the bands sorted by
+    min_amount, so the band of an amount is found by bisection in O(log n).
+    Bands are not expected to overlap, if they do the one starting last wins.
+    """
+
+    def __init__(self, rows):
+        bands = {}
+        for transaction_type, currency, min_amount, max_amount, fee in rows:
+            bands.setdefault((transaction_type, currency), []).append((min_amount, max_amount, fee))
+
+        grid = {}
+        for key, key_bands in bands.items():
+            key_bands.sort(key=lambda band: band[0])
+            # parallel tuples: bisect runs on the lower bounds only
+            grid[key] = (
+                tuple(band[0] for band in key_bands),
+                tuple(band[1] for band in key_bands),
+                tuple(band[2] for band in key_bands),
+            )
+        self.grid = MappingProxyType(grid)
+
+    def fee(self, transaction_type: str, currency: str, amount: Decimal):
+        """
+        Fee of the band containing `amount` (bounds included), None when no band does.
+        """
+        bands = self.grid.get((transaction_type, currency))
+        if bands is None:
+            return None
+        min_amounts, max_amounts, fees = bands
+        position = bisect_right(min_amounts, amount) - 1
+        if position < 0 or amount > max_amounts[position]:
+            return None
+        return fees[position]
@@ -1,82 +1,202 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
 
-from app.core.utils import currency_rate_converter
-from app.models.user_model import CurrencyRate
+from sqlalchemy import func, insert as sql_insert, select, text
+from sqlalchemy.dialects.mysql import insert
 from sqlalchemy.orm import Session
-from datetime import datetime
-
-def update_currency_rates(db: Session):
-
-    supported_currencies = ["USD", "EUR", "XAF"]
-    # rate for 1 USD to 1 EUR
-
-    for currency in supported_currencies:
-        # currency to euro
-        if currency == "USD":
-            euro_rate = currency_rate_converter(currency, "EUR")
-            xaf_rate = currency_rate_converter(currency, "XAF")
-            currency_rate = db.query(CurrencyRate).filter(CurrencyRate.from_currency == currency, CurrencyRate.to_currency=="EUR").first()
-            
-            if currency_rate:
-                currency_rate.rate = euro_rate
-                currency_rate.updated_at = datetime.now()
-                db.commit()
-            else:
-                currency_rate = CurrencyRate(from_currency=currency, to_currency="EUR", rate=euro_rate)
-                db.add(currency_rate)
-                db.commit()
-            currency_rate = db.query(CurrencyRate).filter(CurrencyRate.from_currency == currency, CurrencyRate.to_currency=="XAF").first()
-            if currency_rate:
-                currency_rate.rate = xaf_rate
-                currency_rate.updated_at = datetime.now()
-
-                db.commit()
-            else:
-                currency_rate = CurrencyRate(from_currency=currency, to_currency="XAF", rate=xaf_rate)
-                db.add(currency_rate)
-                db.commit()
-        elif currency == "EUR":
-            usd_rate = currency_rate_converter(currency, "USD")
-            xaf_rate = currency_rate_converter(currency, "XAF")
-            currency_rate = db.query(CurrencyRate).filter(CurrencyRate.from_currency == currency, CurrencyRate.to_currency=="USD").first()
-            
-            if currency_rate:
-                currency_rate.rate = usd_rate
-                currency_rate.updated_at = datetime.now()
-                db.commit()
-            else:
-                currency_rate = CurrencyRate(from_currency=currency, to_currency="USD", rate=usd_rate)
-                db.add(currency_rate)
-                db.commit()
-            currency_rate = db.query(CurrencyRate).filter(CurrencyRate.from_currency == currency, CurrencyRate.to_currency=="XAF").first()
-            if currency_rate:
-                currency_rate.rate = xaf_rate
-                currency_rate.updated_at = datetime.now()
-                db.commit()
-            else:
-                currency_rate = CurrencyRate(from_currency=currency, to_currency="XAF", rate=xaf_rate)
-                db.add(currency_rate)
-                db.commit()
-        else :
-            euro_rate = currency_rate_converter(currency, "USD")
-            euro_rate = currency_rate_converter(currency, "EUR")
-            currency_rate = db.query(CurrencyRate).filter(CurrencyRate.from_currency == currency, CurrencyRate.to_currency=="USD").first()
-            
-            if currency_rate:
-                currency_rate.rate = euro_rate
-                currency_rate.updated_at = datetime.now()
-                db.commit()
-            else:
-                currency_rate = CurrencyRate(from_currency=currency, to_currency="USD", rate=euro_rate)
-                db.add(currency_rate)
-                db.commit()
-                
-            currency_rate = db.query(CurrencyRate).filter(CurrencyRate.from_currency == currency, CurrencyRate.to_currency=="EUR").first()
-            
-            if currency_rate:
-                currency_rate.rate = euro_rate
-                currency_rate.updated_at = datetime.now()
-                db.commit()
-            else:
-                currency_rate = CurrencyRate(from_currency=currency, to_currency="EUR", rate=euro_rate)
-                db.add(currency_rate)
-                db.commit()
\ No newline at end of file
+
+from app.configs.config import settings
+from app.configs.database import SessionLocal
+from app.core.money import quantize_rate, to_decimal
+from app.core.utils import currency_rate_converter
+from app.models.ledger_model import BalanceCheckpoint, LedgerEntry, latest_checkpoints_query
+from app.models.user_model import CurrencyRate, currency_rate_cache, currency_rates_query
+
+logger = logging.getLogger(__name__)
+
+
+def with_session(job):
+    """
+    Run a scheduler job with its own database session, closed once the job is done.
+    """
+    def run(*args, **kwargs):
+        db = SessionLocal()
+        try:
+            return job(db, *args, **kwargs)
+        finally:
+            db.close()
+    run.__name__ = job.__name__
+    return run
+
+
+def fetch_base_rates(base_currency: str, currencies: list) -> dict:
+    """
+    Fetch the rate from the base currency to every other currency, concurrently.
+    Currencies whose rate cannot be fetched are left out.
+    """
+    targets = [currency for currency in currencies if currency != base_currency]
+    rates = {base_currency: Decimal(1)}
+
+    with ThreadPoolExecutor(max_workers=max(len(targets), 1)) as executor:
+        futures = {currency: executor.submit(currency_rate_converter, base_currency, currency) for currency in targets}
+
+    for currency, future in futures.items():
+        try:
+            rates[currency] = to_decimal(future.result())
+        except Exception as e:
+            logger.error(f"Could not fetch the {base_currency} to {currency} rate: {e}")
+    return rates
+
+
+def build_rate_matrix(base_rates: dict) -> list:
+    """
+    Derive every (from, to) pair from the base currency rates:
+    rate(from -> to) = rate(base -> to) / rate(base -> from).
+    """
+    return [
+        (from_currency, to_currency, quantize_rate(to_rate / from_rate))
+        for from_currency, from_rate in base_rates.items()
+        for to_currency, to_rate in base_rates.items()
+        if from_currency != to_currency
+    ]
+
+
+def update_currency_rates(db: Session, currencies: list = None, base_currency: str = None):
+    currencies = currencies or settings.SUPPORTED_CURRENCIES
+    base_currency = base_currency or settings.CURRENCY_RATES_BASE_CURRENCY
+
+    # N - 1 provider calls whatever the number of currencies, the matrix is derived from them
+    rows = build_rate_matrix(fetch_base_rates(base_currency, currencies))
+    if not rows:
+        logger.warning("No currency rate could be fetched, keeping the current rates")
+        return
+
+    now = datetime.utcnow()
+    stmt = insert(CurrencyRate).values([
+        {"from_currency": from_currency, "to_currency": to_currency, "rate": rate, "created_at": now, "updated_at": now}
+        for from_currency, to_currency, rate in rows
+    ])
+    stmt = stmt.on_duplicate_key_update(rate=stmt.inserted.rate, updated_at=stmt.inserted.updated_at)
+
+    # All the pairs are written in a single statement and a single transaction
+    try:
+        db.execute(stmt)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    # Swap the new rates into this worker's cache right away. The snapshot is reloaded
+    # from the table: pairs whose fetch failed keep their previous rate there
+    currency_rate_cache.swap(db.execute(currency_rates_query()).all())
+    logger.info(f"Updated {len(rows)} currency rates")
+
+
+def _delete_in_batches(db: Session, stmt, params: dict, batch_size: int) -> int:
+    """
+    Run a DELETE ... LIMIT :batch_size until it deletes less than a batch, one transaction
+    per batch so a purge never holds the locks of a big delete.
+    """
+    deleted = 0
+    while True:
+        try:
+            count = db.execute(stmt, {**params, "batch_size": batch_size}).rowcount
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+
+def purge_expired_sessions(db: Session, batch_size: int = None) -> int:
+    """
+    Delete the expired USSD sessions, batch_size rows per statement and per transaction
+    so the purge never holds the locks of a big delete while dials keep coming in.
+    """
+    batch_size = batch_size or settings.USSD_SESSION_SWEEP_BATCH
+    # DELETE ... LIMIT is MySQL specific and not expressible with this SQLAlchemy version,
+    # the rows walked come from the expiration index
+    stmt = text("DELETE FROM sessions WHERE expiration <= :now LIMIT :batch_size")
+    # Same clock as create_session/get_session, fixed so the loop ends even while sessions keep expiring
+    deleted = _delete_in_batches(db, stmt, {"now": datetime.now()}, batch_size)
+
+    if deleted:
+        logger.info(f"Purged {deleted} expired USSD sessions")
+    return deleted
+
+
+def purge_idempotency_keys(db: Session, ttl: int = None, batch_size: int = 1000) -> int:
+    """
+    Delete the Idempotency-Keys older than the TTL, a retry after that runs as a new request.
+    """
+    ttl = settings.IDEMPOTENCY_KEY_TTL if ttl is None else ttl
+    # created_at is set by the database, so is the cutoff
+    cutoff = db.scalar(select(func.now())) - timedelta(seconds=ttl)
+    stmt = text("DELETE FROM idempotency_keys WHERE created_at <= :cutoff LIMIT :batch_size")
+    deleted = _delete_in_batches(db, stmt, {"cutoff": cutoff}, batch_size)
+
+    if deleted:
+        logger.info(f"Purged {deleted} expired idempotency keys")
+    return deleted
+
+
+def purge_outbox(db: Session, retention: int = None, batch_size: int = 1000) -> int:
+    """
+    Delete the outbox messages relayed more than `retention` seconds ago, failed ones are kept.
+    """
+    retention = settings.OUTBOX_RETENTION if retention is None else retention
+    # sent_at comes from the relay's clock (utc)
+    cutoff = datetime.utcnow() - timedelta(seconds=retention)
+    stmt = text("DELETE FROM outbox_messages WHERE status = 'sent' AND sent_at <= :cutoff LIMIT :batch_size")
+    deleted = _delete_in_batches(db, stmt, {"cutoff": cutoff}, batch_size)
+
+    if deleted:
+        logger.info(f"Purged {deleted} relayed outbox messages")
+    return deleted
+
+
+def checkpoint_balances(db: Session, lag: int = None, batch_size: int = 1000) -> int:
+    """
+    Checkpoint the balance of every wallet with ledger entries since the previous run,
+    from its previous checkpoint plus those entries only.
+    """
+    lag = settings.LEDGER_CHECKPOINT_LAG if lag is None else lag
+
+    # Ids are allocated before the commit: entries younger than the lag are left for the
+    # next run, a transaction still open with a lower id could commit after this one
+    cutoff = db.scalar(select(func.now())) - timedelta(seconds=lag)
+    watermark = db.scalar(select(func.max(LedgerEntry.id)).filter(LedgerEntry.created_at <= cutoff))
+    previous = db.scalar(select(func.max(BalanceCheckpoint.last_entry_id))) or 0
+    if watermark is None or watermark <= previous:
+        return 0
+
+    changes = db.execute(
+        select(LedgerEntry.wallet_id, func.sum(LedgerEntry.amount))
+        .filter(LedgerEntry.wallet_id.is_not(None), LedgerEntry.id > previous, LedgerEntry.id <= watermark)
+        .group_by(LedgerEntry.wallet_id)
+    ).all()
+
+    checkpointed = 0
+    try:
+        for start in range(0, len(changes), batch_size):
+            batch = dict(changes[start:start + batch_size])
+            balances = {
+                wallet_id: balance
+                for wallet_id, _, balance in db.execute(latest_checkpoints_query(list(batch))).all()
+            }
+            db.execute(sql_insert(BalanceCheckpoint), [
+                {"wallet_id": wallet_id, "last_entry_id": watermark, "balance": balances.get(wallet_id, Decimal(0)) + amount}
+                for wallet_id, amount in batch.items()
+            ])
+            checkpointed += len(batch)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    logger.info(f"Checkpointed {checkpointed} wallet balances up to ledger entry {watermark}")
+    return checkpointed
@@ -0,0 +1,176 @@
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidInput(Exception):
+    """
+    Raised by a validator: the text `text_key` is shown, then the prompt of the state again.
+    """
+
+    def __init__(self, text_key: str):
+        super().__init__(text_key)
+        self.text_key = text_key
+
+
+@dataclass(frozen=True)
+class Reply:
+    message: str
+    end: bool = False
+
+
+@dataclass(frozen=True)
+class Option:
+    label: str  # text key
+    next: str
+
+
+@dataclass(frozen=True)
+class State:
+    """
+    One screen of a USSD flow, either a menu (`options`) or an input.
+    A valid input is stored under `store_as` in the session data, then the flow goes to
+    `next`, or `action` is run and its reply ends the session. `loads` names what
+    the state needs loaded before it runs (see UssdMachine loaders).
+    """
+    name: str
+    prompt: str  # text key
+    options: Dict[str, Option] = field(default_factory=dict)
+    store_as: Optional[str] = None
+    validate: Optional[Callable[[str], Any]] = None
+    next: Optional[str] = None
+    action: Optional[Callable[["HopContext"], Awaitable[Reply]]] = None
+    loads: Tuple[str, ...] = ()
+
+
+@dataclass
+class HopContext:
+    machine: "UssdMachine"
+    db: Any
+    msisdn: str
+    lang: str
+    data: dict
+    loaded: dict = field(default_factory=dict)
+
+    def text(self, key: str, **kwargs) -> str:
+        return self.machine.text(self.lang, key, **kwargs)
+
+    def __getattr__(self, name):
+        # ctx.user etc. for what the state declared in `loads`
+        try:
+            return self.__dict__["loaded"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class UssdMachine:
+    """
+    Table-driven USSD flow. The states are checked and compiled once, at import time:
+    a dict gives the state of a hop in O(1) and every prompt, menus included, is
+    rendered beforehand for every language.
+    """
+
+    def __init__(self, states, texts: Dict[str, Dict[str, str]], entry, entry_loads=(), loaders=None,
+                 default_language: str = "fr"):
+        self.states = {state.name: state for state in states}
+        self.texts = texts
+        self.entry = entry
+        self.entry_loads = tuple(entry_loads)
+        self.loaders = loaders or {}
+        self.default_language = default_language
+        self._check()
+        self.prompts = {
+            (state.name, lang): self._render(state, lang)
+            for state in self.states.values()
+            for lang in texts
+        }
+
+    def _check(self):
+        for state in self.states.values():
+            targets = [option.next for option in state.options.values()]
+            if state.next:
+                targets.append(state.next)
+            for target in targets:
+                if target not in self.states:
+                    raise ValueError(f"USSD state {state.name} leads to unknown state {target}")
+            if not state.options and not state.next and not state.action:
+                raise ValueError(f"USSD state {state.name} has no way out")
+            for name in state.loads:
+                if name not in self.loaders:
+                    raise ValueError(f"USSD state {state.name} loads unknown {name}")
+            keys = [state.prompt] + [option.label for option in state.options.values()]
+            for lang, texts in self.texts.items():
+                for key in keys:
+                    if key not in texts:
+                        raise ValueError(f"USSD text {key} missing in {lang}")
+
+    def _render(self, state: State, lang: str) -> str:
+        lines = [self.texts[lang][state.prompt]]
+        lines += [f"{choice}-{self.texts[lang][option.label]}" for choice, option in state.options.items()]
+        return "\n".join(lines)
+
+    def text(self, lang: str, key: str, **kwargs) -> str:
+        text = self.texts.get(lang, self.texts[self.default_language])[key]
+        return text.format(**kwargs) if kwargs else text
+
+    def prompt(self, state_name: str, lang: str) -> str:
+        return self.prompts.get((state_name, lang)) or self.prompts[(state_name, self.default_language)]
+
+    async def _context(self, db, msisdn: str, lang: str, data: dict, loads) -> HopContext:
+        context = HopContext(self, db, msisdn, lang, data)
+        for name in loads:
+            context.loaded[name] = await self.loaders[name](db, msisdn)
+        return context
+
+    async def handle(self, store, db, session_id: str, msisdn: str, user_input: str) -> Reply:
+        session = await store.get(session_id)
+
+        if session is None:
+            context = await self._context(db, msisdn, self.default_language, {"phone_number": msisdn}, self.entry_loads)
+            state_name, context.lang = await self.entry(context)
+            context.data["lang"] = context.lang
+            await store.create(session_id, state_name, context.data)
+            return Reply(self.prompt(state_name, context.lang))
+
+        state = self.states.get(session.state)
+        lang = session.data.get("lang", self.default_language)
+        if state is None:
+            await store.delete(session_id)
+            return Reply(self.text(lang, "error"), end=True)
+
+        if state.options:
+            option = state.options.get(user_input.strip())
+            if option is None:
+                return Reply(f"{self.text(lang, 'invalid_option')}\n{self.prompt(state.name, lang)}")
+            next_state = option.next
+            data = session.data
+        else:
+            try:
+                value = state.validate(user_input.strip()) if state.validate else user_input.strip()
+            except InvalidInput as e:
+                return Reply(f"{self.text(lang, e.text_key)}\n{self.prompt(state.name, lang)}")
+            data = dict(session.data)
+            if state.store_as:
+                data[state.store_as] = value
+
+            if state.action:
+                # Deleting the session claims the action: a retried or concurrent hop on the
+                # same session finds it gone and never runs the action a second time
+                if not await store.delete(session_id, state.name):
+                    return Reply(self.text(lang, "session_expired"), end=True)
+                context = await self._context(db, msisdn, lang, data, state.loads)
+                try:
+                    reply = await state.action(context)
+                except Exception:
+                    logger.exception("USSD action of state %s failed", state.name)
+                    return Reply(self.text(lang, "error"), end=True)
+                return Reply(reply.message, end=True)
+            next_state = state.next
+
+        # Only moves on from the state this hop read, a concurrent hop or an expiry wins otherwise
+        if not await store.transition(session_id, state.name, next_state, data):
+            await store.delete(session_id)
+            return Reply(self.text(lang, "session_expired"), end=True)
+        return Reply(self.prompt(next_state, lang))
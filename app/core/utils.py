@@ -1,9 +1,22 @@
+import hmac
+import hashlib
 import random
+from decimal import Decimal
 from passlib.context import CryptContext
-from PyCurrency_Converter import convert
+from bs4 import BeautifulSoup
 from requests.exceptions import JSONDecodeError
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app.configs.config import settings
+from app.core.http_client import http_clients
+
+# Hashes made with another cost factor are flagged by verify_and_update and rehashed on login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.BCRYPT_ROUNDS,
+)
 # oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 def secure_pwd(raw_password):
@@ -21,21 +34,43 @@ def generate_pin_code():
 def generate_merchant_code():
     return str(random.randint(100000, 999999))
 
+def hash_merchant_code(merchant_code) -> str:
+    """
+    Keyed HMAC-SHA256 digest of a merchant code. Unlike bcrypt it is deterministic,
+    so it can be stored in an indexed column and looked up directly; the server-side
+    pepper keeps the short codes from being brute-forced out of a database dump.
+    """
+    return hmac.new(settings.MERCHANT_CODE_PEPPER.encode(), str(merchant_code).encode(), hashlib.sha256).hexdigest()
+
+def fetch_converted_amount(from_currency, to_currency, amount=1) -> Decimal:
+    """
+    Ask the currency provider to convert the amount, over the shared "currency" client
+    so the call is pooled and bounded by the HTTP timeouts.
+    """
+    response = http_clients.request(
+        "currency", "GET", settings.CURRENCY_CONVERTER_ENDPOINT,
+        params={"a": amount, "from": from_currency, "to": to_currency},
+    )
+    response.raise_for_status()
+    # the converter page holds the result in <span class="bld">, e.g. "655.96 XAF"
+    result = BeautifulSoup(response.text, "html.parser").find("span", attrs={"class": "bld"})
+    return Decimal(result.text.split()[0])
+
 def currency_rate_converter(from_currency, to_currency, amount=1):
     """
     Convert currency with fallback to default rates if API fails.
     """
     fallback_rates = {
-        ("USD", "EUR"): 0.95,
-        ("USD", "XAF"): 623.44,
-        ("EUR", "USD"): 1.05,
-        ("EUR", "XAF"): 656.32,
-        ("XAF", "USD"): 0.0016,
-        ("XAF", "EUR"): 0.0015,
+        ("USD", "EUR"): Decimal("0.95"),
+        ("USD", "XAF"): Decimal("623.44"),
+        ("EUR", "USD"): Decimal("1.05"),
+        ("EUR", "XAF"): Decimal("656.32"),
+        ("XAF", "USD"): Decimal("0.0016"),
+        ("XAF", "EUR"): Decimal("0.0015"),
     }
 
     try:
-        converted_amount = convert(amount, from_currency, to_currency)
+        converted_amount = fetch_converted_amount(from_currency, to_currency, amount)
         print(f"Converted {amount} {from_currency} to {converted_amount} {to_currency}")
         return converted_amount
     except Exception as e:
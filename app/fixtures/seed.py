@@ -3,7 +3,9 @@ from faker import Faker
 from sqlalchemy.orm import Session
 from app.models.user_model import CurrencyRate, User, Wallet, CurrencyRate
 from app.models.roles_model import Merchant, Partner, Client, Admin
-from app.core.utils import secure_pwd, generate_pin_code, generate_merchant_code
+from app.models.ledger_model import opening_entries
+from app.core.money import quantize
+from app.core.utils import secure_pwd, generate_pin_code, generate_merchant_code, hash_merchant_code
 
 faker = Faker()
 
@@ -61,8 +63,10 @@ def _seed_user(db: Session, count: int = 10, default_pin: str = "14982", default
         currency = "EUR"
 
 
-    wallet = Wallet(owner_id=user.id, balance=random.uniform(0, 1000), currency=currency)
+    wallet = Wallet(owner_id=user.id, balance=quantize(random.uniform(0, 1000), currency), currency=currency)
     db.add(wallet)
+    db.flush()
+    db.add_all(opening_entries(wallet))
 
     admin = Admin(owner_id=user.id)
     db.add(admin)
@@ -108,8 +112,10 @@ def _seed_user(db: Session, count: int = 10, default_pin: str = "14982", default
             currency = "EUR"
 
 
-        wallet = Wallet(owner_id=user.id, balance=random.uniform(0, 1000), currency=currency)
+        wallet = Wallet(owner_id=user.id, balance=quantize(random.uniform(0, 1000), currency), currency=currency)
         db.add(wallet)
+        db.flush()
+        db.add_all(opening_entries(wallet))
 
         if fake_role == "client":
             client = Client(owner_id=user.id, registered_by=None)
@@ -126,7 +132,7 @@ def _seed_user(db: Session, count: int = 10, default_pin: str = "14982", default
             while db.query(Merchant).filter(Merchant.business_name == business_name).first():
                 business_name = faker.company()
 
-            merchant = Merchant(owner_id=user.id, business_name=business_name, merchant_code=generate_merchant_code(), phone_number=_generate_phone_number(), email=merchant_email, registered_by=None)
+            merchant = Merchant(owner_id=user.id, business_name=business_name, merchant_code_digest=hash_merchant_code(generate_merchant_code()), phone_number=_generate_phone_number(), email=merchant_email, registered_by=None)
             db.add(merchant)
             db.commit()
         elif fake_role == "partner":
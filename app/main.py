@@ -1,3 +1,4 @@
+import logging
 from typing import Union
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
@@ -5,15 +6,26 @@ from starlette.middleware.base import BaseHTTPMiddleware
 from fastapi.staticfiles import StaticFiles
 
 from app.configs.config import settings, babel, babel_configs
-from app.configs.database import Base, engine, SessionLocal
-from app.routers import auth, account, transaction, merchant, recharge, ussd, webhook
+from app.configs.database import Base, engine, SessionLocal, async_engine, AsyncSessionLocal
+from app.routers import auth, account, transaction, merchant, recharge, ussd, webhook, metrics, analytics
 from fastapi_pagination import add_pagination
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
-from app.core.tasks import update_currency_rates
+from apscheduler.triggers.interval import IntervalTrigger
+from app.core.tasks import update_currency_rates, purge_expired_sessions, purge_idempotency_keys, purge_outbox, checkpoint_balances, with_session
+from app.models.user_model import load_currency_rates
+from app.models.tarif_model import load_tariffs
+from app.services.notifications import sms_queue
+from app.services.stripe_events import stripe_event_processor
+from app.services.outbox import outbox_relay
+from app.services.analytics import snapshot_transactions
+from app.core.http_client import http_clients
+from app.services.ussd_sessions import ussd_session_store
 
 from fastapi_babel import BabelMiddleware, _
 
+logger = logging.getLogger(__name__)
+
 scheduler = BackgroundScheduler()
 
 class LocaleMiddleware(BaseHTTPMiddleware):
@@ -65,16 +77,69 @@ async def connect():
     # )
 
     scheduler.add_job(
-        func=update_currency_rates,
+        func=with_session(update_currency_rates),
         trigger=CronTrigger(hour=6, minute=0),  # Every day at 6:00 AM
-        args=[SessionLocal()]
+    )
+
+    scheduler.add_job(
+        func=with_session(purge_expired_sessions),
+        trigger=IntervalTrigger(seconds=settings.USSD_SESSION_SWEEP_INTERVAL),
+        coalesce=True,
+    )
+
+    scheduler.add_job(
+        func=with_session(purge_idempotency_keys),
+        trigger=IntervalTrigger(hours=1),
+        coalesce=True,
+    )
+
+    scheduler.add_job(
+        func=with_session(purge_outbox),
+        trigger=IntervalTrigger(hours=1),
+        coalesce=True,
+    )
+
+    scheduler.add_job(
+        func=with_session(checkpoint_balances),
+        trigger=IntervalTrigger(seconds=settings.LEDGER_CHECKPOINT_INTERVAL),
+        coalesce=True,
+    )
+
+    scheduler.add_job(
+        func=with_session(snapshot_transactions),
+        trigger=IntervalTrigger(seconds=settings.ANALYTICS_SNAPSHOT_INTERVAL),
+        coalesce=True,
     )
 
     scheduler.start()
 
+    await sms_queue.start()
+    await outbox_relay.start()
+    await stripe_event_processor.start()
+
+    # Warm the exchange rate cache, convert_currency falls back to the database if this fails
+    try:
+        async with AsyncSessionLocal() as db:
+            await load_currency_rates(db)
+    except Exception as e:
+        logger.warning(f"Could not preload the currency rates: {e}")
+
+    # Same for the fee grid, compute_fee loads it on first use otherwise
+    try:
+        async with AsyncSessionLocal() as db:
+            await load_tariffs(db)
+    except Exception as e:
+        logger.warning(f"Could not preload the tariffs: {e}")
+
 @app.on_event("shutdown")
 async def shutdown():
     scheduler.shutdown()
+    await stripe_event_processor.stop()
+    await outbox_relay.stop()
+    await sms_queue.stop()
+    await http_clients.aclose()
+    await ussd_session_store.close()
+    await async_engine.dispose()
 
 app.include_router(auth.router)
 app.include_router(account.router)
@@ -83,3 +148,5 @@ app.include_router(transaction.router)
 app.include_router(recharge.router)
 app.include_router(ussd.router)
 app.include_router(webhook.router)
+app.include_router(metrics.router)
+app.include_router(analytics.router)
@@ -10,6 +10,11 @@ from app.models.roles_model import Merchant, Client, Admin, Partner
 from app.models.session_model import Session
 from app.models.tarif_model import Tariff
 from app.models.transaction_model import Transaction
+from app.models.ledger_model import LedgerEntry, BalanceCheckpoint
+from app.models.idempotency_model import IdempotencyKey
+from app.models.stripe_event_model import StripeEvent
+from app.models.outbox_model import OutboxMessage
+from app.models.statement_model import WalletDailyStat
 
 from alembic import context
 
@@ -0,0 +1,48 @@
+"""add merchant code digest
+
+Revision ID: 7c1f9e2a4d6b
+Revises: 53e67a78a05a
+Create Date: 2026-10-18 14:05:12.418203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.core.utils import hash_merchant_code
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c1f9e2a4d6b'
+down_revision: Union[str, None] = '53e67a78a05a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('merchants', sa.Column('merchant_code_digest', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_merchants_merchant_code_digest'), 'merchants', ['merchant_code_digest'], unique=True)
+    op.alter_column('merchants', 'merchant_code', existing_type=sa.String(length=255), nullable=True)
+
+    # Codes stored in clear are converted right away, bcrypt hashes are replaced
+    # by get_merchant_by_code on their first successful verification
+    merchants = sa.table('merchants', sa.column('id', sa.Integer), sa.column('merchant_code', sa.String),
+                         sa.column('merchant_code_digest', sa.String))
+    connection = op.get_bind()
+    rows = connection.execute(sa.select(merchants.c.id, merchants.c.merchant_code)).fetchall()
+    for merchant_id, merchant_code in rows:
+        if merchant_code and not merchant_code.startswith("$2"):
+            connection.execute(
+                merchants.update()
+                .where(merchants.c.id == merchant_id)
+                .values(merchant_code_digest=hash_merchant_code(merchant_code), merchant_code=None)
+            )
+
+
+def downgrade() -> None:
+    # Digests cannot be reversed: those merchants need a new code after a downgrade
+    op.execute("UPDATE merchants SET merchant_code = CONCAT('reset-', id) WHERE merchant_code IS NULL")
+    op.alter_column('merchants', 'merchant_code', existing_type=sa.String(length=255), nullable=False)
+    op.drop_index(op.f('ix_merchants_merchant_code_digest'), table_name='merchants')
+    op.drop_column('merchants', 'merchant_code_digest')
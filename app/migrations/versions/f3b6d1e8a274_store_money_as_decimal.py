@@ -0,0 +1,62 @@
+"""store money as decimal
+
+Revision ID: f3b6d1e8a274
+Revises: e2a9c7d5b318
+Create Date: 2026-10-18 18:20:13.774529
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b6d1e8a274'
+down_revision: Union[str, None] = 'e2a9c7d5b318'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONEY_COLUMNS = [
+    ('transactions', 'amount', False),
+    ('transactions', 'fees', False),
+    ('tariffs', 'min_amount', False),
+    ('tariffs', 'max_amount', False),
+    ('tariffs', 'fee', False),
+    ('ledger_entries', 'amount', False),
+    ('balance_checkpoints', 'balance', False),
+]
+
+
+def upgrade() -> None:
+    # MySQL rounds the stored floats to the new scale while converting the columns
+    op.execute("UPDATE wallets SET balance = 0 WHERE balance IS NULL")
+    op.alter_column('wallets', 'balance',
+               existing_type=sa.Float(),
+               type_=sa.Numeric(precision=18, scale=2),
+               nullable=False)
+    for table, column, nullable in MONEY_COLUMNS:
+        op.alter_column(table, column,
+                   existing_type=sa.Float(),
+                   type_=sa.Numeric(precision=18, scale=2),
+                   existing_nullable=nullable)
+    op.alter_column('currency_rates', 'rate',
+               existing_type=sa.Float(),
+               type_=sa.Numeric(precision=18, scale=8),
+               existing_nullable=False)
+
+
+def downgrade() -> None:
+    op.alter_column('currency_rates', 'rate',
+               existing_type=sa.Numeric(precision=18, scale=8),
+               type_=sa.Float(),
+               existing_nullable=False)
+    for table, column, nullable in MONEY_COLUMNS:
+        op.alter_column(table, column,
+                   existing_type=sa.Numeric(precision=18, scale=2),
+                   type_=sa.Float(),
+                   existing_nullable=nullable)
+    op.alter_column('wallets', 'balance',
+               existing_type=sa.Numeric(precision=18, scale=2),
+               type_=sa.Float(),
+               nullable=True)
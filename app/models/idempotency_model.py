@@ -0,0 +1,94 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, UniqueConstraint, select, update, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession as Db_session
+from sqlalchemy.sql import func
+
+from app.configs.database import Base
+
+
+class IdempotencyKey(Base):
+    """
+    A request made with an Idempotency-Key header. The row is inserted before the
+    request runs (status_code null), the unique index makes a single worker own a key;
+    the response is stored by the transaction of the payment itself. claimed_at
+    identifies the claim: a pending key whose request died is taken over by a retry,
+    and the request it was taken from can no longer complete nor release it.
+    """
+    __tablename__ = "idempotency_keys"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"), nullable=False)
+    key = Column(String(255), nullable=False)
+    endpoint = Column(String(64), nullable=False)
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=True)
+    response = Column(Text, nullable=True)
+    claimed_at = Column(DateTime, nullable=True)  # utc, by the worker running the request
+    created_at = Column(DateTime, server_default=func.now(), index=True)
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'key', name='uq_idempotency_keys_user_id_key'),
+    )
+
+
+async def get_idempotency_key(db: Db_session, user_id: int, key: str):
+    result = await db.execute(select(IdempotencyKey).filter(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key))
+    return result.scalars().first()
+
+async def claim_idempotency_key(db: Db_session, user_id: int, key: str, endpoint: str, request_hash: str) -> Optional[datetime]:
+    """
+    Take the key for this request, returns the claim (its claimed_at) or None when another request already holds it.
+    """
+    claimed_at = _claim_time()
+    db.add(IdempotencyKey(user_id=user_id, key=key, endpoint=endpoint, request_hash=request_hash, claimed_at=claimed_at))
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        return None
+    return claimed_at
+
+async def take_over_idempotency_key(db: Db_session, user_id: int, key: str, previous_claimed_at: Optional[datetime]) -> Optional[datetime]:
+    """
+    Take a pending key over from the request that claimed it at previous_claimed_at, None if it moved on meanwhile.
+    """
+    claimed_at = _claim_time()
+    result = await db.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key, IdempotencyKey.status_code.is_(None),
+               _held_by(previous_claimed_at))
+        .values(claimed_at=claimed_at)
+    )
+    await db.commit()
+    return claimed_at if result.rowcount == 1 else None
+
+async def complete_idempotency_key(db: Db_session, user_id: int, key: str, claimed_at: datetime, status_code: int, response: str) -> bool:
+    """
+    Store the response in the caller's transaction, False if the claim was taken over.
+    """
+    result = await db.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key, IdempotencyKey.status_code.is_(None),
+               _held_by(claimed_at))
+        .values(status_code=status_code, response=response)
+    )
+    return result.rowcount == 1
+
+async def release_idempotency_key(db: Db_session, user_id: int, key: str, claimed_at: datetime):
+    # Only a key still pending under this claim is released, a completed response stays
+    await db.execute(
+        delete(IdempotencyKey)
+        .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key, IdempotencyKey.status_code.is_(None),
+               _held_by(claimed_at))
+    )
+    await db.commit()
+
+def _claim_time() -> datetime:
+    # Whole seconds, what a DATETIME column gives back: a claim is compared as stored
+    return datetime.utcnow().replace(microsecond=0)
+
+def _held_by(claimed_at: Optional[datetime]):
+    # Keys claimed before claimed_at existed have none
+    return IdempotencyKey.claimed_at.is_(None) if claimed_at is None else IdempotencyKey.claimed_at == claimed_at
@@ -0,0 +1,124 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, select, func
+from sqlalchemy.orm import relationship
+
+from app.configs.database import Base
+from app.core.money import MoneyColumn, to_decimal
+from app.models.user_model import Wallet
+
+# Counterparts of the wallets: money entering or leaving the platform, and the currency exchange
+ACCOUNT_OPENING = "opening"  # balances that existed before the ledger
+ACCOUNT_FX = "fx"
+ACCOUNT_MOBILE_MONEY = "mobile_money"
+ACCOUNT_STRIPE = "stripe"
+ACCOUNT_FEES = "fees"  # fees earned by the platform
+
+
+class LedgerEntry(Base):
+    """
+    One leg of a posting, never updated nor deleted. A leg moves money in (amount > 0)
+    or out (amount < 0) of a wallet, or of an external account when wallet_id is null.
+    The legs of a posting add up to zero in each currency.
+    """
+    __tablename__ = 'ledger_entries'
+    id = Column(Integer, primary_key=True, index=True)
+    wallet_id = Column(Integer, ForeignKey('wallets.id'), nullable=True)
+    account = Column(String(32), nullable=True)
+    amount = Column(MoneyColumn, nullable=False)
+    currency = Column(String(3), nullable=False)
+
+    transaction_id = Column(Integer, ForeignKey('transactions.id'), nullable=True)
+    transaction = relationship("Transaction", foreign_keys=[transaction_id])
+
+    created_at = Column(DateTime, server_default=func.now())
+
+    # Replays read the entries of a wallet after a given id
+    __table_args__ = (
+        Index('ix_ledger_entries_wallet_id_id', 'wallet_id', 'id'),
+    )
+
+
+class BalanceCheckpoint(Base):
+    """
+    Balance of a wallet once every entry up to last_entry_id is applied.
+    """
+    __tablename__ = 'balance_checkpoints'
+    id = Column(Integer, primary_key=True, index=True)
+    wallet_id = Column(Integer, ForeignKey('wallets.id'), nullable=False)
+    last_entry_id = Column(Integer, nullable=False)
+    balance = Column(MoneyColumn, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        Index('ix_balance_checkpoints_wallet_id_last_entry_id', 'wallet_id', 'last_entry_id'),
+    )
+
+
+def ledger_entries(legs, transaction=None) -> list:
+    """
+    Entries of a posting, legs being (wallet_id, account, amount, currency) tuples.
+    Raises ValueError when the legs do not balance, nothing is written then.
+    """
+    totals = defaultdict(Decimal)
+    for _, _, amount, currency in legs:
+        totals[currency] += to_decimal(amount)
+    if any(totals.values()):
+        raise ValueError(f"Unbalanced posting: {dict(totals)}")
+
+    return [
+        LedgerEntry(wallet_id=wallet_id, account=account, amount=amount, currency=currency, transaction=transaction)
+        for wallet_id, account, amount, currency in legs
+    ]
+
+
+def latest_checkpoints_query(wallet_ids=None):
+    """
+    (wallet_id, last_entry_id, balance) of the latest checkpoint of each wallet.
+    """
+    latest = select(BalanceCheckpoint.wallet_id, func.max(BalanceCheckpoint.last_entry_id).label("last_entry_id"))
+    if wallet_ids is not None:
+        latest = latest.filter(BalanceCheckpoint.wallet_id.in_(wallet_ids))
+    latest = latest.group_by(BalanceCheckpoint.wallet_id).subquery()
+    return (
+        select(BalanceCheckpoint.wallet_id, BalanceCheckpoint.last_entry_id, BalanceCheckpoint.balance)
+        .join(latest, (BalanceCheckpoint.wallet_id == latest.c.wallet_id)
+              & (BalanceCheckpoint.last_entry_id == latest.c.last_entry_id))
+    )
+
+
+def reconciliation_query():
+    """
+    (id, balance, ledger_balance) of every wallet. The ledger balance is rebuilt from the
+    latest checkpoint and only the entries written after it, so the cost follows the
+    recent activity, not the whole history.
+    """
+    checkpoints = latest_checkpoints_query().subquery()
+    since = func.coalesce(checkpoints.c.last_entry_id, 0)
+    recent = (
+        select(LedgerEntry.wallet_id, func.sum(LedgerEntry.amount).label("amount"))
+        .outerjoin(checkpoints, checkpoints.c.wallet_id == LedgerEntry.wallet_id)
+        .filter(LedgerEntry.wallet_id.is_not(None), LedgerEntry.id > since)
+        .group_by(LedgerEntry.wallet_id)
+        .subquery()
+    )
+    return (
+        select(
+            Wallet.id,
+            Wallet.balance,
+            (func.coalesce(checkpoints.c.balance, 0) + func.coalesce(recent.c.amount, 0)).label("ledger_balance"),
+        )
+        .outerjoin(checkpoints, checkpoints.c.wallet_id == Wallet.id)
+        .outerjoin(recent, recent.c.wallet_id == Wallet.id)
+    )
+
+
+def opening_entries(wallet) -> list:
+    """
+    Entries of a wallet created with a balance outside of any posting (fixtures).
+    """
+    return ledger_entries([
+        (wallet.id, None, wallet.balance, wallet.currency),
+        (None, ACCOUNT_OPENING, -wallet.balance, wallet.currency),
+    ])
@@ -0,0 +1,53 @@
+import json
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, Text, DateTime, Index, select
+
+from app.configs.database import Base
+
+OUTBOX_PENDING = "pending"
+OUTBOX_SENT = "sent"
+OUTBOX_FAILED = "failed"
+
+# Sinks of the outbox, see app.services.outbox
+TOPIC_SMS = "sms"
+TOPIC_WEBHOOK = "webhook"
+TOPIC_ANALYTICS = "analytics"
+
+
+class OutboxMessage(Base):
+    """
+    A side effect of a database change (SMS, webhook call, analytics event), written in
+    the same transaction as the change: it exists if and only if the change committed.
+    The relay hands it to its sink afterwards, at least once.
+    """
+    __tablename__ = "outbox_messages"
+    id = Column(Integer, primary_key=True, index=True)
+    topic = Column(String(32), nullable=False)
+    payload = Column(Text, nullable=False)  # JSON
+    status = Column(String(16), nullable=False, default=OUTBOX_PENDING, server_default=OUTBOX_PENDING)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    error = Column(Text, nullable=True)
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)  # pushed back after a failure
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+    # The relay takes the pending messages that are due, oldest first
+    __table_args__ = (
+        Index('ix_outbox_messages_status_available_at', 'status', 'available_at'),
+    )
+
+
+def outbox_message(topic: str, payload: dict) -> OutboxMessage:
+    return OutboxMessage(topic=topic, payload=json.dumps(payload))
+
+
+def due_outbox_messages_query(batch_size: int, now: datetime):
+    # SKIP LOCKED: the relays of the other workers take the next messages instead of waiting
+    return (
+        select(OutboxMessage)
+        .filter(OutboxMessage.status == OUTBOX_PENDING, OutboxMessage.available_at <= now)
+        .order_by(OutboxMessage.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
@@ -1,5 +1,9 @@
+import hmac
+
 from app.configs.database import Base
-from sqlalchemy import Column, Integer, String, ForeignKey
+from app.core.hashing import averify_pwd
+from app.core.utils import hash_merchant_code
+from sqlalchemy import Column, Integer, String, ForeignKey, select
 from sqlalchemy.orm import relationship
 
 
@@ -10,7 +14,10 @@ class Merchant(Base):
     business_name = Column(String(255), unique=True, nullable=False)
     phone_number = Column(String(20), unique=True, nullable=False)
     email = Column(String(255), unique=True, nullable=False)
-    merchant_code = Column(String(255), unique=True, nullable=False)
+    # HMAC digest of the merchant code (see hash_merchant_code)
+    merchant_code_digest = Column(String(64), unique=True, nullable=True, index=True)
+    # Legacy code (bcrypt hash or clear), replaced by the digest on the first successful verification
+    merchant_code = Column(String(255), unique=True, nullable=True)
 
     # Relationship to the User who registered the Merchant (Partner or Admin)
     registered_by = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"), nullable=True)
@@ -20,8 +27,41 @@ class Merchant(Base):
     owner_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"), nullable=False)
     owner = relationship("User", foreign_keys=[owner_id], back_populates="merchant", uselist=False)
 
-def get_merchant(db, phone_number):
-    return db.query(Merchant).filter(Merchant.phone_number == phone_number).first()
+async def get_merchant(db, phone_number):
+    result = await db.execute(select(Merchant).filter(Merchant.phone_number == phone_number))
+    return result.scalars().first()
+
+async def get_merchant_by_code(db, phone_number, merchant_code):
+    """
+    Return the merchant when the code matches, None otherwise.
+    """
+    merchant = await get_merchant(db, phone_number)
+    if not merchant:
+        return None
+
+    digest = hash_merchant_code(merchant_code)
+    if merchant.merchant_code_digest:
+        return merchant if hmac.compare_digest(merchant.merchant_code_digest, digest) else None
+
+    # Merchant registered before the digests: verify the legacy code once, then switch to the digest
+    legacy_code = merchant.merchant_code
+    if not legacy_code:
+        return None
+    if legacy_code.startswith("$2"):
+        valid = await averify_pwd(str(merchant_code), legacy_code)
+    else:
+        # stored in clear by older versions of register_merchant
+        valid = hmac.compare_digest(legacy_code.encode(), str(merchant_code).encode())
+    if not valid:
+        return None
+    merchant.merchant_code_digest = digest
+    merchant.merchant_code = None
+    await db.commit()
+    return merchant
+
+async def merchant_code_exists(db, merchant_code) -> bool:
+    result = await db.execute(select(Merchant.id).filter(Merchant.merchant_code_digest == hash_merchant_code(merchant_code)))
+    return result.first() is not None
 
 class Partner(Base):
     __tablename__ = 'partners'
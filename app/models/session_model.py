@@ -1,8 +1,10 @@
 import json
 from datetime import timedelta, datetime
 
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Text
-from sqlalchemy.orm import relationship, Session as Db_session
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Text, select, update, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession as Db_session
+from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
 from app.configs.database import Base
@@ -17,39 +19,60 @@ class Session(Base):
     last_activity = Column(DateTime, server_default=func.now(), onupdate=func.now())
     state = Column(String(255))
     data = Column(Text)
-    expiration = Column(DateTime, nullable=False)  # Timestamp for session expiration
+    expiration = Column(DateTime, nullable=False, index=True)  # Timestamp for session expiration, swept by purge_expired_sessions
 
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    # USSD sessions start before the caller is known (or registered)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
     user = relationship("User", back_populates="sessions", foreign_keys=[user_id])
 
 
-def get_session(db: Db_session, session_id: str):
-    return db.query(Session).filter(Session.session_id == session_id).first()
+async def get_session(db: Db_session, session_id: str):
+    # Expired rows are left for the cleanup, they are simply not sessions anymore
+    result = await db.execute(select(Session).filter(Session.session_id == session_id, Session.expiration > datetime.now()))
+    return result.scalars().first()
 
-def create_session(db: Db_session, session: SessionCreate):
+async def create_session(db: Db_session, session: SessionCreate, ttl: int = 60):
+    """
+    Start a session, returns None when a live one already exists with the same id.
+    """
+    # An expired session with the same id would still hold the unique session_id
+    await db.execute(delete(Session).where(Session.session_id == session.session_id, Session.expiration <= datetime.now()))
     db_session = Session(
         session_id=session.session_id,
         user_id=session.user_id,
         state=session.state,
         data=json.dumps(session.data),
-        expiration=datetime.now() + timedelta(minutes=1)  # Session expires in 1 minutes
+        expiration=datetime.now() + timedelta(seconds=ttl)
     )
     db.add(db_session)
-    db.commit()
-    db.refresh(db_session)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        return None
     return db_session
 
-def update_session(db: Db_session, session: SessionUpdate):
-    db_session = get_session(db, session.session_id)
-    if db_session:
-        db_session.state = session.state
-        db_session.data = json.dumps(session.data)
-        db.commit()
-        db.refresh(db_session)
-    return db_session
+async def update_session(db: Db_session, session_id: str, from_state: str, session: SessionUpdate, ttl: int = 60) -> bool:
+    """
+    Move a live session from `from_state` to the new state in a single conditional UPDATE,
+    False when it expired or another request already moved it.
+    """
+    result = await db.execute(
+        update(Session)
+        .where(Session.session_id == session_id, Session.state == from_state, Session.expiration > datetime.now())
+        .values(state=session.state, data=json.dumps(session.data), expiration=datetime.now() + timedelta(seconds=ttl))
+    )
+    await db.commit()
+    return result.rowcount == 1
 
-def delete_session(db: Db_session, session_id: str):
-    session = get_session(db, session_id)
-    if session:
-        db.delete(session)
-        db.commit()
\ No newline at end of file
+async def delete_session(db: Db_session, session_id: str, state: str = None) -> bool:
+    """
+    Delete the session, only while it is live and still in `state` when one is given.
+    False when there was nothing to delete: another request already did.
+    """
+    query = delete(Session).where(Session.session_id == session_id)
+    if state is not None:
+        query = query.where(Session.state == state, Session.expiration > datetime.now())
+    result = await db.execute(query)
+    await db.commit()
+    return result.rowcount == 1
@@ -0,0 +1,174 @@
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+from sqlalchemy import Column, Integer, String, Date, ForeignKey, Index, UniqueConstraint, case, delete, insert, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import func
+
+from app.configs.database import Base
+from app.core.money import MoneyColumn
+from app.models.ledger_model import ACCOUNT_FEES, LedgerEntry
+from app.models.transaction_model import Transaction
+from app.models.user_model import Wallet
+
+
+class WalletDailyStat(Base):
+    """
+    What went in and out of a wallet in a day, kept up to date by the postings
+    (see add_wallet_activity) so statements read O(days) rows, not the transactions.
+    Outflows include the fees, `fees` tells how much of them were fees.
+    """
+    __tablename__ = "wallet_daily_stats"
+    id = Column(Integer, primary_key=True, index=True)
+    wallet_id = Column(Integer, ForeignKey('wallets.id'), nullable=False)
+    day = Column(Date, nullable=False)
+    currency = Column(String(3), nullable=False)
+    inflow = Column(MoneyColumn, nullable=False, default=Decimal(0))
+    outflow = Column(MoneyColumn, nullable=False, default=Decimal(0))
+    fees = Column(MoneyColumn, nullable=False, default=Decimal(0))
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint('wallet_id', 'day', name='uq_wallet_daily_stats_wallet_id_day'),
+        Index('ix_wallet_daily_stats_day', 'day'),
+    )
+
+
+def collect_activity(activity: dict, legs, payer_wallet_id: int = None, fee: Decimal = Decimal(0)) -> dict:
+    """
+    Add the wallet legs of a posting to `activity`: wallet_id -> [currency, inflow, outflow, fees, count].
+    `fee` is charged to `payer_wallet_id`.
+    """
+    for wallet_id, _, amount, currency in legs:
+        if wallet_id is None:
+            continue
+        stats = activity.setdefault(wallet_id, [currency, Decimal(0), Decimal(0), Decimal(0), 0])
+        if amount > 0:
+            stats[1] += amount
+        else:
+            stats[2] -= amount
+        stats[4] += 1
+    if fee and payer_wallet_id is not None:
+        activity[payer_wallet_id][3] += fee
+    return activity
+
+
+async def add_wallet_activity(db: AsyncSession, activity: dict):
+    """
+    Add `activity` to today's row of each wallet, inside the caller's transaction.
+    A single upsert: an UPDATE matching no row would take a gap lock on the unique
+    (wallet_id, day) index, and the first postings of the day of two wallets falling
+    in the same gap would then deadlock on their inserts.
+    """
+    if not activity:
+        return
+    rows = [
+        {"wallet_id": wallet_id, "day": func.current_date(),  # the database's date, like the ledger's created_at
+         "currency": currency, "inflow": inflow, "outflow": outflow, "fees": fees, "count": count}
+        for wallet_id, (currency, inflow, outflow, fees, count) in sorted(activity.items())
+    ]
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        stmt = mysql_insert(WalletDailyStat).values(rows)
+        stmt = stmt.on_duplicate_key_update(**_added_activity(stmt.inserted))
+    elif dialect == "sqlite":  # the test databases
+        stmt = sqlite_insert(WalletDailyStat).values(rows)
+        stmt = stmt.on_conflict_do_update(index_elements=["wallet_id", "day"], set_=_added_activity(stmt.excluded))
+    else:
+        raise NotImplementedError(f"No upsert of the wallet daily stats for {dialect}")
+    await db.execute(stmt)
+
+
+def _added_activity(added) -> dict:
+    return {
+        "inflow": WalletDailyStat.inflow + added.inflow,
+        "outflow": WalletDailyStat.outflow + added.outflow,
+        "fees": WalletDailyStat.fees + added.fees,
+        "count": WalletDailyStat.count + added.count,
+    }
+
+
+def statement_query(wallet_id, start_date: date, end_date: date):
+    """
+    (day, currency, inflow, outflow, fees, count) of one wallet, or of every wallet
+    summed per currency when wallet_id is None.
+    """
+    query = (select(WalletDailyStat.day, WalletDailyStat.currency,
+                    func.sum(WalletDailyStat.inflow), func.sum(WalletDailyStat.outflow),
+                    func.sum(WalletDailyStat.fees), func.sum(WalletDailyStat.count))
+             .filter(WalletDailyStat.day.between(start_date, end_date)))
+    if wallet_id is not None:
+        query = query.filter(WalletDailyStat.wallet_id == wallet_id)
+    return (query.group_by(WalletDailyStat.day, WalletDailyStat.currency)
+            .order_by(WalletDailyStat.day, WalletDailyStat.currency))
+
+
+def statement_items(rows, by_month: bool = False) -> list:
+    """
+    Statement lines from statement_query rows, the days folded into months when asked.
+    """
+    totals = defaultdict(lambda: [Decimal(0), Decimal(0), Decimal(0), 0])
+    for day, currency, inflow, outflow, fees, count in rows:
+        period = day.replace(day=1) if by_month else day
+        line = totals[(period, currency)]
+        line[0] += inflow
+        line[1] += outflow
+        line[2] += fees
+        line[3] += int(count)
+    return [
+        {"period": period, "currency": currency, "inflow": inflow, "outflow": outflow, "fees": fees, "count": count}
+        for (period, currency), (inflow, outflow, fees, count) in sorted(totals.items())
+    ]
+
+
+def rebuild_wallet_stats(db, since: date = None, until: date = None, batch_size: int = 1000) -> int:
+    """
+    Recompute the rows of the days in [since, until) from the ledger, with a sync session.
+    Returns the number of rows written.
+    """
+    day = func.date(LedgerEntry.created_at, type_=Date)
+    # Legs outside of any transaction are opening balances, not activity
+    period = [LedgerEntry.transaction_id.is_not(None)]
+    if since:
+        period.append(LedgerEntry.created_at >= since)
+    if until:
+        period.append(LedgerEntry.created_at < until)
+
+    flows = db.execute(
+        select(LedgerEntry.wallet_id, day, LedgerEntry.currency,
+               func.sum(case((LedgerEntry.amount > 0, LedgerEntry.amount), else_=0)),
+               func.sum(case((LedgerEntry.amount < 0, -LedgerEntry.amount), else_=0)),
+               func.count())
+        .filter(LedgerEntry.wallet_id.is_not(None), *period)
+        .group_by(LedgerEntry.wallet_id, day, LedgerEntry.currency)
+    ).all()
+    # The fee legs have no wallet, they are charged to the wallet of the transaction's user
+    fees = dict(((wallet_id, fee_day), amount) for wallet_id, fee_day, amount in db.execute(
+        select(Wallet.id, day, func.sum(LedgerEntry.amount))
+        .join(Transaction, Transaction.id == LedgerEntry.transaction_id)
+        .join(Wallet, Wallet.owner_id == Transaction.user_id)
+        .filter(LedgerEntry.account == ACCOUNT_FEES, *period)
+        .group_by(Wallet.id, day)
+    ).all())
+
+    stale = delete(WalletDailyStat)
+    if since:
+        stale = stale.filter(WalletDailyStat.day >= since)
+    if until:
+        stale = stale.filter(WalletDailyStat.day < until)
+    try:
+        db.execute(stale)
+        for start in range(0, len(flows), batch_size):
+            db.execute(insert(WalletDailyStat), [
+                {"wallet_id": wallet_id, "day": flow_day, "currency": currency, "inflow": inflow, "outflow": outflow,
+                 "fees": fees.get((wallet_id, flow_day), Decimal(0)), "count": count}
+                for wallet_id, flow_day, currency, inflow, outflow, count in flows[start:start + batch_size]
+            ])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(flows)
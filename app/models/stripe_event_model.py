@@ -0,0 +1,59 @@
+import json
+
+from sqlalchemy import Column, Integer, String, Text, DateTime, Index, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession as Db_session
+from sqlalchemy.sql import func
+
+from app.configs.database import Base
+
+STRIPE_EVENT_PENDING = "pending"
+STRIPE_EVENT_PROCESSED = "processed"
+STRIPE_EVENT_FAILED = "failed"
+
+
+class StripeEvent(Base):
+    """
+    A webhook event received from Stripe, keyed by its event id so a redelivery is
+    recorded only once. The webhook stores it as pending, the wallet is credited later
+    by the StripeEventProcessor.
+    """
+    __tablename__ = "stripe_events"
+    id = Column(String(255), primary_key=True)  # evt_...
+    type = Column(String(64), nullable=False)
+    payload = Column(Text, nullable=False)  # data.object, as JSON
+    status = Column(String(16), nullable=False, default=STRIPE_EVENT_PENDING, server_default=STRIPE_EVENT_PENDING)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+    processed_at = Column(DateTime, nullable=True)
+
+    # The processor takes the oldest pending events
+    __table_args__ = (
+        Index('ix_stripe_events_status_created_at', 'status', 'created_at'),
+    )
+
+
+async def record_stripe_event(db: Db_session, event) -> bool:
+    """
+    Store a verified event, False when it was already received (a Stripe retry).
+    """
+    stmt = (
+        insert(StripeEvent)
+        .values(id=event["id"], type=event["type"], payload=json.dumps(event["data"]["object"]))
+        .prefix_with("IGNORE", dialect="mysql")
+        .prefix_with("OR IGNORE", dialect="sqlite")
+    )
+    result = await db.execute(stmt)
+    await db.commit()
+    return result.rowcount == 1
+
+
+def pending_stripe_events_query(batch_size: int):
+    # SKIP LOCKED: the processors of the other workers take the next events instead of waiting
+    return (
+        select(StripeEvent)
+        .filter(StripeEvent.status == STRIPE_EVENT_PENDING)
+        .order_by(StripeEvent.created_at, StripeEvent.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
@@ -1,12 +1,43 @@
-from sqlalchemy import Column, Integer, String, Float
+from decimal import Decimal
+
+from sqlalchemy import Column, Integer, String, select
+from sqlalchemy.ext.asyncio import AsyncSession as Session
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from app.configs.config import settings
 from app.configs.database import Base
+from app.core.money import MoneyColumn, quantize
+from app.core.snapshot_cache import SnapshotCache
+from app.core.tariff_index import TariffIndex
+
+# Transaction types of the fee grid
+TARIFF_TRANSFER = "transfer"
+TARIFF_WITHDRAW = "withdraw"
+TARIFF_RECHARGE = "recharge"
 
 class Tariff(Base):
     __tablename__ = 'tariffs'
     id = Column(Integer, primary_key=True, index=True)
-    transaction_type = Column(String(20), nullable=False)  # e.g., 'transfer', 'payment'
-    min_amount = Column(Float, nullable=False)
-    max_amount = Column(Float, nullable=False)
-    fee = Column(Float, nullable=False)
\ No newline at end of file
+    transaction_type = Column(String(20), nullable=False)  # e.g., 'transfer', 'withdraw', 'recharge'
+    currency = Column(String(3), nullable=False, server_default="XAF")  # currency of the bounds and of the fee
+    min_amount = Column(MoneyColumn, nullable=False)
+    max_amount = Column(MoneyColumn, nullable=False)
+    fee = Column(MoneyColumn, nullable=False)
+
+async def _tariff_rows(db: Session):
+    result = await db.execute(select(Tariff.transaction_type, Tariff.currency, Tariff.min_amount, Tariff.max_amount, Tariff.fee))
+    return result.all()
+
+# Fees are read on every payment and the grid barely changes, compute_fee reads this cache
+tariff_cache = SnapshotCache(TariffIndex, _tariff_rows, ttl=settings.TARIFF_CACHE_TTL)
+
+async def load_tariffs(db: Session):
+    return await tariff_cache.reload(db)
+
+async def compute_fee(db: Session, transaction_type: str, amount: Decimal, currency: str) -> Decimal:
+    """
+    Fee charged on top of `amount`, 0 when no band of the grid covers it.
+    """
+    index = await tariff_cache.get(db)
+    fee = index.fee(transaction_type, currency, amount)
+    return quantize(fee or 0, currency)
@@ -1,15 +1,19 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
-from sqlalchemy.orm import relationship
+from decimal import Decimal
+
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, select, union
+from sqlalchemy.orm import relationship, joinedload, aliased
 from sqlalchemy.sql import func
 
 from app.configs.database import Base
+from app.core.money import MoneyColumn
+from app.core.pagination import keyset_page
 
 
 class Transaction(Base):
     __tablename__ = 'transactions'
     id = Column(Integer, primary_key=True, index=True)
-    amount = Column(Float, nullable=False)
-    fees = Column(Float, nullable=False, default=0.0)
+    amount = Column(MoneyColumn, nullable=False)
+    fees = Column(MoneyColumn, nullable=False, default=Decimal(0))
     transaction_type = Column(String(20), nullable=False)  # e.g., 'transfer', 'payment'
     status = Column(String(20), default="pending")
     currency = Column(String(3), nullable=False)
@@ -22,6 +26,90 @@ class Transaction(Base):
 
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    # History reads: one index per side of a transfer, plus created_at alone for the admins.
+    # InnoDB appends the primary key, so they also serve the (created_at, id) keyset order.
+    __table_args__ = (
+        Index('ix_transactions_user_id_created_at', 'user_id', 'created_at'),
+        Index('ix_transactions_recipient_id_created_at', 'recipient_id', 'created_at'),
+        Index('ix_transactions_created_at', 'created_at'),
+    )
     
     def __repr__(self):
-        return f"<Transaction(id={self.id}, amount={self.amount}, transaction_type={self.transaction_type}, status={self.status}, currency={self.currency}, user_id={self.user_id}, recipient_id={self.recipient_id}, created_at={self.created_at}, updated_at={self.updated_at})>"
\ No newline at end of file
+        return f"<Transaction(id={self.id}, amount={self.amount}, transaction_type={self.transaction_type}, status={self.status}, currency={self.currency}, user_id={self.user_id}, recipient_id={self.recipient_id}, created_at={self.created_at}, updated_at={self.updated_at})>"
+
+
+def _history_branches(user_id, start_date, end_date):
+    period = Transaction.created_at.between(start_date, end_date)
+    if user_id is None:
+        return [period]
+    # user_id = ? OR recipient_id = ? cannot use either index, each side is read on its own
+    return [
+        (Transaction.user_id == user_id) & period,
+        (Transaction.recipient_id == user_id) & period,
+    ]
+
+
+def history_page_query(user_id, start_date, end_date, cursor: str = None, size: int = 50):
+    """
+    One keyset page of the history of a user (all the transactions when user_id is None).
+    Each branch reads at most size + 1 rows from its own (…_id, created_at) index, the
+    UNION merges them and only the ids of the page are joined back to the rows.
+    """
+    branches = [
+        keyset_page(select(Transaction.id, Transaction.created_at).filter(condition),
+                    Transaction.created_at, Transaction.id, cursor, size).subquery()
+        for condition in _history_branches(user_id, start_date, end_date)
+    ]
+    if len(branches) == 1:
+        page = branches[0]
+    else:
+        merged = union(*(select(branch.c.id, branch.c.created_at) for branch in branches)).subquery()
+        page = (select(merged.c.id)
+                .order_by(merged.c.created_at.desc(), merged.c.id.desc())
+                .limit(size + 1)
+                .subquery())
+
+    # only the user columns are rendered, so the user roles are not joined in
+    return (select(Transaction)
+            .join(page, Transaction.id == page.c.id)
+            .options(joinedload(Transaction.user).lazyload("*"), joinedload(Transaction.recipient).lazyload("*"))
+            .order_by(Transaction.created_at.desc(), Transaction.id.desc()))
+
+
+def history_full_scans(plan) -> list:
+    """
+    Rows of the MySQL EXPLAIN of a history query reading transactions without an index.
+    """
+    return [row for row in plan if row["table"] == "transactions" and (row["type"] == "ALL" or row["key"] is None)]
+
+
+def history_count_query(user_id, start_date, end_date):
+    ids = union(*(select(Transaction.id).filter(condition)
+                  for condition in _history_branches(user_id, start_date, end_date))).subquery()
+    return select(func.count()).select_from(ids)
+
+
+def history_export_query(user_id, start_date, end_date, transaction_type: str = None):
+    """
+    Flat rows of the history, oldest first, for the exports: only columns, no ORM objects,
+    with the phone numbers of both sides.
+    """
+    branches = _history_branches(user_id, start_date, end_date)
+    if transaction_type:
+        branches = [condition & (Transaction.transaction_type == transaction_type) for condition in branches]
+
+    from app.models.user_model import User  # user_model imports this module
+    sender, recipient = aliased(User), aliased(User)
+    query = (select(Transaction.id, Transaction.created_at, Transaction.transaction_type, Transaction.status,
+                    Transaction.amount, Transaction.fees, Transaction.currency,
+                    Transaction.user_id, sender.phone_number.label("user_phone"),
+                    Transaction.recipient_id, recipient.phone_number.label("recipient_phone"))
+             .outerjoin(sender, sender.id == Transaction.user_id)
+             .outerjoin(recipient, recipient.id == Transaction.recipient_id))
+    if len(branches) == 1:
+        query = query.filter(branches[0])
+    else:
+        ids = union(*(select(Transaction.id).filter(condition) for condition in branches)).subquery()
+        query = query.join(ids, ids.c.id == Transaction.id)
+    return query.order_by(Transaction.created_at, Transaction.id)
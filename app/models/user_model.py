@@ -1,11 +1,18 @@
 from datetime import datetime
 from enum import Enum
 
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float, UniqueConstraint, Date
-from sqlalchemy.orm import Session
+from decimal import Decimal
+
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, UniqueConstraint, Date, select
+from sqlalchemy.ext.asyncio import AsyncSession as Session
 from sqlalchemy.orm import relationship
 
+from app.configs.config import settings
 from app.configs.database import Base
+from app.core.money import MoneyColumn, RateColumn, quantize, to_decimal
+from app.core.rate_cache import RateSnapshot
+from app.core.snapshot_cache import SnapshotCache
+from app.core.utils import hash_merchant_code
 from app.models.roles_model import Merchant, Partner, Client, Admin
 from app.models.session_model import Session as SessionModel
 from app.models.transaction_model import Transaction
@@ -19,17 +26,17 @@ class LANGUAGES (Enum):
 class Wallet(Base):
     __tablename__ = 'wallets'
     id = Column(Integer, primary_key=True, index=True)
-    balance = Column(Float, default=0.0)
+    balance = Column(MoneyColumn, nullable=False, default=Decimal(0))
     currency = Column(String(3), default="USD")
 
     owner_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"))
     owner = relationship("User", back_populates="wallet", uselist=False, foreign_keys=[owner_id])
 
-    def convert_balance(self,  db: Session, to_currency: str) -> float:
-        return convert_currency(db, self.balance, self.currency, to_currency)
+    async def convert_balance(self,  db: Session, to_currency: str) -> Decimal:
+        return await convert_currency(db, self.balance, self.currency, to_currency)
 
-    def convert_amount(self, db: Session, amount: float,  to_currency: str) -> float:
-        return convert_currency(db, amount, self.currency, to_currency)
+    async def convert_amount(self, db: Session, amount: Decimal,  to_currency: str) -> Decimal:
+        return await convert_currency(db, amount, self.currency, to_currency)
 
 class PaymentCard(Base):
     __tablename__ = 'payment_cards'
@@ -50,7 +57,7 @@ class CurrencyRate(Base):
     id = Column(Integer, primary_key=True, index=True)
     from_currency = Column(String(3), nullable=False)  # e.g., "USD"
     to_currency = Column(String(3), nullable=False)    # e.g., "EUR"
-    rate = Column(Float, nullable=False)  # Conversion rate, e.g., 0.85 for USD to EUR
+    rate = Column(RateColumn, nullable=False)  # Conversion rate, e.g., 0.85 for USD to EUR
 
     __table_args__ = (
         UniqueConstraint('from_currency', 'to_currency', name='_from_to_currency_uc'),
@@ -62,6 +69,15 @@ class CurrencyRate(Base):
     def __repr__(self):
         return f"<CurrencyRate {self.from_currency} to {self.to_currency} = {self.rate}>"
 
+def currency_rates_query():
+    return select(CurrencyRate.from_currency, CurrencyRate.to_currency, CurrencyRate.rate)
+
+async def _currency_rate_rows(db: Session):
+    return (await db.execute(currency_rates_query())).all()
+
+# Exchange rates only change once a day, convert_currency reads them from this cache
+currency_rate_cache = SnapshotCache(RateSnapshot, _currency_rate_rows, ttl=settings.CURRENCY_RATES_CACHE_TTL)
+
 class User(Base):
     __tablename__ = 'users'
     id = Column(Integer, primary_key=True, index=True)
@@ -86,11 +102,13 @@ class User(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationships with other entities
-    wallet = relationship("Wallet", back_populates="owner", uselist=False)
-    merchant = relationship("Merchant", back_populates="owner", foreign_keys="[Merchant.owner_id]", uselist=False)
-    client = relationship("Client", back_populates="owner", foreign_keys="[Client.owner_id]", uselist=False)
-    partner = relationship("Partner", back_populates="owner", foreign_keys="[Partner.owner_id]", uselist=False)
-    admin = relationship("Admin", back_populates="owner",  foreign_keys="[Admin.owner_id]", uselist=False)
+    # The wallet and the roles are joined-loaded with the user: lazy loading is not
+    # available on an AsyncSession and they are read on almost every request
+    wallet = relationship("Wallet", back_populates="owner", uselist=False, lazy="joined")
+    merchant = relationship("Merchant", back_populates="owner", foreign_keys="[Merchant.owner_id]", uselist=False, lazy="joined")
+    client = relationship("Client", back_populates="owner", foreign_keys="[Client.owner_id]", uselist=False, lazy="joined")
+    partner = relationship("Partner", back_populates="owner", foreign_keys="[Partner.owner_id]", uselist=False, lazy="joined")
+    admin = relationship("Admin", back_populates="owner",  foreign_keys="[Admin.owner_id]", uselist=False, lazy="joined")
     payment_cards = relationship("PaymentCard", back_populates="owner", uselist=False)
 
     # Registered entities by this user
@@ -99,29 +117,37 @@ class User(Base):
     registered_merchants = relationship("Merchant", foreign_keys=[Merchant.registered_by], back_populates="registered_by_user")
     registered_clients = relationship("Client", foreign_keys=[Client.registered_by], back_populates="registered_by_user")
 
-def generate_username(db: Session, first_name: str, last_name: str) -> str:
+async def generate_username(db: Session, first_name: str, last_name: str) -> str:
     base_username = f"{first_name.lower()}.{last_name.lower()}"
     username = base_username
     counter = 1
 
     # Ensure the username is unique
-    while db.query(User).filter(User.username == username).first():
+    while (await db.execute(select(User.id).filter(User.username == username))).first():
         username = f"{base_username}{counter}"
         counter += 1
 
     return username
 
-def get_user(db: Session, phone_number: str):
-    return db.query(User).filter(User.phone_number == phone_number).first()
+async def get_user(db: Session, phone_number: str):
+    result = await db.execute(select(User).filter(User.phone_number == phone_number))
+    return result.scalars().first()
 
-def create_user(db: Session, user: UserCreate, registered_by: int = None):
+async def get_users_by_phone(db: Session, phone_numbers) -> dict:
+    # A single IN query, for the bulk operations
+    if not phone_numbers:
+        return {}
+    result = await db.execute(select(User).filter(User.phone_number.in_(list(phone_numbers))))
+    return {user.phone_number: user for user in result.scalars().unique().all()}
+
+async def create_user(db: Session, user: UserCreate, registered_by: int = None):
     if not user.username:
-        user.username = generate_username(db, user.first_name, user.last_name)
+        user.username = await generate_username(db, user.first_name, user.last_name)
 
     db_client = User(**user.dict())
 
     db.add(db_client)
-    db.flush()
+    await db.flush()
 
     # determine the currency based on the phone number (+237, +1, and +33)
     currency = "USD"
@@ -140,17 +166,17 @@ def create_user(db: Session, user: UserCreate, registered_by: int = None):
 
     db.add_all([new_wallet, new_client])
 
-    db.commit()
+    await db.commit()
 
-    db.refresh(db_client)
+    await db.refresh(db_client)
 
     return db_client
 
-def create_user_partner(db: Session, user: UserCreate, partner_code: str):
+async def create_user_partner(db: Session, user: UserCreate, partner_code: str):
     db_client = User(**user.dict())
 
     db.add(db_client)
-    db.flush()
+    await db.flush()
 
     new_wallet = Wallet(
         owner_id=db_client.id
@@ -165,13 +191,13 @@ def create_user_partner(db: Session, user: UserCreate, partner_code: str):
 
     db.add_all([new_wallet, new_partner])
 
-    db.commit()
+    await db.commit()
 
-    db.refresh(db_client)
+    await db.refresh(db_client)
 
     return db_client
 
-def create_merchant_user(db: Session, user: MerchantCreate, merchant_code: str, registered_by: int = None):
+async def create_merchant_user(db: Session, user: MerchantCreate, merchant_code: str, registered_by: int = None):
     b_name: str = user.business_name
 
     del user.business_name
@@ -179,7 +205,7 @@ def create_merchant_user(db: Session, user: MerchantCreate, merchant_code: str,
     db_client = User(**user.dict())
 
     db.add(db_client)
-    db.flush()
+    await db.flush()
 
     new_wallet = Wallet(
         owner_id=db_client.id
@@ -187,7 +213,7 @@ def create_merchant_user(db: Session, user: MerchantCreate, merchant_code: str,
 
     new_merchant = Merchant(
         owner_id=db_client.id,
-        merchant_code=merchant_code,
+        merchant_code_digest=hash_merchant_code(merchant_code),
         email=user.email if user.email else "",
         phone_number=user.phone_number,
         business_name=b_name,
@@ -196,18 +222,18 @@ def create_merchant_user(db: Session, user: MerchantCreate, merchant_code: str,
 
     db.add_all([new_wallet, new_merchant])
 
-    db.commit()
+    await db.commit()
 
-    db.refresh(db_client)
+    await db.refresh(db_client)
 
     return db_client
 
 
-def create_admin(db: Session, user: UserCreate):
+async def create_admin(db: Session, user: UserCreate):
     db_client = User(**user.dict())
 
     db.add(db_client)
-    db.flush()
+    await db.flush()
 
     new_wallet = Wallet(
         owner_id=db_client.id
@@ -217,44 +243,27 @@ def create_admin(db: Session, user: UserCreate):
 
     db.add_all([new_wallet, new_admin])
 
-    db.commit()
+    await db.commit()
 
-    db.refresh(db_client)
+    await db.refresh(db_client)
 
     return db_client
-def create_wallet(db: Session):
+async def create_wallet(db: Session):
     wallet = Wallet(balance=0.0)
     db.add(wallet)
-    db.commit()
-    db.refresh(wallet)
+    await db.commit()
+    await db.refresh(wallet)
     return wallet
 
-def increase_user_balance(db: Session, phone_number: str, amount: float):
-    client = get_user(db, phone_number)
-    if client:
-        client.wallet.balance += amount
-        db.commit()
-        db.refresh(client)
-    return client
-
-def decrease_user_balance(db: Session, phone_number: str, amount: float):
-    client = get_user(db, phone_number)
-    if client and client.wallet.balance >= amount:
-        client.wallet.balance -= amount
-        db.commit()
-        db.refresh(client)
-    return client
-
-def convert_currency(db: Session, amount: float, from_currency: str, to_currency: str) -> float:
-    # Check if the exchange rate exists in the database
-    currency_rate = db.query(CurrencyRate).filter(
-        CurrencyRate.from_currency == from_currency,
-        CurrencyRate.to_currency == to_currency
-    ).first()
-
-    if not currency_rate:
+async def load_currency_rates(db: Session):
+    return await currency_rate_cache.reload(db)
+
+async def convert_currency(db: Session, amount: Decimal, from_currency: str, to_currency: str) -> Decimal:
+    rates = await currency_rate_cache.get(db)
+    rate = rates.get(from_currency, to_currency)
+
+    if rate is None:
         raise ValueError(f"Exchange rate from {from_currency} to {to_currency} not found.")
 
-    # Convert the amount using the exchange rate
-    converted_amount = amount * currency_rate.rate
-    return converted_amount
+    # Convert the amount using the exchange rate, rounded once to the decimals of the target currency
+    return quantize(to_decimal(amount) * to_decimal(rate), to_currency)
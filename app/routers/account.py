@@ -1,10 +1,15 @@
-from fastapi import Depends, APIRouter
-from sqlalchemy.orm import Session
+from datetime import date, timedelta
+
+from fastapi import Depends, APIRouter, Query
+from sqlalchemy.ext.asyncio import AsyncSession as Session
 
 from app.configs.database import get_db
-from app.core.oauth import get_current_user
-from app.core.send_sms import sendsms
-from app.core.utils import verify_pwd, secure_pwd
+from app.core.oauth import get_current_user, invalidate_principal, role_required
+from app.core.principal_cache import Principal
+from app.models.statement_model import statement_items, statement_query
+from app.schemas.statement_schema import StatementPeriod, StatementResponse
+from app.services.notifications import SMS_PIN_CHANGED, enqueue_sms
+from app.core.hashing import averify_pwd, asecure_pwd
 from app.models.user_model import User
 from app.schemas.user_schema import UserBalanceResponse, UserResponse, UserUpdate, UserUpdatePin, UserUpdatePassword
 from fastapi.exceptions import HTTPException
@@ -16,7 +21,7 @@ router = APIRouter(
 )
 
 @router.get('/balance', response_model=UserBalanceResponse)
-def get_user_balance(current_user: User = Depends(get_current_user), db:Session = Depends(get_db)):
+async def get_user_balance(current_user: User = Depends(get_current_user), db:Session = Depends(get_db)):
     wallet = current_user.wallet
 
     balance_response = UserBalanceResponse(
@@ -28,8 +33,53 @@ def get_user_balance(current_user: User = Depends(get_current_user), db:Session
     return wallet
 
 
+def statement_range(period: StatementPeriod, start_date: date, end_date: date):
+    # Default: the last 30 days, or the last 12 months
+    end_date = end_date or date.today()
+    if not start_date:
+        start_date = end_date - timedelta(days=30) if period == StatementPeriod.DAY else date(end_date.year - 1, end_date.month, 1)
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date is after end_date")
+    return start_date, end_date
+
+
+@router.get('/statement', response_model=StatementResponse)
+async def get_statement(
+    period: StatementPeriod = Query(StatementPeriod.DAY, description="One line per day or per month"),
+    start_date: date = Query(None),
+    end_date: date = Query(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Inflow, outflow, fees and number of operations of the wallet, from the daily rollups.
+    """
+    start_date, end_date = statement_range(period, start_date, end_date)
+    rows = (await db.execute(statement_query(current_user.wallet.id, start_date, end_date))).all()
+    return {"start_date": start_date, "end_date": end_date, "period": period,
+            "items": statement_items(rows, by_month=period == StatementPeriod.MONTH)}
+
+
+@router.get('/dashboard', response_model=StatementResponse)
+async def get_dashboard(
+    period: StatementPeriod = Query(StatementPeriod.DAY, description="One line per day or per month"),
+    start_date: date = Query(None),
+    end_date: date = Query(None),
+    wallet_id: int = Query(None, description="One wallet, all of them (per currency) otherwise"),
+    user: Principal = Depends(role_required(['admin'])),
+    db: Session = Depends(get_db)
+):
+    """
+    Same as /statement for any wallet, or the totals of all the wallets.
+    """
+    start_date, end_date = statement_range(period, start_date, end_date)
+    rows = (await db.execute(statement_query(wallet_id, start_date, end_date))).all()
+    return {"start_date": start_date, "end_date": end_date, "period": period,
+            "items": statement_items(rows, by_month=period == StatementPeriod.MONTH)}
+
+
 @router.put('/update', response_model=UserResponse)
-def update_user_informmation(user_update: UserUpdate, user: User = Depends(get_current_user), db:Session = Depends(get_db)):
+async def update_user_informmation(user_update: UserUpdate, user: User = Depends(get_current_user), db:Session = Depends(get_db)):
     
     if user_update.username:
         user.username = user_update.username
@@ -55,39 +105,42 @@ def update_user_informmation(user_update: UserUpdate, user: User = Depends(get_c
         user.language = user_update.language
 
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
+    invalidate_principal(user.phone_number)
 
     print(user.language)
 
     return user
 
 @router.post('/change-pin', response_model=UserResponse)
-def change_user_pin(user: UserUpdatePin, current_user: User = Depends(get_current_user), db:Session = Depends(get_db)):
+async def change_user_pin(user: UserUpdatePin, current_user: User = Depends(get_current_user), db:Session = Depends(get_db)):
     # check if pin is correct
-    if not verify_pwd(user.old_pin, current_user.pin):
+    if not await averify_pwd(user.old_pin, current_user.pin):
         raise HTTPException(status_code=400, detail="Invalid PIN")
 
-    current_user.pin = secure_pwd(user.new_pin)
+    current_user.pin = await asecure_pwd(user.new_pin)
 
 
     db.add(current_user)
-    db.commit()
-    db.refresh(current_user)
+    await db.commit()
+    await db.refresh(current_user)
+    invalidate_principal(current_user.phone_number)
 
-    sendsms(current_user.phone_number, f"Votre nouveau code PIN est : {user.new_pin}")
+    enqueue_sms(current_user.phone_number, f"Votre nouveau code PIN est : {user.new_pin}", SMS_PIN_CHANGED)
     return current_user
 
 
 @router.post("/change-password", response_model=UserResponse)
-def change_password(user: UserUpdatePassword, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def change_password(user: UserUpdatePassword, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     # check if old password is correct
-    if not verify_pwd(user.old_password, current_user.password):
+    if not await averify_pwd(user.old_password, current_user.password):
         raise HTTPException(status_code=400, detail="Invalid Password")
 
     # update password
-    current_user.password = secure_pwd(user.new_password)
+    current_user.password = await asecure_pwd(user.new_password)
     db.add(current_user)
-    db.commit()
-    db.refresh(current_user)
+    await db.commit()
+    await db.refresh(current_user)
+    invalidate_principal(current_user.phone_number)
     return current_user
@@ -0,0 +1,43 @@
+from datetime import date, timedelta
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.oauth import role_required
+from app.core.principal_cache import Principal
+from app.schemas.analytics_schema import AnalyticsDimension, VolumesResponse
+from app.services.analytics import transaction_snapshots
+
+router = APIRouter(
+    prefix="/api/v1/analytics",
+    tags=["Analytics"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@router.get("/volumes", response_model=VolumesResponse)
+async def get_volumes(
+    group_by: List[AnalyticsDimension] = Query([AnalyticsDimension.CURRENCY]),
+    start_date: date = Query(None, description="30 days before end_date by default"),
+    end_date: date = Query(None, description="Today by default"),
+    currency: str = Query(None, min_length=3, max_length=3),
+    status: str = Query("completed", max_length=20),
+    user: Principal = Depends(role_required(['admin']))
+):
+    """
+    Amount, fees and number of transactions per currency and per dimension, from the
+    Parquet snapshots (see TransactionSnapshots): they lag behind by up to
+    ANALYTICS_SNAPSHOT_INTERVAL, the database is not queried.
+    """
+    end_date = end_date or date.today()
+    start_date = start_date or end_date - timedelta(days=30)
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date is after end_date")
+    group_by = list(dict.fromkeys(group_by))
+
+    # Reading and grouping the files is CPU bound, off the event loop
+    items = await run_in_threadpool(
+        transaction_snapshots.volumes, start_date, end_date, [dimension.value for dimension in group_by], currency, status,
+    )
+    return {"start_date": start_date, "end_date": end_date, "group_by": group_by, "items": items}
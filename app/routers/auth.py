@@ -1,9 +1,11 @@
 from enum import Enum
 
 from fastapi import Depends, HTTPException, APIRouter, Query, status, Form, File, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi_pagination import Page
 from fastapi_pagination.ext.sqlalchemy import paginate
 from sqlalchemy import select, or_
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from typing import  Optional
 
@@ -11,10 +13,11 @@ from app.configs.config import settings
 from app.configs.database import get_db
 from app.core.upload_file import upload_file
 from app.core.oauth import create_access_token, get_current_user, create_refresh_token, refresh_token, role_required
-from app.core.send_sms import sendsms
-from app.core.utils import generate_pin_code, secure_pwd, verify_pwd, generate_merchant_code
-from app.models.roles_model import Merchant
-from app.models.session_model import Session
+from app.core.principal_cache import Principal
+from app.services.notifications import SMS_WELCOME, enqueue_sms
+from app.core.utils import generate_pin_code, generate_merchant_code
+from app.core.hashing import asecure_pwd, averify_and_update
+from app.models.roles_model import Merchant, merchant_code_exists
 from app.models.user_model import User, create_user, create_user_partner, create_merchant_user, generate_username
 from app.schemas.user_schema import UserCreate, UserResponse, UserLogin, UserLoginResponse, MerchantCreate
 
@@ -32,9 +35,9 @@ class UserRole(str, Enum):
 
 
 @router.post("/register/partner", response_model=UserResponse)
-async def register_partner(user: UserCreate, db: Session = Depends(get_db)):
+async def register_partner(user: UserCreate, db: AsyncSession = Depends(get_db)):
     # check if user exists with the same phone number or email
-    existing_user = db.query(User).filter(User.phone_number == user.phone_number).first()
+    existing_user = (await db.execute(select(User.id).filter(User.phone_number == user.phone_number))).first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Phone number or email already registered")
 
@@ -44,20 +47,18 @@ async def register_partner(user: UserCreate, db: Session = Depends(get_db)):
         user.pin = generate_pin_code()
 
     pin = user.pin
-    user.pin = secure_pwd(pin)
+    user.pin = await asecure_pwd(pin)
 
     if user.password:
-        user.password = secure_pwd(user.password)
+        user.password = await asecure_pwd(user.password)
     
-    user.username = generate_username(db, user.first_name, user.last_name)
+    user.username = await generate_username(db, user.first_name, user.last_name)
 
-    new_user = create_user_partner(db, user, secure_pwd(partner_code))
+    new_user = await create_user_partner(db, user, await asecure_pwd(partner_code))
 
     # Envoyer un msg de bienvenue avec le code PIN par SMS
-    response = sendsms(user.phone_number,
-                       f"Bienvenue sur {settings.PROJECT_NAME}! Votre code PIN est : {pin}\nVotre code partenaire est : {partner_code}")
-    if not response:
-        raise HTTPException(status_code=500, detail="Failed to send SMS")
+    enqueue_sms(user.phone_number,
+                f"Bienvenue sur {settings.PROJECT_NAME}! Votre code PIN est : {pin}\nVotre code partenaire est : {partner_code}", SMS_WELCOME)
 
     return new_user
 
@@ -68,10 +69,10 @@ async def register_client(
         avatar: Optional[UploadFile] = File(None),
         address_proof: Optional[UploadFile] = File(None),
         id_document: Optional[UploadFile] = File(None),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
     ):
     # check if user exists
-    existing_user = db.query(User).filter(User.phone_number == user.phone_number).first()
+    existing_user = (await db.execute(select(User.id).filter(User.phone_number == user.phone_number))).first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Phone number or email already registered")
 
@@ -81,44 +82,44 @@ async def register_client(
     print("**********GENERATED PIN**********", user.pin)
 
     pin = user.pin
-    user.pin = secure_pwd(pin)
+    user.pin = await asecure_pwd(pin)
 
     if user.password:
-        user.password = secure_pwd(user.password)
-    user.username = generate_username(db, user.first_name, user.last_name)
+        user.password = await asecure_pwd(user.password)
+    user.username = await generate_username(db, user.first_name, user.last_name)
 
-    avatar_path = upload_file(avatar) if avatar else None
-    address_proof_path = upload_file(address_proof) if address_proof else None
-    id_document_path = upload_file(id_document) if id_document else None
+    avatar_path = await run_in_threadpool(upload_file, avatar) if avatar else None
+    address_proof_path = await run_in_threadpool(upload_file, address_proof) if address_proof else None
+    id_document_path = await run_in_threadpool(upload_file, id_document) if id_document else None
 
     user.address_proof = address_proof_path
     user.avatar = avatar_path
     user.id_document = id_document_path
 
-    new_user = create_user(db, user)
+    new_user = await create_user(db, user)
 
     # Envoyer un msg de bienvenue avec le code PIN par SMS
-    response = sendsms(user.phone_number, f"Bienvenue sur {settings.PROJECT_NAME}! Votre code PIN est : {pin}")
-    if not response:
-        raise HTTPException(status_code=500, detail="Failed to send SMS")
+    enqueue_sms(user.phone_number, f"Bienvenue sur {settings.PROJECT_NAME}! Votre code PIN est : {pin}", SMS_WELCOME)
 
     return new_user
 
 
 @router.post('/register/merchant', response_model=UserResponse)
-async def register_merchant(user: MerchantCreate, db: Session = Depends(get_db),
+async def register_merchant(user: MerchantCreate, db: AsyncSession = Depends(get_db),
                             partner=Depends(role_required(['partner', 'admin']))):
     # check if user exists
-    existing_user = db.query(User).filter(User.phone_number == user.phone_number).first()
+    existing_user = (await db.execute(select(User.id).filter(User.phone_number == user.phone_number))).first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Phone number or email  already registered")
 
     # check if business name exists
-    existing_merchant = db.query(Merchant).filter(Merchant.business_name == user.business_name).first()
+    existing_merchant = (await db.execute(select(Merchant.id).filter(Merchant.business_name == user.business_name))).first()
     if existing_merchant:
         raise HTTPException(status_code=400, detail="Business name already registered")
 
     merchant_code = generate_merchant_code()
+    while await merchant_code_exists(db, merchant_code):
+        merchant_code = generate_merchant_code()
 
     print("**********GENERATED MERCHANT CODE**********", merchant_code)
 
@@ -129,27 +130,26 @@ async def register_merchant(user: MerchantCreate, db: Session = Depends(get_db),
     print("**********GENERATED PIN**********", user.pin)
 
     pin = user.pin
-    user.pin = secure_pwd(pin)
+    user.pin = await asecure_pwd(pin)
 
     if user.password:
-        user.password = secure_pwd(user.password)
+        user.password = await asecure_pwd(user.password)
         
-    user.username = generate_username(db, user.first_name, user.last_name)
-    new_user = create_merchant_user(db, user, merchant_code)
+    user.username = await generate_username(db, user.first_name, user.last_name)
+    new_user = await create_merchant_user(db, user, merchant_code)
 
     # send welcome SMS with merchant code
-    response = sendsms(user.phone_number,
-                       f"Bienvenue sur {settings.PROJECT_NAME}! Votre code PIN est : {pin} et votre code marchand est : {merchant_code}")
-    if not response:
-        raise HTTPException(status_code=500, detail="Failed to send SMS")
+    enqueue_sms(user.phone_number,
+                f"Bienvenue sur {settings.PROJECT_NAME}! Votre code PIN est : {pin} et votre code marchand est : {merchant_code}", SMS_WELCOME)
 
     return new_user
 
 
 @router.post("/login", response_model=UserLoginResponse)
-def login_user(user: UserLogin, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(
-        or_(User.phone_number == user.phone_number, User.email == user.phone_number)).first()
+async def login_user(user: UserLogin, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(User).filter(
+        or_(User.phone_number == user.phone_number, User.email == user.phone_number)))
+    db_user = result.scalars().first()
 
     if not db_user:
         raise HTTPException(status_code=400, detail="Invalid credentials")
@@ -158,11 +158,23 @@ def login_user(user: UserLogin, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Invalid credentials")
 
     # Check if the provided pin or password is valid
-    if user.pin and verify_pwd(user.pin, db_user.pin) == False:
-        raise HTTPException(status_code=400, detail="Invalid credentials")
+    if user.pin:
+        valid, new_hash = await averify_and_update(user.pin, db_user.pin)
+        if not valid:
+            raise HTTPException(status_code=400, detail="Invalid credentials")
+        if new_hash:
+            db_user.pin = new_hash
+
+    if user.password:
+        valid, new_hash = await averify_and_update(user.password, db_user.password)
+        if not valid:
+            raise HTTPException(status_code=400, detail="Invalid password")
+        if new_hash:
+            db_user.password = new_hash
 
-    if user.password and verify_pwd(user.password, db_user.password) == False:
-        raise HTTPException(status_code=400, detail="Invalid password")
+    # Hashes made with an older cost factor are replaced by the ones computed above
+    if db.dirty:
+        await db.commit()
 
     # Génération des tokens JWT
     access_token = create_access_token({'sub': user.phone_number})
@@ -181,23 +193,23 @@ def refresh_token(r_token: str = Depends(refresh_token)):
 
 
 @router.get("/me", response_model=UserResponse)
-def get_current_user(current_user: User = Depends(get_current_user)):
+async def get_current_user(current_user: User = Depends(get_current_user)):
     return current_user
 
 
 @router.get("/users", response_model=Page[UserResponse])
-def get_users(
-        db: Session = Depends(get_db),
+async def get_users(
+        db: AsyncSession = Depends(get_db),
         role: UserRole = Query(None, description="Filter user by role  (client, partner, merchant, admin)"),
         name: str = Query(None, description="Filter user by name"),
         phone_number: str = Query(None, description="Filter user by phone number"),
-        user: User = Depends(role_required(['partner', 'admin']))):
+        user: Principal = Depends(role_required(['partner', 'admin']))):
     """
     Get all users filtered by role, name, and phone number. based on the current user role.
     """
     query = select(User).filter(user.phone_number != User.phone_number)
 
-    if user.partner:
+    if user.has_role("partner"):
         query = query.filter(
             or_(
                 User.merchant.registered_by == user.id,
@@ -206,11 +218,11 @@ def get_users(
         )
 
     if role:
-        if role == "partner" and user.admin:
+        if role == "partner" and user.has_role("admin"):
             query = query.filter(User.partner)
-        elif role == "client" and (user.admin or user.partner):
+        elif role == "client" and user.has_role("admin", "partner"):
             query = query.filter(User.client)
-        elif role == "merchant" and (user.admin or user.partner):
+        elif role == "merchant" and user.has_role("admin", "partner"):
             query = query.filter(User.merchant)
         else:
             raise HTTPException(
@@ -224,4 +236,4 @@ def get_users(
     if phone_number:
         query = query.filter(User.phone_number.ilike(f"%{phone_number}%"))
 
-    return paginate(db, query.order_by(User.updated_at.desc()))
+    return await paginate(db, query.order_by(User.updated_at.desc()))
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends
+
+from app.configs.database import sync_pool_metrics, async_pool_metrics
+from app.core.http_client import http_clients
+from app.core.oauth import role_required
+from app.core.principal_cache import Principal
+from app.schemas.metrics_schema import DatabasePoolsResponse, UpstreamsResponse
+
+router = APIRouter(
+    prefix="/api/v1/metrics",
+    tags=["Metrics"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@router.get("/db-pool", response_model=DatabasePoolsResponse)
+async def get_db_pool_metrics(reset: bool = False, user: Principal = Depends(role_required(['admin']))):
+    """
+    Connection pool usage of this worker: live checked-out/overflow gauges, checkout
+    counters and the time spent waiting for a connection since the last reset.
+    """
+    pools = [async_pool_metrics.snapshot(), sync_pool_metrics.snapshot()]
+    if reset:
+        async_pool_metrics.reset()
+        sync_pool_metrics.reset()
+    return {"pools": pools}
+
+
+@router.get("/upstreams", response_model=UpstreamsResponse)
+async def get_upstream_metrics(user: Principal = Depends(role_required(['admin']))):
+    """
+    Latency histograms of the outbound HTTP calls of this worker, per upstream.
+    """
+    return {"upstreams": [{"upstream": upstream, **histogram} for upstream, histogram in http_clients.snapshot().items()]}
@@ -1,5 +1,6 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession as Session
 import logging
 # Configuration du logger
 logging.basicConfig(level=logging.INFO)
@@ -7,12 +8,13 @@ logger = logging.getLogger(__name__)
 
 from app.configs.database import get_db
 from app.core.oauth import get_current_user
-from app.core.send_sms import sendsms
-from app.core.utils import verify_pwd
-from app.models.transaction_model import Transaction
+from app.core.hashing import averify_pwd
+from app.core.idempotency import idempotent
 from app.models.user_model import User
 from app.schemas.transaction_schema import RechargeRequest, Operator, TransactionResponse, RechareCardRequest, CheckoutSessionResponse, CreatePaymentCardRequest, PaymentCardsResponse
 from app.core.stripe_payment import StripePayment
+from app.core.money import to_minor_units
+from app.services.payments import PaymentError, recharge
 
 from app.configs.cybersource_config import CyberSourceConfig
 
@@ -23,50 +25,40 @@ router = APIRouter(
 )
 
 @router.post("/mobile-money", response_model=TransactionResponse)
-async def recharge_using_mobile_money(data: RechargeRequest, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    # Check if PIN is correct
-    if not verify_pwd(str(data.pin), user.pin):
-        raise HTTPException(status_code=400, detail="Invalid PIN")
-
-    # Verify operator is supported
-    if data.operator not in [Operator.ORANGE, Operator.MTN]:
-        raise HTTPException(status_code=400, detail="Unsupported operator")
+async def recharge_using_mobile_money(
+    data: RechargeRequest,
+    idempotency_key: str = Header(None, alias="Idempotency-Key", max_length=255),
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    async def run(claim):
+        # Check if PIN is correct
+        if not await averify_pwd(str(data.pin), user.pin):
+            raise HTTPException(status_code=400, detail="Invalid PIN")
+
+        # Verify operator is supported
+        if data.operator not in [Operator.ORANGE, Operator.MTN]:
+            raise HTTPException(status_code=400, detail="Unsupported operator")
 
-    try:
         # response = paycool(data.amount, user.phone_number)
         # if response["status"] != "success":
         #     raise HTTPException(status_code=400, detail="Payment failed")
 
-        # Create credit transaction
-        credit_transaction = Transaction(
-            amount=data.amount,
-            user_id=user.id,
-            transaction_type="credit",
-            status="completed"
-        )
-        db.add(credit_transaction)
-
-        # Update user balance
-        user.wallet.balance += data.amount
-        db.commit()  # Commit changes
-        db.refresh(user.wallet)  # Refresh wallet after update
-        db.refresh(credit_transaction)
-
-        # Send SMS notification
-        sendsms(
-            user.phone_number,
-            f"Vous avez rechargé votre compte de {data.amount} FCFA. Votre nouveau solde est de {user.wallet.balance} FCFA."
-        )
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail="Transaction failed")
+        try:
+            return await recharge(db, user, data.amount, before_commit=claim.complete if claim else None)
+        except PaymentError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail="Transaction failed")
 
-    return credit_transaction
+    return await idempotent(idempotency_key, user.id, "recharge_mobile_money", data, run, TransactionResponse)
 
 @router.post("/card", response_model=CheckoutSessionResponse)
 async def recharge_using_card(data: RechareCardRequest, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     # Check if PIN is correct
-    if not verify_pwd(str(data.pin), user.pin):
+    if not await averify_pwd(str(data.pin), user.pin):
         raise HTTPException(status_code=400, detail="Invalid PIN")
 
     # get user currency
@@ -84,21 +76,21 @@ async def recharge_using_card(data: RechareCardRequest, user: User = Depends(get
     if data.amount < min_amount:
         raise HTTPException(status_code=400, detail="Invalid amount")
 
-    # make data.amount to valid stripe integer
-    data.amount = int(data.amount) * 100
+    # Stripe wants the amount in the smallest unit of the currency (XAF has no decimals)
+    amount = to_minor_units(data.amount, currency)
 
     # create checkout session
     stripe = StripePayment()
 
     metadata = {
         "user_id": user.id,
-        "amount": data.amount,
+        "amount": amount,
         "currency": currency
     }
 
     # TODO: add dynamic country code
     country_code = "US"
-    session = stripe.create_payment_intent(data.amount, currency, metadata=metadata)
+    session = await run_in_threadpool(stripe.create_payment_intent, amount, currency, metadata=metadata)
 
     if not session:
         raise HTTPException(status_code=500, detail="Payment failed")
@@ -213,7 +205,8 @@ async def test(card_data: PaymentCardData, db: Session = Depends(get_db)):
 
 
         payments_api = PaymentsApi(config)
-        data, status, body = payments_api.create_payment(payment_request)
+        # Blocking HTTP call of the CyberSource SDK, off the event loop
+        data, status, body = await run_in_threadpool(payments_api.create_payment, payment_request)
 
         if status == 201:
             return {
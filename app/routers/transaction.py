@@ -1,19 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import or_, select
+import csv
+import io
+from decimal import Decimal, InvalidOperation
+
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Header, Form, File, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession as Session
+from sqlalchemy.orm import joinedload
+from sqlalchemy import select
 from app.configs.database import get_db
 from app.configs.config import settings
-from app.models.transaction_model import Transaction
-from app.models.user_model import User, get_user, convert_currency
-from app.models.roles_model import Merchant, get_merchant
-from app.schemas.transaction_schema import TransferRequest, TransactionResponse, WithdrawRequest
+from app.models.transaction_model import Transaction, history_page_query, history_count_query, history_export_query
+from app.models.user_model import User, get_user
+from app.models.roles_model import Merchant, get_merchant_by_code
+from app.schemas.transaction_schema import TransferRequest, TransactionResponse, TransactionHistoryPage, WithdrawRequest, BulkTransferRequest, BulkTransferResponse, ExportFormat
 from app.schemas.user_schema import  UserResponse
-from app.core.oauth import get_current_user
-from app.core.utils import verify_pwd
-from app.core.send_sms import sendsms
+from app.core.oauth import get_current_user, get_current_principal, role_required
+from app.core.principal_cache import Principal
+from app.core.hashing import averify_pwd
+from app.core.pagination import cursor_page_response
+from app.core.idempotency import idempotent
 from datetime import datetime, timedelta
-from fastapi_pagination import Page, paginate
 from app.core.stripe_payment import StripePayment
+from app.services.exports import history_exporter
+from app.services.payments import PaymentError, BulkTransferRow, bulk_transfer, transfer, withdraw
+from app.models.stripe_event_model import record_stripe_event
+from app.services.stripe_events import HANDLERS as STRIPE_EVENT_HANDLERS, stripe_event_processor
 
 router = APIRouter(
     prefix="/api/v1/transactions",
@@ -23,201 +35,213 @@ router = APIRouter(
 
 
 @router.get('/verify-recipient/{phone_number}', response_model=UserResponse)
-def transfer_verify_recipient(phone_number: str, current_user: User = Depends(get_current_user), db:Session = Depends(get_db)):
+async def transfer_verify_recipient(phone_number: str, current_user: User = Depends(get_current_user), db:Session = Depends(get_db)):
     
     
-    u = db.query(User).filter(User.phone_number == phone_number).first()
+    u = await get_user(db, phone_number)
 
     if not u:
         raise HTTPException(status_code=404, detail="User not found")
     return u
 
 @router.post("/transfer", response_model=TransactionResponse)
-def transfer_funds(
+async def transfer_funds(
     transaction: TransferRequest,
+    idempotency_key: str = Header(None, alias="Idempotency-Key", max_length=255),
     user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    # Check user is different from recipient
-    if user.phone_number == transaction.recipient_phone:
-        raise HTTPException(status_code=400, detail="You cannot transfer funds to yourself")
+    async def run(claim):
+        # Check user is different from recipient
+        if user.phone_number == transaction.recipient_phone:
+            raise HTTPException(status_code=400, detail="You cannot transfer funds to yourself")
+
+        # Verify PIN
+        if not await averify_pwd(str(transaction.pin), user.pin):
+            raise HTTPException(status_code=400, detail="Invalid PIN")
+
+        # Get recipient user with wallet loaded
+        recipient_user = await get_user(db, transaction.recipient_phone)
+        if not recipient_user:
+            raise HTTPException(status_code=404, detail="Recipient user not found")
+
+        try:
+            # The response of the Idempotency-Key commits with the transfer
+            return await transfer(db, user, recipient_user, transaction.amount,
+                                  before_commit=claim.complete if claim else None)
+        except PaymentError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        except HTTPException:
+            raise
+        except Exception:
+            raise HTTPException(status_code=500, detail="Transaction processing failed")
+
+    # A retry with the same key gets the first response back, without a second debit
+    return await idempotent(idempotency_key, user.id, "transfer", transaction, run, TransactionResponse)
 
-    # Verify PIN
-    if not verify_pwd(str(transaction.pin), user.pin):
-        raise HTTPException(status_code=400, detail="Invalid PIN")
+@router.post('/withdraw', response_model=TransactionResponse)
+async def withdraw_funds(
+    transaction: WithdrawRequest,
+    idempotency_key: str = Header(None, alias="Idempotency-Key", max_length=255),
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    async def run(claim):
+        # Vérifier si le PIN est correct
+        if not await averify_pwd(str(transaction.pin), user.pin):
+            raise HTTPException(status_code=400, detail="Invalid PIN")
+
+        # Vérifier si l'utilisateur a suffisamment de fonds
+        if user.wallet.balance < transaction.amount:
+            raise HTTPException(status_code=400, detail="Insufficient funds")
+
+        # Vérifier si le commerçant existe avec le code du commerçant et le numéro de téléphone fournis
+        merchant = await get_merchant_by_code(db, transaction.merchan_phone, transaction.merchant_code)
 
-    # Get recipient user with wallet loaded
-    recipient_user = (
-        db.query(User)
-        .options(joinedload(User.wallet))
-        .filter(User.phone_number == transaction.recipient_phone)
-        .first()
+        if not merchant:
+            raise HTTPException(status_code=400, detail="Merchant not found or invalid merchant code")
+
+        # Récupérer le propriétaire du commerçant
+        merchant_owner = await db.get(User, merchant.owner_id)
+        if not merchant_owner:
+            raise HTTPException(status_code=400, detail="Merchant owner not found")
+
+        try:
+            return await withdraw(db, user, merchant_owner, transaction.amount,
+                                  before_commit=claim.complete if claim else None)
+        except PaymentError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(e)
+            raise HTTPException(status_code=500, detail="Transaction failed")
+
+    return await idempotent(idempotency_key, user.id, "withdraw", transaction, run, TransactionResponse)
+
+BULK_TRANSFER_CSV_COLUMNS = ["line", "recipient_phone", "amount", "status", "transaction_id", "error"]
+
+
+def read_bulk_transfer_csv(content: bytes) -> list:
+    """
+    Rows of an uploaded CSV with a header naming a phone (or recipient_phone) and an amount column.
+    """
+    reader = csv.DictReader(io.StringIO(content.decode("utf-8-sig")))
+    fields = {(name or "").strip().lower(): name for name in reader.fieldnames or []}
+    phone_field = fields.get("recipient_phone") or fields.get("phone")
+    amount_field = fields.get("amount")
+    if not phone_field or not amount_field:
+        raise HTTPException(status_code=400, detail="The CSV needs a phone and an amount column")
+
+    rows = []
+    for record in reader:
+        phone = (record.get(phone_field) or "").strip()
+        value = (record.get(amount_field) or "").strip()
+        if not phone and not value:
+            continue
+        try:
+            amount = Decimal(value.replace(",", "."))
+            if not amount.is_finite():
+                amount = None
+        except InvalidOperation:
+            amount = None
+        rows.append(BulkTransferRow(line=reader.line_num, recipient_phone=phone, amount=amount))
+    return rows
+
+
+def bulk_transfer_response(rows: list) -> BulkTransferResponse:
+    succeeded = [row for row in rows if row.status == "completed"]
+    return BulkTransferResponse(
+        total=len(rows),
+        succeeded=len(succeeded),
+        failed=len(rows) - len(succeeded),
+        debited=sum((row.amount + row.fee for row in succeeded), Decimal(0)),
+        rows=rows,
     )
-    if not recipient_user:
-        raise HTTPException(status_code=404, detail="Recipient user not found")
-
-    # Validate amount
-    if transaction.amount < 50:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Minimum transfer amount is 50 {user.wallet.currency}"
-        )
-
-    # Check sufficient funds
-    if user.wallet.balance < transaction.amount:
-        raise HTTPException(status_code=400, detail="Insufficient funds")
-
-    try:
-        # Load both users with relationships for the response
-        db.refresh(user)
-        db.refresh(recipient_user)
-
-        sender_currency = user.wallet.currency
-        recipient_currency = recipient_user.wallet.currency
-        
-        # Handle currency conversion if needed
-        converted_amount = (
-            convert_currency(db, transaction.amount, sender_currency, recipient_currency)
-            if sender_currency != recipient_currency
-            else transaction.amount
-        )
-
-        # Create debit transaction with relationships loaded
-        debit_transaction = Transaction(
-            amount=transaction.amount,
-            user_id=user.id,
-            user=user,  # Set relationship explicitly
-            transaction_type="debit",
-            recipient_id=recipient_user.id,
-            recipient=recipient_user,  # Set relationship explicitly
-            status="completed",
-            currency=sender_currency,
-            created_at=datetime.utcnow()
-        )
-
-        # Update balances
-        user.wallet.balance -= transaction.amount
-        recipient_user.wallet.balance += converted_amount
-
-        # Add and commit
-        db.add(debit_transaction)
-        db.commit()
-
-        # Explicitly refresh with relationships
-        db.refresh(debit_transaction)
-        debit_transaction.user = user
-        debit_transaction.recipient = recipient_user
-
-        # Send notifications
-        sendsms(
-            recipient_user.phone_number,
-            f"You received {converted_amount} {recipient_currency} from {user.phone_number}. New balance: {recipient_user.wallet.balance} {recipient_currency}."
-        )
-        sendsms(
-            user.phone_number,
-            f"You sent {transaction.amount} {sender_currency} to {recipient_user.phone_number}. New balance: {user.wallet.balance} {sender_currency}."
-        )
-
-        return debit_transaction
-
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail="Transaction processing failed")
 
-@router.post('/withdraw', response_model=TransactionResponse)
-def withdraw_funds(transaction: WithdrawRequest, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    # Vérifier si le PIN est correct
-    if not verify_pwd(str(transaction.pin), user.pin):
-        raise HTTPException(status_code=400, detail="Invalid PIN")
 
-    # Vérifier si l'utilisateur a suffisamment de fonds
-    if user.wallet.balance < transaction.amount:
-        raise HTTPException(status_code=400, detail="Insufficient funds")
+def bulk_transfer_csv(rows: list) -> str:
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(BULK_TRANSFER_CSV_COLUMNS)
+    for row in rows:
+        writer.writerow([row.line, row.recipient_phone, row.amount, row.status, row.transaction_id, row.error])
+    return output.getvalue()
 
-    # Vérifier si le commerçant existe avec le code du commerçant et le numéro de téléphone fournis
-    merchant = get_merchant(db, transaction.merchan_phone)
 
-    if not merchant:
-        raise HTTPException(status_code=400, detail="Merchant not found or invalid merchant code")
+async def run_bulk_transfer(db: Session, user: User, pin: int, rows: list, claim=None, result=None) -> list:
+    """
+    `result` turns the rows into what the endpoint returns, for the claim of the Idempotency-Key.
+    """
+    if len(rows) > settings.BULK_TRANSFER_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.BULK_TRANSFER_MAX_ROWS} payments per bulk transfer")
 
-    if not verify_pwd(str(transaction.merchant_code), merchant.merchant_code):
-        raise HTTPException(status_code=400, detail="Merchant not found or invalid merchant code")
+    # One PIN check for the whole run
+    if not await averify_pwd(str(pin), user.pin):
+        raise HTTPException(status_code=400, detail="Invalid PIN")
 
-    try:
-        # Récupérer le propriétaire du commerçant
-        merchant_owner = db.query(User).filter(User.merchant == merchant).first()
+    before_commit = None
+    if claim:
+        # Each chunk commits on its own: once they start, the key is never released,
+        # the response is stored by the last transaction
+        claim.keep()
+        result = result or (lambda rows: rows)
 
-        if not merchant_owner:
-            raise HTTPException(status_code=400, detail="Merchant owner not found")
+        async def before_commit(db, rows):
+            await claim.complete(db, result(rows))
 
-        # Obtenez les taux de change pour convertir entre les devises des deux utilisateurs
-        sender_currency = user.wallet.currency
-        recipient_currency = merchant_owner.wallet.currency
+    return await bulk_transfer(db, user, rows, settings.BULK_TRANSFER_CHUNK_SIZE, before_commit=before_commit)
 
-        # Si les devises sont différentes, effectuer la conversion
-        if sender_currency != recipient_currency:
-            # Calculer le montant converti
-            converted_amount = convert_currency(db, transaction.amount, sender_currency, recipient_currency)
-        else:
-            # Si la devise de l'expéditeur et du commerçant est la même, il n'y a pas de conversion
-            converted_amount = transaction.amount
-
-        # Créer la transaction de débit pour l'utilisateur
-        debit_transaction = Transaction(
-            amount=transaction.amount,
-            user_id=user.id,
-            recipient_id=merchant_owner.id,
-            transaction_type="debit",
-            status="completed",
-            currency=sender_currency  # Enregistrer la devise de l'utilisateur
-        )
-
-        # Créer la transaction de crédit pour le commerçant
-        credit_transaction = Transaction(
-            amount=converted_amount,
-            user_id=merchant_owner.id,
-            recipient_id=merchant_owner.id,
-            transaction_type="credit",
-            status="completed",
-            currency=recipient_currency  # Enregistrer la devise du commerçant
-        )
-
-        # Mettre à jour les soldes des utilisateurs
-        user.wallet.balance -= transaction.amount
-        merchant_owner.wallet.balance += converted_amount
-
-        # Ajouter et valider les deux transactions
-        db.add(debit_transaction)
-        db.add(credit_transaction)
-        db.commit()  # Valider une seule fois pour toutes les modifications
-
-        # Rafraîchir les données pour obtenir les informations mises à jour
-        db.refresh(user.wallet)
-        db.refresh(merchant_owner.wallet)
-        db.refresh(debit_transaction)
-        db.refresh(credit_transaction)
-
-    except Exception as e:
-        print(e)
-        raise HTTPException(status_code=500, detail="Transaction failed")
-
-    # Envoyer un SMS à l'utilisateur et au commerçant
-    sendsms(
-        user.phone_number,
-        f"Vous avez retiré {transaction.amount} {sender_currency}. Votre nouveau solde est de {user.wallet.balance} {sender_currency}."
-    )
-    sendsms(
-        merchant_owner.phone_number,
-        f"Vous avez reçu {converted_amount} {recipient_currency} de {user.phone_number}. Votre nouveau solde est de {merchant_owner.wallet.balance} {recipient_currency}."
-    )
 
-    return debit_transaction
+@router.post("/bulk-transfer", response_model=BulkTransferResponse)
+async def bulk_transfer_funds(
+    request: BulkTransferRequest,
+    idempotency_key: str = Header(None, alias="Idempotency-Key", max_length=255),
+    principal: Principal = Depends(role_required(['merchant', 'partner', 'admin'])),
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    rows = [
+        BulkTransferRow(line=line, recipient_phone=item.recipient_phone, amount=item.amount)
+        for line, item in enumerate(request.items, start=1)
+    ]
+
+    async def run(claim):
+        return bulk_transfer_response(await run_bulk_transfer(db, user, request.pin, rows, claim, bulk_transfer_response))
 
-@router.get("/history", response_model=Page[TransactionResponse])
-def get_transaction_history(
+    return await idempotent(idempotency_key, user.id, "bulk_transfer", request, run, BulkTransferResponse, takeover=False)
+
+
+@router.post("/bulk-transfer/csv")
+async def bulk_transfer_funds_csv(
+    pin: int = Form(...),
+    file: UploadFile = File(..., description="CSV with a phone and an amount column"),
+    idempotency_key: str = Header(None, alias="Idempotency-Key", max_length=255),
+    principal: Principal = Depends(role_required(['merchant', 'partner', 'admin'])),
     user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Same as /bulk-transfer from a CSV upload, the result comes back as a CSV with one line per payment.
+    """
+    content = await file.read()
+    rows = read_bulk_transfer_csv(content)
+
+    async def run(claim):
+        return await run_bulk_transfer(db, user, pin, rows, claim)
+
+    return await idempotent(idempotency_key, user.id, "bulk_transfer_csv", f"{pin}\n".encode() + content, run,
+                            serialize=bulk_transfer_csv, media_type="text/csv", takeover=False)
+
+
+@router.get("/history", response_model=TransactionHistoryPage)
+async def get_transaction_history(
+    user: Principal = Depends(get_current_principal),
     start_date: datetime = Query(None, description="Filter transactions by start date"),
     end_date: datetime = Query(None, description="Filter transactions by end date"),
+    cursor: str = Query(None, description="Cursor returned by the previous page"),
+    size: int = Query(50, ge=1, le=100, description="Page size"),
+    include_total: bool = Query(False, description="Also count the transactions of the period (one more query)"),
     db: Session = Depends(get_db)
 ):
 
@@ -226,38 +250,62 @@ def get_transaction_history(
     if not end_date:
         end_date = datetime.now()
 
-    query = db.query(Transaction).options(
-            joinedload(Transaction.user),
-            joinedload(Transaction.recipient)
-        ).filter(
-        Transaction.created_at.between(start_date, end_date)
-    )
+    user_id = None if user.has_role("admin") else user.id
+    result = await db.execute(history_page_query(user_id, start_date, end_date, cursor, size))
+    total = None
+    if include_total:
+        total = await db.scalar(history_count_query(user_id, start_date, end_date))
+    return cursor_page_response(result.scalars().all(), size, total)
 
-    if not user.admin:
-        query = query.filter(or_(
-            Transaction.user_id == user.id,
-            Transaction.recipient_id == user.id
-        ))
 
-    return paginate(query.order_by(Transaction.created_at.desc()).all())
+@router.get("/history/export")
+async def export_transaction_history(
+    user: Principal = Depends(get_current_principal),
+    start_date: datetime = Query(None, description="Filter transactions by start date"),
+    end_date: datetime = Query(None, description="Filter transactions by end date"),
+    transaction_type: str = Query(None, description="Only the transactions of this type (debit, credit...)"),
+    user_id: int = Query(None, description="Admins only: the transactions of this user, all of them otherwise"),
+    export_format: ExportFormat = Query(ExportFormat.CSV, alias="format"),
+):
+    """
+    The whole history of the period as a CSV or NDJSON download, streamed as it is read.
+    """
+    if not start_date:
+        start_date = datetime.now() - timedelta(days=30)
+    if not end_date:
+        end_date = datetime.now()
+
+    if not user.has_role("admin"):
+        if user_id is not None and user_id != user.id:
+            raise HTTPException(status_code=403, detail="Access forbidden: Insufficient role")
+        user_id = user.id
+
+    query = history_export_query(user_id, start_date, end_date, transaction_type)
+    filename = f"transactions_{start_date:%Y%m%d}_{end_date:%Y%m%d}.{export_format.value}"
+    return StreamingResponse(
+        history_exporter.stream(query, export_format.value),
+        media_type=history_exporter.media_types[export_format.value],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 
 @router.get("/history/{transaction_id}", response_model=TransactionResponse)
-def get_transaction(
+async def get_transaction(
         transaction_id: int,
-        user: User = Depends(get_current_user),
+        user: Principal = Depends(get_current_principal),
         db: Session = Depends(get_db)):
-    transaction = db.query(Transaction).options(
-            joinedload(Transaction.user),
-            joinedload(Transaction.recipient)
-        ).filter(transaction_id == Transaction.id, user.id == Transaction.user_id).first()
+    result = await db.execute(select(Transaction).options(
+            joinedload(Transaction.user).lazyload("*"),
+            joinedload(Transaction.recipient).lazyload("*")
+        ).filter(transaction_id == Transaction.id, user.id == Transaction.user_id))
+    transaction = result.scalars().first()
     if not transaction:
         raise HTTPException(status_code=404, detail="Transaction not found")
     return transaction
 
 
 @router.post('/pay-service')
-def pay_service(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def pay_service(user: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
     # Implement the logic to pay for a service
     # This could involve creating a transaction, updating user balance, etc.
     # input data: service_id, amount, pin
@@ -270,45 +318,18 @@ def pay_service(user: User = Depends(get_current_user), db: Session = Depends(ge
 async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
     stripe = StripePayment()
     payload = await request.body()
-    event = stripe.webhook_handler(payload, request.headers["Stripe-Signature"])
-    
-    event_type = event["type"]
-    data_object = event["data"]["object"]
-
-    if event_type == "payment_intent.succeeded":
-        session = data_object
-        print("Payment intent succeeded:", session["id"])
-
-        metadata = session["metadata"]
-
-        user_id = metadata["user_id"]
-        amount = metadata["amount"]
-        currency = metadata["currency"]
-
-        recharge_amount = float(amount) / 100
-        credit_transaction = Transaction(
-            amount= recharge_amount,
-            user_id=user_id,
-            recipient_id=user_id,
-            transaction_type="credit",
-            status="completed",
-            currency=currency,
-        )
-
-        db.add(credit_transaction)
-        
-        # get user from user_id and update wallet balance
-        user = db.query(User).filter(User.id == user_id).first()
-        user.wallet.balance += recharge_amount
-        db.commit()  # Commit changes
-
-
-
-        print(f"User ID: {user_id}, Amount: {amount}, Currency: {currency}")
+    event = await run_in_threadpool(stripe.webhook_handler, payload, request.headers["Stripe-Signature"])
 
+    event_type = event["type"]
 
-        # TODO: send notification to user
+    # Only recorded here, so Stripe gets its answer quickly: the wallet is credited by
+    # stripe_event_processor, and a redelivered event is recorded once
+    if event_type in STRIPE_EVENT_HANDLERS:
+        if await record_stripe_event(db, event):
+            stripe_event_processor.notify()
+        else:
+            print(f"Stripe event {event['id']} already received")
     else:
         print(f"Unhandled event type {event_type}")
 
-    return {"status": "success"}
\ No newline at end of file
+    return {"status": "success"}
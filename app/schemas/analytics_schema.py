@@ -0,0 +1,47 @@
+from datetime import date
+from enum import Enum
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from app.core.money import Amount
+
+
+class AnalyticsDimension(str, Enum):
+    CURRENCY = "currency"
+    DAY = "day"
+    CHANNEL = "channel"  # mobile_money, stripe or wallet
+    MERCHANT = "merchant"
+    TRANSACTION_TYPE = "transaction_type"
+
+
+class VolumeLine(BaseModel):
+    currency: str
+    day: Optional[date] = None
+    channel: Optional[str] = None
+    merchant_id: Optional[int] = None
+    merchant: Optional[str] = None
+    transaction_type: Optional[str] = None
+    amount: Amount
+    fees: Amount
+    count: int
+
+
+class VolumesResponse(BaseModel):
+    start_date: date
+    end_date: date
+    group_by: List[AnalyticsDimension]
+    items: List[VolumeLine]
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "start_date": "2026-09-01",
+                "end_date": "2026-09-30",
+                "group_by": ["merchant"],
+                "items": [
+                    {"currency": "XAF", "merchant_id": 12, "merchant": "Boutique Akwa", "amount": 1250000, "fees": 12500, "count": 431}
+                ]
+            }
+        }
+    }
@@ -0,0 +1,66 @@
+from typing import Dict, List
+
+from pydantic import BaseModel
+
+
+class PoolMetricsResponse(BaseModel):
+    name: str
+    pool_size: int
+    checked_in: int
+    checked_out: int
+    overflow: int
+    checkouts: int
+    checkins: int
+    connects: int
+    invalidations: int
+    timeouts: int
+    wait_count: int
+    wait_avg_ms: float
+    wait_max_ms: float
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "name": "async",
+                "pool_size": 10,
+                "checked_in": 7,
+                "checked_out": 3,
+                "overflow": 0,
+                "checkouts": 15230,
+                "checkins": 15227,
+                "connects": 10,
+                "invalidations": 0,
+                "timeouts": 0,
+                "wait_count": 15230,
+                "wait_avg_ms": 0.12,
+                "wait_max_ms": 35.4
+            }
+        }
+    }
+
+class DatabasePoolsResponse(BaseModel):
+    pools: List[PoolMetricsResponse]
+
+class UpstreamMetricsResponse(BaseModel):
+    upstream: str
+    requests: int
+    errors: int
+    avg_ms: float
+    max_ms: float
+    buckets: Dict[str, int]
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "upstream": "sms",
+                "requests": 1200,
+                "errors": 3,
+                "avg_ms": 182.5,
+                "max_ms": 2310.0,
+                "buckets": {"le_100ms": 240, "le_250ms": 870, "le_500ms": 80, "le_2500ms": 10}
+            }
+        }
+    }
+
+class UpstreamsResponse(BaseModel):
+    upstreams: List[UpstreamMetricsResponse]
@@ -4,7 +4,7 @@ from datetime import datetime
 
 class SessionCreate(BaseModel):
     session_id: str
-    user_id: int
+    user_id: Optional[int] = None
     state: str
     data: dict
 
@@ -39,7 +39,7 @@ class SessionUpdate(BaseModel):
 class SessionResponse(BaseModel):
     id: int
     session_id: str
-    user_id: int
+    user_id: Optional[int]
     state: str
     data: dict
     is_active: bool
@@ -0,0 +1,41 @@
+from datetime import date
+from enum import Enum
+from typing import List
+
+from pydantic import BaseModel
+
+from app.core.money import Amount
+
+
+class StatementPeriod(str, Enum):
+    DAY = "day"
+    MONTH = "month"
+
+
+class StatementLine(BaseModel):
+    period: date  # the day, or the first day of the month
+    currency: str
+    inflow: Amount
+    outflow: Amount  # fees included
+    fees: Amount
+    count: int
+
+
+class StatementResponse(BaseModel):
+    start_date: date
+    end_date: date
+    period: StatementPeriod
+    items: List[StatementLine]
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "start_date": "2026-09-01",
+                "end_date": "2026-09-30",
+                "period": "day",
+                "items": [
+                    {"period": "2026-09-01", "currency": "XAF", "inflow": 25000, "outflow": 10100, "fees": 100, "count": 3}
+                ]
+            }
+        }
+    }
@@ -1,12 +1,14 @@
 from pydantic import BaseModel
 from datetime import datetime
 from enum import Enum
-from typing import Optional
+from typing import List, Optional
+
+from app.core.money import Amount
 
 # Schéma pour les transferts
 class TransferRequest(BaseModel):
     recipient_phone: str
-    amount: float
+    amount: Amount
     pin: int
 
     model_config = {
@@ -20,7 +22,7 @@ class TransferRequest(BaseModel):
     }
 
 class WithdrawRequest(BaseModel):
-    amount: float
+    amount: Amount
     pin: int
     merchant_code: str
     merchan_phone: str
@@ -36,13 +38,51 @@ class WithdrawRequest(BaseModel):
         }
     }
 
+class BulkTransferItem(BaseModel):
+    recipient_phone: str
+    amount: Amount
+
+class BulkTransferRequest(BaseModel):
+    pin: int
+    items: List[BulkTransferItem]
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "pin": 12345,
+                "items": [
+                    {"recipient_phone": "237691882411", "amount": 25000},
+                    {"recipient_phone": "237691882412", "amount": 30000}
+                ]
+            }
+        }
+    }
+
+class BulkTransferRowResponse(BaseModel):
+    line: int
+    recipient_phone: str
+    amount: Optional[Amount]
+    status: str
+    transaction_id: Optional[int] = None
+    error: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+class BulkTransferResponse(BaseModel):
+    total: int
+    succeeded: int
+    failed: int
+    debited: Amount  # fees included
+    rows: List[BulkTransferRowResponse]
+
 class Operator(str, Enum):
     ORANGE = "ORANGE"
     MTN = "MTN"
 
 # Schéma pour la recharge
 class RechargeRequest(BaseModel):
-    amount: float
+    amount: Amount
     operator: Operator
     pin: int
 
@@ -57,7 +97,7 @@ class RechargeRequest(BaseModel):
     }
 
 class RechareCardRequest(BaseModel):
-    amount: float
+    amount: Amount
     pin: int
 
     model_config = {
@@ -71,7 +111,7 @@ class RechareCardRequest(BaseModel):
 # Schéma pour un paiement
 class PaymentRequest(BaseModel):
     merchant_code: str
-    amount: float
+    amount: Amount
 
     class Config:
         from_attributes = True
@@ -91,8 +131,8 @@ class UserResponse(BaseModel):
 
 class TransactionResponse(BaseModel):
     id: int
-    amount: float
-    fees: float
+    amount: Amount
+    fees: Amount
     status: str
     user: UserResponse  
     recipient: Optional[UserResponse] 
@@ -125,11 +165,22 @@ class TransactionResponse(BaseModel):
         }
 
 
+class ExportFormat(str, Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
+
+
+class TransactionHistoryPage(BaseModel):
+    items: List[TransactionResponse]
+    next_cursor: Optional[str] = None  # pass it back as `cursor` to get the next page, null on the last one
+    total: Optional[int] = None  # only computed when asked with include_total
+
+
 class TariffResponse(BaseModel):
     transaction_type: str
-    min_amount: float
-    max_amount: float
-    fee: float
+    min_amount: Amount
+    max_amount: Amount
+    fee: Amount
 
     class Config:
         from_attributes = True
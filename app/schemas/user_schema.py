@@ -3,6 +3,8 @@ from typing import Optional, List
 from datetime import datetime, date
 from fastapi import Form, UploadFile
 
+from app.core.money import Amount
+
 class UserCreate(BaseModel):
     phone_number: str
     pin: Optional[str] = None
@@ -259,9 +261,9 @@ class UserLoginResponse(BaseModel):
 
 
 class UserBalanceResponse(BaseModel):
-    balance: float
+    balance: Amount
     currency: str # Currency code (e.g., USD, EUR, XAF)
-    converted_balance: Optional[float] = None 
+    converted_balance: Optional[Amount] = None 
     conversion_currency: Optional[str] = None 
 
 
@@ -276,7 +278,7 @@ class UserBalanceResponse(BaseModel):
             }
         }
 
-    def update_balance_with_conversion(self,db,  user_wallet, to_currency: str,) -> None:
+    async def update_balance_with_conversion(self,db,  user_wallet, to_currency: str,) -> None:
         """
         This method updates the balance with the converted value if the currency differs.
         """
@@ -286,7 +288,7 @@ class UserBalanceResponse(BaseModel):
 
         # If the desired currency for conversion is different, perform the conversion
         if self.currency != to_currency:
-            self.converted_balance = user_wallet.convert_balance(db, to_currency)
+            self.converted_balance = await user_wallet.convert_balance(db, to_currency)
             self.conversion_currency = to_currency
         else:
             self.converted_balance = self.balance
@@ -0,0 +1,169 @@
+import logging
+import os
+import shutil
+from datetime import date, timedelta
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from sqlalchemy import literal, or_, select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+
+from app.configs.config import settings
+from app.models.ledger_model import ACCOUNT_MOBILE_MONEY, ACCOUNT_STRIPE, LedgerEntry
+from app.models.roles_model import Merchant
+from app.models.transaction_model import Transaction
+
+logger = logging.getLogger(__name__)
+
+# Where the money of a transaction came from: the external account of its ledger legs,
+# "wallet" for the transfers and withdrawals between wallets
+SOURCE_ACCOUNTS = [ACCOUNT_MOBILE_MONEY, ACCOUNT_STRIPE]
+CHANNEL_WALLET = "wallet"
+
+SNAPSHOT_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("created_at", pa.timestamp("us")),
+    ("transaction_type", pa.string()),
+    ("status", pa.string()),
+    ("currency", pa.string()),
+    ("amount", pa.decimal128(18, 2)),
+    ("fees", pa.decimal128(18, 2)),
+    ("user_id", pa.int64()),
+    ("recipient_id", pa.int64()),
+    ("merchant_id", pa.int64()),  # the recipient's merchant, if any
+    ("merchant", pa.string()),
+    ("channel", pa.string()),
+])
+# The day is the partition (day=YYYY-MM-DD directories), not a column of the files
+PARTITIONING = ds.partitioning(pa.schema([("day", pa.date32())]), flavor="hive")
+
+# Group by keys of the analytics endpoints, amounts are always summed per currency
+DIMENSIONS = {
+    "currency": [],
+    "day": ["day"],
+    "channel": ["channel"],
+    "merchant": ["merchant_id", "merchant"],
+    "transaction_type": ["transaction_type"],
+}
+
+
+def snapshot_query(day: date):
+    return (
+        select(Transaction.id, Transaction.created_at, Transaction.transaction_type, Transaction.status,
+               Transaction.currency, Transaction.amount, Transaction.fees, Transaction.user_id,
+               Transaction.recipient_id, Merchant.id, Merchant.business_name,
+               func.coalesce(LedgerEntry.account, literal(CHANNEL_WALLET)))
+        # A top-up credits the user itself, it is not a payment to the user's merchant
+        .outerjoin(Merchant, (Merchant.owner_id == Transaction.recipient_id) & (Transaction.user_id != Transaction.recipient_id))
+        # At most one source leg per transaction, the join does not repeat rows
+        .outerjoin(LedgerEntry, (LedgerEntry.transaction_id == Transaction.id) & LedgerEntry.account.in_(SOURCE_ACCOUNTS))
+        .filter(Transaction.created_at >= day, Transaction.created_at < day + timedelta(days=1))
+        # Skips the merchant's mirror credit of a withdrawal (from and to the merchant, no
+        # source leg), its debit already counts the money once; the top-ups have a source leg
+        .filter(or_(Transaction.recipient_id.is_(None), Transaction.user_id != Transaction.recipient_id,
+                    LedgerEntry.id.isnot(None)))
+    )
+
+
+class TransactionSnapshots:
+    """
+    Columnar copies of the transactions for the reports, so they never scan MySQL.
+
+    Every day is a zstd compressed Parquet file (directory/transactions/day=YYYY-MM-DD),
+    rewritten whole by snapshot(): the rows come from a server-side cursor batch_size at
+    a time, one row group each, into a temporary file renamed over the previous one, so
+    readers see either snapshot. The scheduler rewrites the last few days, statuses
+    settle in the meantime; the older ones are backfilled from the CLI.
+    Reads (volumes) load the columns they need from the days in range only and group
+    them with Arrow's vectorized kernels.
+    """
+
+    def __init__(self, directory: str, batch_size: int = 10000):
+        self.directory = directory
+        self.batch_size = batch_size
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, "transactions")
+
+    def _day_path(self, day: date) -> str:
+        return os.path.join(self.path, f"day={day.isoformat()}")
+
+    def snapshot_day(self, db: Session, day: date) -> int:
+        """
+        Rewrite the file of `day`, returns its number of rows.
+        """
+        directory = self._day_path(day)
+        os.makedirs(directory, exist_ok=True)
+        # Dot files are skipped by the readers
+        tmp_path = os.path.join(directory, f".data-{os.getpid()}.parquet")
+        rows = 0
+        try:
+            with pq.ParquetWriter(tmp_path, SNAPSHOT_SCHEMA, compression="zstd") as writer:
+                result = db.execute(snapshot_query(day).execution_options(yield_per=self.batch_size))
+                for batch in result.partitions():
+                    columns = list(zip(*batch))
+                    writer.write_batch(pa.record_batch(
+                        [pa.array(column, type=field.type) for column, field in zip(columns, SNAPSHOT_SCHEMA)],
+                        schema=SNAPSHOT_SCHEMA,
+                    ))
+                    rows += len(batch)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        if rows:
+            os.replace(tmp_path, os.path.join(directory, "data.parquet"))
+        else:
+            shutil.rmtree(directory)
+        return rows
+
+    def snapshot(self, db: Session, since: date, until: date) -> int:
+        """
+        Rewrite the days in [since, until), returns the number of rows written.
+        """
+        rows = 0
+        day = since
+        while day < until:
+            rows += self.snapshot_day(db, day)
+            day += timedelta(days=1)
+        return rows
+
+    def volumes(self, start_date: date, end_date: date, group_by: list, currency: str = None,
+                status: str = "completed") -> list:
+        """
+        Amount, fees and number of the transactions of [start_date, end_date] per currency
+        and per `group_by` dimension (see DIMENSIONS).
+        """
+        if not os.path.isdir(self.path):
+            return []
+        keys = ["currency"] + [column for dimension in group_by for column in DIMENSIONS[dimension]]
+        condition = (ds.field("day") >= start_date) & (ds.field("day") <= end_date) & (ds.field("status") == status)
+        if currency:
+            condition &= ds.field("currency") == currency
+
+        dataset = ds.dataset(self.path, format="parquet", partitioning=PARTITIONING)
+        table = dataset.to_table(columns=list(dict.fromkeys(keys + ["id", "amount", "fees"])), filter=condition)
+        grouped = table.group_by(keys).aggregate([("amount", "sum"), ("fees", "sum"), ("id", "count")])
+        grouped = grouped.rename_columns([
+            {"amount_sum": "amount", "fees_sum": "fees", "id_count": "count"}.get(name, name) for name in grouped.column_names
+        ])
+        return sorted(grouped.to_pylist(), key=lambda line: tuple((line[key] is None, line[key]) for key in keys))
+
+
+transaction_snapshots = TransactionSnapshots(settings.ANALYTICS_SNAPSHOT_DIR, settings.ANALYTICS_SNAPSHOT_BATCH_SIZE)
+
+
+def snapshot_transactions(db: Session, days: int = None) -> int:
+    """
+    Scheduler job: rewrite the snapshots of the last `days` days, today included.
+    """
+    days = settings.ANALYTICS_SNAPSHOT_DAYS if days is None else days
+    # created_at is set by the database, so are the days
+    today = db.scalar(select(func.current_date()))
+    rows = transaction_snapshots.snapshot(db, today - timedelta(days=days - 1), today + timedelta(days=1))
+    logger.info(f"Snapshotted {rows} transactions of the last {days} days")
+    return rows
@@ -0,0 +1,60 @@
+import csv
+import io
+import json
+
+from app.configs.config import settings
+from app.configs.database import AsyncSessionLocal
+
+EXPORT_COLUMNS = ["id", "created_at", "transaction_type", "status", "amount", "fees", "currency",
+                  "user_id", "user_phone", "recipient_id", "recipient_phone"]
+
+
+def _csv_chunk(rows, header: bool = False) -> str:
+    output = io.StringIO()
+    writer = csv.writer(output)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(rows)
+    return output.getvalue()
+
+
+def _ndjson_value(value):
+    # Decimals as strings, the amounts stay exact
+    if value is None or isinstance(value, (int, str)):
+        return value
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def _ndjson_chunk(rows) -> str:
+    return "".join(
+        json.dumps({column: _ndjson_value(value) for column, value in zip(EXPORT_COLUMNS, row)}) + "\n"
+        for row in rows
+    )
+
+
+class HistoryExporter:
+    """
+    Stream the rows of an export query as CSV or NDJSON. The rows come from a server-side
+    cursor batch_size at a time and each batch is written out before the next is read,
+    so memory stays flat whatever the number of rows. The export has its own session: a
+    streamed response outlives the request's one.
+    """
+
+    media_types = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+    def __init__(self, session_factory=AsyncSessionLocal, batch_size: int = 1000):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+
+    async def stream(self, query, export_format: str):
+        if export_format == "csv":
+            yield _csv_chunk([], header=True)
+        async with self.session_factory() as db:
+            result = await db.stream(query.execution_options(yield_per=self.batch_size))
+            async for rows in result.partitions():
+                yield _csv_chunk(rows) if export_format == "csv" else _ndjson_chunk(rows)
+
+
+history_exporter = HistoryExporter(batch_size=settings.EXPORT_BATCH_SIZE)
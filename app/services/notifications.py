@@ -0,0 +1,190 @@
+import asyncio
+import json
+import logging
+import os
+import random
+from datetime import datetime
+
+from app.configs.config import settings
+from app.core.http_client import http_clients
+from app.core.send_sms import sms_payload, SMS_HEADERS
+
+logger = logging.getLogger(__name__)
+
+# Kinds of message, what the dead letters keep instead of the body
+SMS_NOTIFICATION = "notification"
+SMS_WELCOME = "welcome"  # carries the PIN, and the partner or merchant code
+SMS_PIN_CHANGED = "pin_changed"  # carries the new PIN
+
+
+class SmsDeliveryError(Exception):
+    pass
+
+
+class HttpSmsBackend:
+    """
+    Send the messages to the SMS provider over the shared keep-alive "sms" client.
+    """
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        # The client belongs to app.core.http_client, closed with the others at shutdown
+        pass
+
+    async def send(self, to: str, message: str):
+        response = await http_clients.arequest("sms", "POST", self.endpoint, data=sms_payload(to, message), headers=SMS_HEADERS)
+        result = response.json()
+        if result.get("status") != "success":
+            raise SmsDeliveryError(f"SMS provider answered {result}")
+
+
+class MemorySmsBackend:
+    """
+    Keep the messages in memory instead of sending them, for tests and local runs.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def send(self, to: str, message: str):
+        self.sent.append({"to": to, "message": message})
+
+
+class FileSmsBackend:
+    """
+    Append the messages to a JSON lines file instead of sending them.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    async def open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+    async def close(self):
+        pass
+
+    async def send(self, to: str, message: str):
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"to": to, "message": message, "sent_at": datetime.utcnow().isoformat()}) + "\n")
+
+
+class DeadLetterStore:
+    """
+    Messages that could not be delivered after every retry, appended to a JSON lines
+    file (or only kept in memory when no path is given) to be followed up. Only the
+    recipient, the kind of message and the error are kept: bodies carry PINs and
+    merchant codes, they never reach the disk.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.messages = []
+
+    def add(self, to: str, kind: str, error: str):
+        entry = {"to": to, "kind": kind, "error": error, "failed_at": datetime.utcnow().isoformat()}
+        if self.path is None:
+            self.messages.append(entry)
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+
+class SmsQueue:
+    """
+    Outbound SMS queue. Handlers enqueue and return immediately, a pool of worker
+    tasks takes the messages in batches and sends them concurrently, retrying with
+    exponential backoff before giving up to the dead-letter store.
+    """
+
+    def __init__(self, backend, dead_letters: DeadLetterStore, workers: int = 4, max_size: int = 10000,
+                 batch_size: int = 20, max_retries: int = 3, retry_backoff: float = 1.0):
+        self.backend = backend
+        self.dead_letters = dead_letters
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self._tasks = []
+
+    def enqueue(self, to: str, message: str, kind: str = SMS_NOTIFICATION):
+        try:
+            self.queue.put_nowait((to, message, kind))
+        except asyncio.QueueFull:
+            logger.error(f"SMS queue full, {kind} message to {to} dead-lettered")
+            self.dead_letters.add(to, kind, "queue full")
+
+    async def start(self):
+        await self.backend.open()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0):
+        # Give the workers a chance to flush what is already queued
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.queue.qsize()} SMS still queued at shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.backend.close()
+
+    async def _worker(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await asyncio.gather(*(self._deliver(to, message, kind) for to, message, kind in batch))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _deliver(self, to: str, message: str, kind: str):
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.backend.send(to, message)
+                return
+            except Exception as e:
+                error = e
+                if attempt < self.max_retries:
+                    # 1s, 2s, 4s... with some jitter so retries do not arrive in bursts
+                    await asyncio.sleep(self.retry_backoff * 2 ** attempt * (1 + random.random() / 2))
+        logger.error(f"{kind} SMS to {to} failed after {self.max_retries + 1} attempts: {error}")
+        self.dead_letters.add(to, kind, str(error))
+
+
+def create_sms_backend(name: str):
+    if name == "memory":
+        return MemorySmsBackend()
+    if name == "file":
+        return FileSmsBackend(settings.SMS_FILE_BACKEND_PATH)
+    return HttpSmsBackend(settings.SMS_ENDPOINT)
+
+
+sms_queue = SmsQueue(
+    backend=create_sms_backend(settings.SMS_BACKEND),
+    dead_letters=DeadLetterStore(settings.SMS_DEAD_LETTER_FILE),
+    workers=settings.SMS_WORKERS,
+    max_size=settings.SMS_QUEUE_SIZE,
+    max_retries=settings.SMS_MAX_RETRIES,
+    retry_backoff=settings.SMS_RETRY_BACKOFF,
+)
+
+
+def enqueue_sms(to: str, message: str, kind: str = SMS_NOTIFICATION):
+    sms_queue.enqueue(to, message, kind)
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from app.configs.config import settings
+from app.configs.database import AsyncSessionLocal
+from app.core.http_client import http_clients
+from app.models.outbox_model import (
+    OUTBOX_FAILED, OUTBOX_SENT, TOPIC_ANALYTICS, TOPIC_SMS, TOPIC_WEBHOOK, OutboxMessage, due_outbox_messages_query,
+    outbox_message,
+)
+from app.services.notifications import sms_queue
+
+logger = logging.getLogger(__name__)
+
+
+# Writers: add the message to the caller's transaction, it is relayed once committed
+def add_sms(db, to: str, message: str):
+    db.add(outbox_message(TOPIC_SMS, {"to": to, "message": message}))
+
+
+def add_transaction_events(db, transaction):
+    """
+    Analytics event (and webhook call, when configured) of a completed transaction.
+    The transaction must be flushed already, for its id.
+    """
+    event = {
+        "event": "transaction.completed",
+        "transaction_id": transaction.id,
+        "user_id": transaction.user_id,
+        "recipient_id": transaction.recipient_id,
+        "transaction_type": transaction.transaction_type,
+        "amount": str(transaction.amount),
+        "fees": str(transaction.fees or 0),
+        "currency": transaction.currency,
+        "occurred_at": datetime.utcnow().isoformat(),
+    }
+    db.add(outbox_message(TOPIC_ANALYTICS, event))
+    if settings.OUTBOX_WEBHOOK_URL:
+        db.add(outbox_message(TOPIC_WEBHOOK, event))
+
+
+# Sinks: raise to have the message retried later
+async def sms_sink(payload: dict):
+    await sms_queue.backend.send(payload["to"], payload["message"])
+
+
+async def webhook_sink(payload: dict):
+    response = await http_clients.arequest("webhook", "POST", settings.OUTBOX_WEBHOOK_URL, json=payload)
+    response.raise_for_status()
+
+
+_analytics_lock = threading.Lock()
+
+
+def _append_event(path: str, line: str):
+    with _analytics_lock:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a") as f:
+            f.write(line)
+
+
+async def analytics_sink(payload: dict):
+    # Blocking file I/O, off the event loop
+    await asyncio.to_thread(_append_event, settings.ANALYTICS_EVENTS_FILE, json.dumps(payload) + "\n")
+
+
+SINKS = {
+    TOPIC_SMS: sms_sink,
+    TOPIC_WEBHOOK: webhook_sink,
+    TOPIC_ANALYTICS: analytics_sink,
+}
+
+
+class OutboxRelay:
+    """
+    Drain the outbox: a worker task wakes up when a request committed messages, or
+    every poll_interval for those committed by the other workers, leases up to
+    batch_size due messages for `lease` seconds (SKIP LOCKED, so the relays of several
+    workers drain it in parallel) and hands them to their sinks concurrently, outside of
+    any transaction. A message whose sink fails is retried with exponential backoff, then
+    marked failed after max_attempts; one whose relay died is retried once its lease ran out.
+    """
+
+    def __init__(self, sinks: dict, session_factory=AsyncSessionLocal, batch_size: int = 100,
+                 poll_interval: float = 5.0, max_attempts: int = 8, retry_backoff: float = 5.0, lease: float = 60.0):
+        self.sinks = sinks
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.lease = lease
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def notify(self):
+        self._wakeup.set()
+
+    async def start(self):
+        # The SMS backend is opened by sms_queue.start()
+        self._task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _worker(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                while await self.relay_batch() == self.batch_size:
+                    pass
+            except Exception:
+                logger.exception("Could not relay the outbox")
+
+    async def _send(self, topic: str, payload: str):
+        sink = self.sinks.get(topic)
+        if sink is None:
+            raise ValueError(f"No sink for topic {topic}")
+        await sink(json.loads(payload))
+
+    async def relay_batch(self) -> int:
+        """
+        Relay the next due messages, returns how many were taken.
+        """
+        # Claim: the due messages are leased (available_at pushed past the sends) in a short
+        # transaction, the other relays skip them until the lease runs out
+        async with self.session_factory() as db:
+            now = datetime.utcnow()
+            lease = now.replace(microsecond=0) + timedelta(seconds=self.lease)  # DATETIME has no fraction
+            messages = (await db.execute(due_outbox_messages_query(self.batch_size, now))).scalars().all()
+            if not messages:
+                return 0
+            claimed = [(message.id, message.topic, message.payload, message.attempts) for message in messages]
+            for message in messages:
+                message.available_at = lease
+            await db.commit()
+
+        # No transaction open while the sinks run: a slow sink holds neither rows nor a connection
+        results = await asyncio.gather(*(self._send(topic, payload) for _, topic, payload, _ in claimed),
+                                       return_exceptions=True)
+
+        # Record: only while the lease still holds, a message whose lease ran out was taken
+        # (and will be recorded) by another relay
+        async with self.session_factory() as db:
+            now = datetime.utcnow()
+            sent = [message_id for (message_id, _, _, _), result in zip(claimed, results) if not isinstance(result, Exception)]
+            if sent:
+                await db.execute(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.id.in_(sent), OutboxMessage.available_at == lease)
+                    .values(status=OUTBOX_SENT, sent_at=now, attempts=OutboxMessage.attempts + 1)
+                )
+            for (message_id, topic, _, attempts), result in zip(claimed, results):
+                if not isinstance(result, Exception):
+                    continue
+                attempts += 1
+                values = {"attempts": attempts, "error": repr(result)}
+                if attempts >= self.max_attempts:
+                    logger.error(f"Outbox message {message_id} ({topic}) failed after {attempts} attempts: {result!r}")
+                    values["status"] = OUTBOX_FAILED
+                else:
+                    values["available_at"] = now + timedelta(seconds=self.retry_backoff * 2 ** (attempts - 1))
+                await db.execute(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.id == message_id, OutboxMessage.available_at == lease)
+                    .values(**values)
+                )
+            await db.commit()
+        return len(claimed)
+
+outbox_relay = OutboxRelay(
+    SINKS,
+    batch_size=settings.OUTBOX_BATCH_SIZE,
+    poll_interval=settings.OUTBOX_POLL_INTERVAL,
+    max_attempts=settings.OUTBOX_MAX_ATTEMPTS,
+    retry_backoff=settings.OUTBOX_RETRY_BACKOFF,
+    lease=settings.OUTBOX_LEASE,
+)
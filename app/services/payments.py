@@ -0,0 +1,349 @@
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import Awaitable, Callable, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.transaction_model import Transaction
+from app.models.user_model import User, convert_currency, get_users_by_phone
+from app.services.outbox import add_sms, add_transaction_events, outbox_relay
+from app.core.money import format_amount, quantize
+from app.models.ledger_model import ACCOUNT_MOBILE_MONEY
+from app.models.tarif_model import TARIFF_RECHARGE, TARIFF_TRANSFER, TARIFF_WITHDRAW, compute_fee
+from app.services.wallet_service import InsufficientFundsError, transfer_between_wallets, transfer_many, deposit_to_wallet
+
+logger = logging.getLogger(__name__)
+
+MIN_TRANSFER_AMOUNT = Decimal(50)
+
+# Called with the session and the result right before the commit of a payment, to write
+# in the same transaction (the response of an Idempotency-Key, see IdempotencyClaim)
+BeforeCommit = Callable[[AsyncSession, object], Awaitable]
+
+
+class PaymentError(Exception):
+    """
+    A payment refused for a business reason, `detail` can be shown to the user.
+    """
+
+    def __init__(self, detail: str, status_code: int = 400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+async def _converted_amount(db: AsyncSession, amount: Decimal, from_currency: str, to_currency: str) -> Decimal:
+    if from_currency == to_currency:
+        return amount
+    return await convert_currency(db, amount, from_currency, to_currency)
+
+
+async def transfer(db: AsyncSession, sender: User, recipient: User, amount: Decimal,
+                   before_commit: BeforeCommit = None) -> Transaction:
+    """
+    Move `amount` (in the sender's currency) from the sender's wallet to the recipient's.
+    The PIN is checked by the caller, every channel asks for it its own way.
+    """
+    amount = quantize(amount, sender.wallet.currency)
+    if sender.phone_number == recipient.phone_number:
+        raise PaymentError("You cannot transfer funds to yourself")
+    if amount < MIN_TRANSFER_AMOUNT:
+        raise PaymentError(f"Minimum transfer amount is {format_amount(MIN_TRANSFER_AMOUNT, sender.wallet.currency)}")
+    fee = await compute_fee(db, TARIFF_TRANSFER, amount, sender.wallet.currency)
+    if sender.wallet.balance < amount + fee:
+        raise PaymentError("Insufficient funds")
+
+    sender_currency = sender.wallet.currency
+    recipient_currency = recipient.wallet.currency
+    try:
+        converted_amount = await _converted_amount(db, amount, sender_currency, recipient_currency)
+
+        debit_transaction = Transaction(
+            amount=amount,
+            fees=fee,
+            user_id=sender.id,
+            user=sender,  # Set relationship explicitly
+            transaction_type="debit",
+            recipient_id=recipient.id,
+            recipient=recipient,  # Set relationship explicitly
+            status="completed",
+            currency=sender_currency,
+            created_at=datetime.utcnow()
+        )
+
+        # Update balances, both wallets stay locked until the commit
+        await transfer_between_wallets(db, sender.wallet.id, recipient.wallet.id, amount, converted_amount,
+                                       transaction=debit_transaction, fee=fee)
+
+        db.add(debit_transaction)
+        await db.flush()
+
+        # Committed with the balances, sent by the outbox relay
+        add_sms(
+            db,
+            recipient.phone_number,
+            f"You received {format_amount(converted_amount, recipient_currency)} from {sender.phone_number}. New balance: {format_amount(recipient.wallet.balance, recipient_currency)}."
+        )
+        add_sms(
+            db,
+            sender.phone_number,
+            f"You sent {format_amount(amount, sender_currency)} to {recipient.phone_number}. New balance: {format_amount(sender.wallet.balance, sender_currency)}."
+        )
+        add_transaction_events(db, debit_transaction)
+
+        await db.refresh(debit_transaction)
+        debit_transaction.user = sender
+        debit_transaction.recipient = recipient
+        if before_commit:
+            await before_commit(db, debit_transaction)
+        await db.commit()
+    except InsufficientFundsError:
+        await db.rollback()
+        raise PaymentError("Insufficient funds")
+    except Exception:
+        await db.rollback()
+        raise
+    outbox_relay.notify()
+    return debit_transaction
+
+
+async def withdraw(db: AsyncSession, user: User, merchant_owner: User, amount: Decimal,
+                   before_commit: BeforeCommit = None) -> Transaction:
+    """
+    Cash out `amount` at a merchant: the user's wallet is debited, the merchant's credited.
+    """
+    amount = quantize(amount, user.wallet.currency)
+    if amount <= 0:
+        raise PaymentError("Invalid amount")
+    fee = await compute_fee(db, TARIFF_WITHDRAW, amount, user.wallet.currency)
+    if user.wallet.balance < amount + fee:
+        raise PaymentError("Insufficient funds")
+
+    sender_currency = user.wallet.currency
+    recipient_currency = merchant_owner.wallet.currency
+    try:
+        converted_amount = await _converted_amount(db, amount, sender_currency, recipient_currency)
+
+        # Créer la transaction de débit pour l'utilisateur
+        debit_transaction = Transaction(
+            amount=amount,
+            fees=fee,
+            user_id=user.id,
+            recipient_id=merchant_owner.id,
+            transaction_type="debit",
+            status="completed",
+            currency=sender_currency
+        )
+
+        # Créer la transaction de crédit pour le commerçant
+        credit_transaction = Transaction(
+            amount=converted_amount,
+            user_id=merchant_owner.id,
+            recipient_id=merchant_owner.id,
+            transaction_type="credit",
+            status="completed",
+            currency=recipient_currency
+        )
+
+        # Mettre à jour les soldes (portefeuilles verrouillés jusqu'au commit)
+        await transfer_between_wallets(db, user.wallet.id, merchant_owner.wallet.id, amount, converted_amount,
+                                       transaction=debit_transaction, fee=fee)
+
+        db.add(debit_transaction)
+        db.add(credit_transaction)
+        await db.flush()
+
+        add_sms(
+            db,
+            user.phone_number,
+            f"Vous avez retiré {format_amount(amount, sender_currency)}. Votre nouveau solde est de {format_amount(user.wallet.balance, sender_currency)}."
+        )
+        add_sms(
+            db,
+            merchant_owner.phone_number,
+            f"Vous avez reçu {format_amount(converted_amount, recipient_currency)} de {user.phone_number}. Votre nouveau solde est de {format_amount(merchant_owner.wallet.balance, recipient_currency)}."
+        )
+        add_transaction_events(db, debit_transaction)
+        add_transaction_events(db, credit_transaction)
+
+        await db.refresh(debit_transaction)
+        debit_transaction.user = user
+        debit_transaction.recipient = merchant_owner
+        if before_commit:
+            await before_commit(db, debit_transaction)
+        await db.commit()
+    except InsufficientFundsError:
+        await db.rollback()
+        raise PaymentError("Insufficient funds")
+    except Exception:
+        await db.rollback()
+        raise
+    outbox_relay.notify()
+    return debit_transaction
+
+
+async def recharge(db: AsyncSession, user: User, amount: Decimal, before_commit: BeforeCommit = None) -> Transaction:
+    """
+    Credit the user's wallet once the mobile money payment went through, less the recharge fee.
+    """
+    amount = quantize(amount, user.wallet.currency)
+    if amount <= 0:
+        raise PaymentError("Invalid amount")
+    fee = await compute_fee(db, TARIFF_RECHARGE, amount, user.wallet.currency)
+    if fee >= amount:
+        raise PaymentError("Amount too low to cover the fees")
+    try:
+        credit_transaction = Transaction(
+            amount=amount,
+            fees=fee,
+            user_id=user.id,
+            transaction_type="credit",
+            status="completed",
+            currency=user.wallet.currency
+        )
+        db.add(credit_transaction)
+
+        await deposit_to_wallet(db, user.wallet.id, user.wallet.currency, amount, ACCOUNT_MOBILE_MONEY,
+                                transaction=credit_transaction, fee=fee)
+        await db.flush()
+
+        add_sms(
+            db,
+            user.phone_number,
+            f"Vous avez rechargé votre compte de {format_amount(amount - fee, user.wallet.currency)}. Votre nouveau solde est de {format_amount(user.wallet.balance, user.wallet.currency)}."
+        )
+        add_transaction_events(db, credit_transaction)
+
+        await db.refresh(credit_transaction)
+        credit_transaction.user = user
+        if before_commit:
+            await before_commit(db, credit_transaction)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    outbox_relay.notify()
+    return credit_transaction
+
+
+@dataclass
+class BulkTransferRow:
+    """
+    One payment of a bulk transfer and its outcome.
+    """
+    line: int
+    recipient_phone: str
+    amount: Optional[Decimal]  # None when it could not be read
+    status: str = "failed"
+    transaction_id: Optional[int] = None
+    error: Optional[str] = None
+    fee: Decimal = Decimal(0)
+
+
+async def bulk_transfer(db: AsyncSession, sender: User, rows: List[BulkTransferRow], chunk_size: int = 200,
+                        before_commit: BeforeCommit = None) -> List[BulkTransferRow]:
+    """
+    Pay every row out of the sender's wallet, the PIN being checked once by the caller.
+    The recipients are resolved with a single query and the rows are applied chunk_size
+    at a time, one database transaction per chunk (see transfer_many). A row that cannot
+    be paid is marked failed with its reason, the others go on. before_commit gets the
+    rows with their outcome in the last transaction, the one of the sender's summary.
+    """
+    # The ORM objects expire when a chunk rolls back, what is needed is read once
+    sender_id, sender_phone = sender.id, sender.phone_number
+    sender_wallet_id, currency = sender.wallet.id, sender.wallet.currency
+
+    valid = []
+    for row in rows:
+        if row.amount is None:
+            row.error = "Invalid amount"
+            continue
+        row.amount = quantize(row.amount, currency)
+        if row.recipient_phone == sender_phone:
+            row.error = "You cannot transfer funds to yourself"
+        elif row.amount < MIN_TRANSFER_AMOUNT:
+            row.error = f"Minimum transfer amount is {format_amount(MIN_TRANSFER_AMOUNT, currency)}"
+        else:
+            valid.append(row)
+
+    recipients = await get_users_by_phone(db, {row.recipient_phone for row in valid})
+    planned = []
+    for row in valid:
+        recipient = recipients.get(row.recipient_phone)
+        if recipient is None:
+            row.error = "Recipient user not found"
+            continue
+        row.fee = await compute_fee(db, TARIFF_TRANSFER, row.amount, currency)
+        converted_amount = await _converted_amount(db, row.amount, currency, recipient.wallet.currency)
+        planned.append((row, recipient.id, recipient.wallet.id, recipient.wallet.currency, converted_amount))
+
+    paid, debited, sender_balance = 0, Decimal(0), None
+    for start in range(0, len(planned), chunk_size):
+        chunk = planned[start:start + chunk_size]
+        transactions = [
+            Transaction(
+                amount=row.amount,
+                fees=row.fee,
+                user_id=sender_id,
+                transaction_type="debit",
+                recipient_id=recipient_id,
+                status="completed",
+                currency=currency,
+                created_at=datetime.utcnow()
+            )
+            for row, recipient_id, _, _, _ in chunk
+        ]
+        try:
+            wallets, applied = await transfer_many(db, sender_wallet_id, [
+                (wallet_id, row.amount, converted_amount, row.fee, transaction)
+                for (row, _, wallet_id, _, converted_amount), transaction in zip(chunk, transactions)
+            ])
+            done = [(plan, transaction) for plan, transaction, ok in zip(chunk, transactions, applied) if ok]
+            db.add_all([transaction for _, transaction in done])
+            await db.flush()
+
+            for (row, _, wallet_id, recipient_currency, converted_amount), transaction in done:
+                add_sms(
+                    db,
+                    row.recipient_phone,
+                    f"You received {format_amount(converted_amount, recipient_currency)} from {sender_phone}. New balance: {format_amount(wallets[wallet_id].balance, recipient_currency)}."
+                )
+                add_transaction_events(db, transaction)
+            await db.commit()
+            outbox_relay.notify()
+        except Exception:
+            await db.rollback()
+            logger.exception(f"Bulk transfer chunk of {len(chunk)} rows failed")
+            for row, *_ in chunk:
+                row.error = "Transaction failed"
+            continue
+
+        for (row, *_), transaction, ok in zip(chunk, transactions, applied):
+            if ok:
+                row.status, row.transaction_id = "completed", transaction.id
+                paid += 1
+                debited += row.amount + row.fee
+            else:
+                row.error = "Insufficient funds"
+        sender_balance = wallets[sender_wallet_id].balance
+
+    if not paid and not before_commit:
+        return rows
+    try:
+        if paid:
+            # One message for the sender, not one per recipient
+            add_sms(
+                db,
+                sender_phone,
+                f"You paid {paid} recipients, {format_amount(debited, currency)} with the fees. New balance: {format_amount(sender_balance, currency)}."
+            )
+        if before_commit:
+            await before_commit(db, rows)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    outbox_relay.notify()
+    return rows
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import logging
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.configs.config import settings
+from app.configs.database import AsyncSessionLocal
+from app.core.money import format_amount, from_minor_units
+from app.models.ledger_model import ACCOUNT_STRIPE
+from app.models.stripe_event_model import (
+    STRIPE_EVENT_FAILED, STRIPE_EVENT_PENDING, STRIPE_EVENT_PROCESSED, StripeEvent, pending_stripe_events_query,
+)
+from app.models.tarif_model import TARIFF_RECHARGE, compute_fee
+from app.models.transaction_model import Transaction
+from app.models.user_model import User
+from app.services.outbox import add_sms, add_transaction_events, outbox_relay
+from app.services.wallet_service import deposit_to_wallet
+
+logger = logging.getLogger(__name__)
+
+
+async def credit_payment_intent(db: AsyncSession, event: StripeEvent, users: dict):
+    """
+    Credit the wallet of a succeeded payment intent, inside the caller's transaction.
+    """
+    metadata = json.loads(event.payload)["metadata"]
+    user = users.get(int(metadata["user_id"]))
+    if user is None:
+        raise ValueError(f"Unknown user {metadata['user_id']}")
+    currency = metadata["currency"]
+    recharge_amount = from_minor_units(metadata["amount"], currency)
+
+    # The card was charged already, the fee can at most take the whole amount
+    fee = min(await compute_fee(db, TARIFF_RECHARGE, recharge_amount, currency), recharge_amount)
+    credit_transaction = Transaction(
+        amount=recharge_amount,
+        fees=fee,
+        user_id=user.id,
+        recipient_id=user.id,
+        transaction_type="credit",
+        status="completed",
+        currency=currency,
+    )
+    db.add(credit_transaction)
+
+    await deposit_to_wallet(db, user.wallet.id, user.wallet.currency, recharge_amount, ACCOUNT_STRIPE,
+                            transaction=credit_transaction, fee=fee)
+    await db.flush()
+
+    add_sms(
+        db,
+        user.phone_number,
+        f"Vous avez rechargé votre compte de {format_amount(recharge_amount - fee, currency)}. Votre nouveau solde est de {format_amount(user.wallet.balance, user.wallet.currency)}."
+    )
+    add_transaction_events(db, credit_transaction)
+
+
+HANDLERS = {
+    "payment_intent.succeeded": credit_payment_intent,
+}
+
+
+class StripeEventProcessor:
+    """
+    Apply the Stripe events recorded by the webhook. A worker task wakes up when the
+    webhook records an event, or every poll_interval for the events recorded by the
+    other workers, and applies the pending events batch_size at a time in a single
+    transaction. When a batch fails, its events are retried one by one so a bad event
+    does not hold back the others, it is marked failed after max_attempts.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, batch_size: int = 50, poll_interval: float = 5.0,
+                 max_attempts: int = 5):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def notify(self):
+        self._wakeup.set()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _worker(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                # Until a batch comes back short, events that failed wait for the next wake up
+                while await self.process_batch() == self.batch_size:
+                    pass
+            except Exception:
+                logger.exception("Could not process the Stripe events")
+
+    async def _apply(self, db: AsyncSession, events: list):
+        user_ids = {int(json.loads(event.payload)["metadata"]["user_id"]) for event in events}
+        result = await db.execute(select(User).filter(User.id.in_(user_ids)))
+        users = {user.id: user for user in result.scalars().all()}
+        for event in events:
+            await HANDLERS[event.type](db, event, users)
+            event.status = STRIPE_EVENT_PROCESSED
+            event.processed_at = datetime.utcnow()
+
+    async def process_batch(self) -> int:
+        """
+        Apply the next pending events, returns how many were applied.
+        """
+        async with self.session_factory() as db:
+            events = (await db.execute(pending_stripe_events_query(self.batch_size))).scalars().all()
+            if not events:
+                return 0
+            ids = [event.id for event in events]
+            try:
+                await self._apply(db, events)
+                await db.commit()
+                outbox_relay.notify()
+                logger.info(f"Applied {len(events)} Stripe events")
+                return len(events)
+            except Exception as e:
+                await db.rollback()
+                if len(events) == 1:
+                    await self._failed(db, ids[0], e)
+                    return 0
+
+        applied = 0
+        for event_id in ids:
+            applied += await self._process_one(event_id)
+        return applied
+
+    async def _process_one(self, event_id: str) -> bool:
+        async with self.session_factory() as db:
+            event = await db.get(StripeEvent, event_id, with_for_update=True)
+            if event is None or event.status != STRIPE_EVENT_PENDING:
+                return False
+            try:
+                await self._apply(db, [event])
+                await db.commit()
+                outbox_relay.notify()
+                return True
+            except Exception as e:
+                await db.rollback()
+                await self._failed(db, event_id, e)
+                return False
+
+    async def _failed(self, db: AsyncSession, event_id: str, error: Exception):
+        logger.error(f"Stripe event {event_id} could not be applied: {error!r}")
+        event = await db.get(StripeEvent, event_id, with_for_update=True, populate_existing=True)
+        event.attempts += 1
+        event.error = repr(error)
+        if event.attempts >= self.max_attempts:
+            event.status = STRIPE_EVENT_FAILED
+        await db.commit()
+
+
+stripe_event_processor = StripeEventProcessor(
+    batch_size=settings.STRIPE_EVENTS_BATCH_SIZE,
+    poll_interval=settings.STRIPE_EVENTS_POLL_INTERVAL,
+    max_attempts=settings.STRIPE_EVENTS_MAX_ATTEMPTS,
+)
@@ -0,0 +1,253 @@
+from decimal import Decimal, InvalidOperation
+
+from app.core.hashing import asecure_pwd, averify_pwd
+from app.core.money import format_amount
+from app.core.ussd_engine import InvalidInput, Option, Reply, State, UssdMachine
+from app.core.utils import generate_pin_code
+from app.models.roles_model import get_merchant_by_code
+from app.models.user_model import User, create_user, get_user
+from app.schemas.transaction_schema import Operator
+from app.schemas.user_schema import UserCreate
+from app.services import payments
+
+TEXTS = {
+    "fr": {
+        "welcome": "Bienvenue sur PerfectPay",
+        "register": "Inscription",
+        "menu": "Bienvenue sur PerfectPay",
+        "transfer": "Transfert",
+        "withdraw": "Retrait",
+        "balance": "Solde",
+        "recharge": "Recharger",
+        "ask_first_name": "Entrez votre prénom",
+        "ask_last_name": "Entrez votre nom",
+        "ask_beneficiary": "Entrez le numéro du bénéficiaire",
+        "ask_transfer_amount": "Entrez le montant à transférer",
+        "ask_transfer_pin": "Entrez votre code PIN pour confirmer le transfert",
+        "ask_merchant": "Entrez le numéro du marchand",
+        "ask_merchant_code": "Entrez le code du marchand",
+        "ask_withdraw_amount": "Entrez le montant à retirer",
+        "ask_withdraw_pin": "Entrez votre code PIN pour confirmer le retrait",
+        "ask_balance_pin": "Entrez votre code PIN pour consulter votre solde",
+        "ask_recharge_amount": "Entrez le montant à recharger",
+        "ask_operator": "Choisissez votre opérateur\n1-Orange\n2-MTN",
+        "ask_recharge_pin": "Entrez votre code PIN pour confirmer la recharge",
+        "invalid_option": "Option invalide, réessayez.",
+        "invalid_amount": "Montant invalide. Veuillez entrer un montant valide.",
+        "invalid_name": "Nom invalide.",
+        "invalid_pin": "Code PIN incorrect. Session terminée.",
+        "already_registered": "Le numéro {phone_number} est déjà enregistré.",
+        "registered": "Inscription réussie. Votre PIN est {pin}.",
+        "unknown_beneficiary": "Numéro du bénéficiaire invalide. Session terminée.",
+        "unknown_merchant": "Marchand introuvable ou code invalide. Session terminée.",
+        "payment_refused": "{reason}. Session terminée.",
+        "transferred": "Transfert de {amount} à {beneficiary}. Merci d'utiliser PerfectPay.",
+        "withdrawn": "Retrait de {amount} effectué. Merci d'utiliser PerfectPay.",
+        "recharged": "Recharge de {amount} effectuée. Merci d'utiliser PerfectPay.",
+        "balance_is": "Votre solde est de {balance}.",
+        "session_expired": "Session expirée. Veuillez recommencer.",
+        "error": "Une erreur est survenue. Session terminée.",
+    },
+    "en": {
+        "welcome": "Welcome to PerfectPay",
+        "register": "Sign up",
+        "menu": "Welcome to PerfectPay",
+        "transfer": "Transfer",
+        "withdraw": "Withdraw",
+        "balance": "Balance",
+        "recharge": "Top up",
+        "ask_first_name": "Enter your first name",
+        "ask_last_name": "Enter your last name",
+        "ask_beneficiary": "Enter the beneficiary's number",
+        "ask_transfer_amount": "Enter the amount to transfer",
+        "ask_transfer_pin": "Enter your PIN to confirm the transfer",
+        "ask_merchant": "Enter the merchant's number",
+        "ask_merchant_code": "Enter the merchant code",
+        "ask_withdraw_amount": "Enter the amount to withdraw",
+        "ask_withdraw_pin": "Enter your PIN to confirm the withdrawal",
+        "ask_balance_pin": "Enter your PIN to see your balance",
+        "ask_recharge_amount": "Enter the amount to top up",
+        "ask_operator": "Choose your operator\n1-Orange\n2-MTN",
+        "ask_recharge_pin": "Enter your PIN to confirm the top up",
+        "invalid_option": "Invalid option, try again.",
+        "invalid_amount": "Invalid amount. Please enter a valid amount.",
+        "invalid_name": "Invalid name.",
+        "invalid_pin": "Wrong PIN. Session ended.",
+        "already_registered": "The number {phone_number} is already registered.",
+        "registered": "Registration successful. Your PIN is {pin}.",
+        "unknown_beneficiary": "Invalid beneficiary number. Session ended.",
+        "unknown_merchant": "Merchant not found or invalid merchant code. Session ended.",
+        "payment_refused": "{reason}. Session ended.",
+        "transferred": "Transfer of {amount} to {beneficiary}. Thank you for using PerfectPay.",
+        "withdrawn": "Withdrawal of {amount} done. Thank you for using PerfectPay.",
+        "recharged": "Top up of {amount} done. Thank you for using PerfectPay.",
+        "balance_is": "Your balance is {balance}.",
+        "session_expired": "Session expired. Please start again.",
+        "error": "An error occurred. Session ended.",
+    },
+}
+
+OPERATORS = {"1": Operator.ORANGE.value, "2": Operator.MTN.value}
+
+
+# Validators: return the value to store, raise InvalidInput to ask again
+def amount(value: str) -> str:
+    try:
+        parsed = Decimal(value.replace(",", "."))
+    except InvalidOperation:
+        raise InvalidInput("invalid_amount")
+    if not parsed.is_finite() or parsed <= 0:
+        raise InvalidInput("invalid_amount")
+    # kept as a string, the session data is JSON
+    return str(parsed)
+
+
+def name(value: str) -> str:
+    if not value or len(value) > 255:
+        raise InvalidInput("invalid_name")
+    return value
+
+
+def operator(value: str) -> str:
+    if value not in OPERATORS:
+        raise InvalidInput("invalid_option")
+    return OPERATORS[value]
+
+
+async def load_user(db, msisdn):
+    return await get_user(db, msisdn)
+
+
+async def entry(ctx):
+    user = ctx.user
+    if user is None:
+        return "welcome", ctx.lang
+    return "menu", user.language if user.language in TEXTS else ctx.lang
+
+
+async def checked_user(ctx):
+    """
+    The caller if the PIN typed in the last state matches, None otherwise.
+    """
+    user = ctx.user
+    if user is None or not await averify_pwd(str(ctx.data["pin"]), user.pin):
+        return None
+    return user
+
+
+async def register(ctx):
+    if ctx.user is not None:
+        return Reply(ctx.text("already_registered", phone_number=ctx.msisdn))
+
+    pin = generate_pin_code()
+    # Only what can be asked over USSD, the rest of the profile is completed in the app
+    new_user = UserCreate.model_construct(
+        phone_number=ctx.msisdn,
+        pin=await asecure_pwd(pin),
+        username=None,
+        email=None,
+        password=None,
+        first_name=ctx.data["first_name"],
+        last_name=ctx.data["last_name"],
+        avatar=None,
+        date_of_birth=None,
+        place_of_birth=None,
+        physical_address=None,
+        postal_code=None,
+        address_proof=None,
+        id_document=None,
+        language=ctx.lang,
+    )
+    await create_user(ctx.db, new_user)
+    return Reply(ctx.text("registered", pin=pin))
+
+
+async def do_transfer(ctx):
+    user = await checked_user(ctx)
+    if user is None:
+        return Reply(ctx.text("invalid_pin"))
+
+    recipient = await get_user(ctx.db, ctx.data["beneficiary"])
+    if recipient is None:
+        return Reply(ctx.text("unknown_beneficiary"))
+
+    try:
+        transaction = await payments.transfer(ctx.db, user, recipient, Decimal(ctx.data["amount"]))
+    except payments.PaymentError as e:
+        return Reply(ctx.text("payment_refused", reason=e.detail))
+    return Reply(ctx.text("transferred", amount=format_amount(transaction.amount, transaction.currency),
+                          beneficiary=recipient.phone_number))
+
+
+async def do_withdraw(ctx):
+    user = await checked_user(ctx)
+    if user is None:
+        return Reply(ctx.text("invalid_pin"))
+
+    merchant = await get_merchant_by_code(ctx.db, ctx.data["merchant"], ctx.data["merchant_code"])
+    merchant_owner = await ctx.db.get(User, merchant.owner_id) if merchant else None
+    if merchant_owner is None:
+        return Reply(ctx.text("unknown_merchant"))
+
+    try:
+        transaction = await payments.withdraw(ctx.db, user, merchant_owner, Decimal(ctx.data["amount"]))
+    except payments.PaymentError as e:
+        return Reply(ctx.text("payment_refused", reason=e.detail))
+    return Reply(ctx.text("withdrawn", amount=format_amount(transaction.amount, transaction.currency)))
+
+
+async def show_balance(ctx):
+    user = await checked_user(ctx)
+    if user is None:
+        return Reply(ctx.text("invalid_pin"))
+    return Reply(ctx.text("balance_is", balance=format_amount(user.wallet.balance, user.wallet.currency)))
+
+
+async def do_recharge(ctx):
+    user = await checked_user(ctx)
+    if user is None:
+        return Reply(ctx.text("invalid_pin"))
+
+    # response = paycool(ctx.data["amount"], user.phone_number)
+    try:
+        transaction = await payments.recharge(ctx.db, user, Decimal(ctx.data["amount"]))
+    except payments.PaymentError as e:
+        return Reply(ctx.text("payment_refused", reason=e.detail))
+    return Reply(ctx.text("recharged", amount=format_amount(transaction.amount, transaction.currency)))
+
+
+STATES = [
+    State("welcome", "welcome", options={"0": Option("register", "register_first_name")}),
+    State("register_first_name", "ask_first_name", store_as="first_name", validate=name, next="register_last_name"),
+    State("register_last_name", "ask_last_name", store_as="last_name", validate=name, action=register, loads=("user",)),
+
+    State("menu", "menu", options={
+        "1": Option("transfer", "transfer_beneficiary"),
+        "2": Option("withdraw", "withdraw_merchant"),
+        "6": Option("balance", "balance_pin"),
+        "8": Option("recharge", "recharge_amount"),
+    }),
+
+    State("transfer_beneficiary", "ask_beneficiary", store_as="beneficiary", next="transfer_amount"),
+    State("transfer_amount", "ask_transfer_amount", store_as="amount", validate=amount, next="transfer_pin"),
+    State("transfer_pin", "ask_transfer_pin", store_as="pin", action=do_transfer, loads=("user",)),
+
+    State("withdraw_merchant", "ask_merchant", store_as="merchant", next="withdraw_code"),
+    State("withdraw_code", "ask_merchant_code", store_as="merchant_code", next="withdraw_amount"),
+    State("withdraw_amount", "ask_withdraw_amount", store_as="amount", validate=amount, next="withdraw_pin"),
+    State("withdraw_pin", "ask_withdraw_pin", store_as="pin", action=do_withdraw, loads=("user",)),
+
+    State("balance_pin", "ask_balance_pin", store_as="pin", action=show_balance, loads=("user",)),
+
+    State("recharge_amount", "ask_recharge_amount", store_as="amount", validate=amount, next="recharge_operator"),
+    State("recharge_operator", "ask_operator", store_as="operator", validate=operator, next="recharge_pin"),
+    State("recharge_pin", "ask_recharge_pin", store_as="pin", action=do_recharge, loads=("user",)),
+]
+
+ussd_machine = UssdMachine(
+    STATES,
+    TEXTS,
+    entry=entry,
+    entry_loads=("user",),
+    loaders={"user": load_user},
+)
@@ -0,0 +1,181 @@
+import json
+import time
+from dataclasses import dataclass, field
+
+from app.configs.config import settings
+from app.configs.database import AsyncSessionLocal
+from app.models.session_model import get_session, create_session, update_session, delete_session
+from app.schemas.session_schema import SessionCreate, SessionUpdate
+
+
+@dataclass
+class UssdSession:
+    session_id: str
+    state: str
+    data: dict = field(default_factory=dict)
+
+
+class MemorySessionStore:
+    """
+    Sessions kept in this process. No I/O at all, but only usable with a single
+    worker since the next hop of a session may land on another one.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._sessions = {}
+        self._next_purge = time.monotonic() + ttl
+
+    def _live(self, session_id: str):
+        entry = self._sessions.get(session_id)
+        if entry is not None and entry[2] <= time.monotonic():
+            del self._sessions[session_id]
+            return None
+        return entry
+
+    def _store(self, session_id: str, state: str, data: dict):
+        now = time.monotonic()
+        if now >= self._next_purge:
+            self._sessions = {key: entry for key, entry in self._sessions.items() if entry[2] > now}
+            self._next_purge = now + self.ttl
+        self._sessions[session_id] = (state, json.dumps(data), now + self.ttl)
+
+    # No await between the check and the write: each operation is atomic on the event loop
+    async def get(self, session_id: str):
+        entry = self._live(session_id)
+        if entry is None:
+            return None
+        return UssdSession(session_id, entry[0], json.loads(entry[1]))
+
+    async def create(self, session_id: str, state: str, data: dict) -> bool:
+        if self._live(session_id) is not None:
+            return False
+        self._store(session_id, state, data)
+        return True
+
+    async def transition(self, session_id: str, from_state: str, to_state: str, data: dict) -> bool:
+        entry = self._live(session_id)
+        if entry is None or entry[0] != from_state:
+            return False
+        self._store(session_id, to_state, data)
+        return True
+
+    async def delete(self, session_id: str, state: str = None) -> bool:
+        entry = self._live(session_id)
+        if entry is None or (state is not None and entry[0] != state):
+            return False
+        del self._sessions[session_id]
+        return True
+
+    async def close(self):
+        self._sessions = {}
+
+
+# The scripts run atomically on the Redis server, the key expires by itself after the TTL
+CREATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+redis.call('HSET', KEYS[1], 'state', ARGV[1], 'data', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+TRANSITION_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'state') ~= ARGV[1] then return 0 end
+redis.call('HSET', KEYS[1], 'state', ARGV[2], 'data', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+DELETE_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'state') ~= ARGV[1] then return 0 end
+return redis.call('DEL', KEYS[1])
+"""
+
+
+class RedisSessionStore:
+    """
+    Sessions in Redis (or anything speaking its protocol), shared by every worker.
+    Each session is a hash {state, data} expiring ttl seconds after its last change.
+    """
+
+    def __init__(self, url: str, ttl: int, prefix: str = "ussd:session:", client=None):
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError:
+                raise RuntimeError("USSD_SESSION_BACKEND=redis requires the redis package")
+            client = redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self._create = client.register_script(CREATE_SCRIPT)
+        self._transition = client.register_script(TRANSITION_SCRIPT)
+        self._delete = client.register_script(DELETE_SCRIPT)
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}"
+
+    async def get(self, session_id: str):
+        entry = await self.client.hgetall(self._key(session_id))
+        if not entry:
+            return None
+        return UssdSession(session_id, entry["state"], json.loads(entry["data"]))
+
+    async def create(self, session_id: str, state: str, data: dict) -> bool:
+        return await self._create(keys=[self._key(session_id)], args=[state, json.dumps(data), self.ttl]) == 1
+
+    async def transition(self, session_id: str, from_state: str, to_state: str, data: dict) -> bool:
+        result = await self._transition(keys=[self._key(session_id)], args=[from_state, to_state, json.dumps(data), self.ttl])
+        return result == 1
+
+    async def delete(self, session_id: str, state: str = None) -> bool:
+        if state is None:
+            return await self.client.delete(self._key(session_id)) == 1
+        return await self._delete(keys=[self._key(session_id)], args=[state]) == 1
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class DatabaseSessionStore:
+    """
+    Sessions in the sessions table, one short transaction per operation.
+    """
+
+    def __init__(self, ttl: int, session_factory=AsyncSessionLocal):
+        self.ttl = ttl
+        self.session_factory = session_factory
+
+    async def get(self, session_id: str):
+        async with self.session_factory() as db:
+            session = await get_session(db, session_id)
+        if session is None:
+            return None
+        return UssdSession(session_id, session.state, json.loads(session.data))
+
+    async def create(self, session_id: str, state: str, data: dict) -> bool:
+        async with self.session_factory() as db:
+            session = await create_session(db, SessionCreate(session_id=session_id, state=state, data=data), self.ttl)
+        return session is not None
+
+    async def transition(self, session_id: str, from_state: str, to_state: str, data: dict) -> bool:
+        async with self.session_factory() as db:
+            return await update_session(db, session_id, from_state, SessionUpdate(state=to_state, data=data), self.ttl)
+
+    async def delete(self, session_id: str, state: str = None) -> bool:
+        async with self.session_factory() as db:
+            return await delete_session(db, session_id, state)
+
+    async def close(self):
+        pass
+
+
+def create_session_store(name: str):
+    if name == "memory":
+        return MemorySessionStore(settings.USSD_SESSION_TTL)
+    if name == "redis":
+        return RedisSessionStore(settings.REDIS_URL, settings.USSD_SESSION_TTL)
+    return DatabaseSessionStore(settings.USSD_SESSION_TTL)
+
+
+ussd_session_store = create_session_store(settings.USSD_SESSION_BACKEND)
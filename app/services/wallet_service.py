@@ -0,0 +1,162 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from sqlalchemy import case, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.models.ledger_model import ACCOUNT_FEES, ACCOUNT_FX, ledger_entries
+from app.models.statement_model import add_wallet_activity, collect_activity
+from app.models.user_model import Wallet
+
+
+class InsufficientFundsError(Exception):
+    pass
+
+
+async def lock_wallets(db: AsyncSession, *wallet_ids: int) -> dict:
+    """
+    Lock the given wallets with SELECT ... FOR UPDATE, always in ascending id order so
+    that two concurrent transfers in opposite directions cannot deadlock.
+    The locks are held until the caller commits or rolls back.
+    """
+    result = await db.execute(
+        select(Wallet)
+        .filter(Wallet.id.in_(set(wallet_ids)))
+        .order_by(Wallet.id)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    )
+    return {wallet.id: wallet for wallet in result.scalars().all()}
+
+
+# debit_wallet and credit_wallet only change the balance, the functions below also write the ledger
+async def debit_wallet(db: AsyncSession, wallet_id: int, amount: Decimal):
+    """
+    Atomically remove `amount` from a wallet, only if its balance covers it.
+    """
+    result = await db.execute(
+        update(Wallet)
+        .filter(Wallet.id == wallet_id, Wallet.balance >= amount)
+        .values(balance=Wallet.balance - amount)
+    )
+    if result.rowcount != 1:
+        raise InsufficientFundsError(f"Insufficient funds on wallet {wallet_id}")
+
+
+async def credit_wallet(db: AsyncSession, wallet_id: int, amount: Decimal):
+    """
+    Atomically add `amount` to a wallet.
+    """
+    await db.execute(
+        update(Wallet)
+        .filter(Wallet.id == wallet_id)
+        .values(balance=Wallet.balance + amount)
+    )
+
+
+async def transfer_between_wallets(db: AsyncSession, from_wallet_id: int, to_wallet_id: int, amount: Decimal,
+                                   credited_amount: Decimal = None, transaction=None, fee: Decimal = Decimal(0)):
+    """
+    Move `amount` out of one wallet and `credited_amount` (the converted amount when the
+    currencies differ, `amount` otherwise) into another, inside the caller's transaction.
+    The sender also pays `fee`, in its own currency.
+    Both wallets are locked first so the balance check and the updates cannot interleave
+    with another transfer. Raises InsufficientFundsError, the caller must then roll back.
+    The ledger entries are added to the same transaction, linked to `transaction`.
+    """
+    if credited_amount is None:
+        credited_amount = amount
+
+    wallets = await lock_wallets(db, from_wallet_id, to_wallet_id)
+    from_currency = wallets[from_wallet_id].currency
+    to_currency = wallets[to_wallet_id].currency
+
+    await debit_wallet(db, from_wallet_id, amount + fee)
+    await credit_wallet(db, to_wallet_id, credited_amount)
+
+    legs = transfer_legs(from_wallet_id, from_currency, to_wallet_id, to_currency, amount, credited_amount, fee)
+    db.add_all(ledger_entries(legs, transaction))
+    await add_wallet_activity(db, collect_activity({}, legs, from_wallet_id, fee))
+
+
+def transfer_legs(from_wallet_id: int, from_currency: str, to_wallet_id: int, to_currency: str, amount: Decimal,
+                  credited_amount: Decimal, fee: Decimal) -> list:
+    if from_currency == to_currency:
+        legs = [
+            (from_wallet_id, None, -(amount + fee), from_currency),
+            (to_wallet_id, None, credited_amount, to_currency),
+        ]
+    else:
+        # The exchange account takes one currency and gives the other
+        legs = [
+            (from_wallet_id, None, -(amount + fee), from_currency),
+            (None, ACCOUNT_FX, amount, from_currency),
+            (None, ACCOUNT_FX, -credited_amount, to_currency),
+            (to_wallet_id, None, credited_amount, to_currency),
+        ]
+    if fee:
+        legs.append((None, ACCOUNT_FEES, fee, from_currency))
+    return legs
+
+
+async def transfer_many(db: AsyncSession, from_wallet_id: int, transfers: list):
+    """
+    Pay several wallets out of one, inside the caller's transaction. `transfers` are
+    (to_wallet_id, amount, credited_amount, fee, transaction) tuples, applied in order
+    while the sender's balance covers them, the others are skipped.
+    Whatever their number: one query locks every wallet, one UPDATE debits the sender
+    and one credits all the recipients.
+    Returns the locked wallets, balances updated, and whether each transfer was applied.
+    """
+    wallets = await lock_wallets(db, from_wallet_id, *(transfer[0] for transfer in transfers))
+    sender = wallets[from_wallet_id]
+
+    available = sender.balance
+    debited = Decimal(0)
+    credits = defaultdict(Decimal)
+    activity = {}
+    applied = []
+    for to_wallet_id, amount, credited_amount, fee, transaction in transfers:
+        if available < amount + fee:
+            applied.append(False)
+            continue
+        available -= amount + fee
+        debited += amount + fee
+        credits[to_wallet_id] += credited_amount
+        legs = transfer_legs(from_wallet_id, sender.currency, to_wallet_id, wallets[to_wallet_id].currency,
+                             amount, credited_amount, fee)
+        db.add_all(ledger_entries(legs, transaction))
+        collect_activity(activity, legs, from_wallet_id, fee)
+        applied.append(True)
+
+    if debited:
+        await debit_wallet(db, from_wallet_id, debited)
+        await db.execute(
+            update(Wallet)
+            .filter(Wallet.id.in_(list(credits)))
+            .values(balance=Wallet.balance + case(dict(credits), value=Wallet.id))
+            .execution_options(synchronize_session=False)
+        )
+        # The rows are locked, their new balances are known without reading them back
+        for wallet_id, credited_amount in credits.items():
+            set_committed_value(wallets[wallet_id], "balance", wallets[wallet_id].balance + credited_amount)
+        await add_wallet_activity(db, activity)
+    return wallets, applied
+
+
+async def deposit_to_wallet(db: AsyncSession, wallet_id: int, currency: str, amount: Decimal, source: str, transaction=None,
+                            fee: Decimal = Decimal(0)):
+    """
+    Credit money coming from outside (`source` is the external account, e.g. ACCOUNT_STRIPE),
+    less `fee`, and write its ledger entries, inside the caller's transaction.
+    """
+    await credit_wallet(db, wallet_id, amount - fee)
+    legs = [
+        (None, source, -amount, currency),
+        (wallet_id, None, amount - fee, currency),
+    ]
+    if fee:
+        legs.append((None, ACCOUNT_FEES, fee, currency))
+    db.add_all(ledger_entries(legs, transaction))
+    await add_wallet_activity(db, collect_activity({}, legs, wallet_id, fee))
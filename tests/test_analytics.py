@@ -0,0 +1,61 @@
+import asyncio
+import json
+from datetime import date, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import selectinload
+
+from app.models.user_model import User, Wallet, create_merchant_user, create_user
+from app.schemas.user_schema import MerchantCreate, UserCreate
+from app.services.analytics import TransactionSnapshots
+from app.services.payments import transfer, withdraw
+from app.services.stripe_events import credit_payment_intent
+
+PROFILE = dict(pin="hashed-pin", first_name="A", last_name="B", date_of_birth=date(1990, 1, 1), place_of_birth="Douala")
+
+
+def seed(sessions):
+    """
+    A client tops up 500 by card, withdraws 1000 at the merchant, sends 200 to the
+    merchant owner; the merchant owner also tops up 300 by card.
+    """
+    async def scenario():
+        async with sessions() as db:
+            client = await create_user(db, UserCreate(phone_number="237690000001", email="a@example.com", **PROFILE))
+            owner = await create_merchant_user(db, MerchantCreate(phone_number="237690000002", email="b@example.com",
+                                                                  business_name="Shop", **PROFILE), "123456")
+            await db.execute(update(Wallet).values(balance=Decimal(5000), currency="XAF"))
+            await db.commit()
+            client_id, owner_id = client.id, owner.id
+
+        async with sessions() as db:
+            users = {user.id: user for user in (await db.execute(select(User).options(selectinload(User.wallet)))).scalars()}
+            for user_id, amount in ((client_id, "500"), (owner_id, "300")):
+                payload = {"metadata": {"user_id": user_id, "currency": "XAF", "amount": amount}}
+                await credit_payment_intent(db, SimpleNamespace(payload=json.dumps(payload)), users)
+            await db.commit()
+            await withdraw(db, users[client_id], users[owner_id], Decimal(1000))
+            await transfer(db, users[client_id], users[owner_id], Decimal(200))
+
+    asyncio.run(scenario())
+
+
+def test_withdrawal_counted_once(sessions, sync_sessions, tmp_path):
+    seed(sessions)
+    snapshots = TransactionSnapshots(str(tmp_path / "analytics"))
+    today = date.today()
+    with sync_sessions() as db:
+        assert snapshots.snapshot(db, today - timedelta(days=1), today + timedelta(days=2)) == 4
+
+    def volumes(dimension):
+        lines = snapshots.volumes(today - timedelta(days=1), today + timedelta(days=1), [dimension])
+        return {line[dimension]: (line["amount"], line["count"]) for line in lines}
+
+    # 500 + 300 top-ups, the 1000 withdrawal and the 200 transfer, the merchant's mirror credit is not counted
+    assert volumes("currency") == {"XAF": (Decimal(2000), 4)}
+
+    # The owner's own top-up is not a payment to the shop
+    assert volumes("merchant") == {"Shop": (Decimal(1200), 2), None: (Decimal(800), 2)}
+    assert volumes("channel") == {"stripe": (Decimal(800), 2), "wallet": (Decimal(1200), 2)}
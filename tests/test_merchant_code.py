@@ -0,0 +1,31 @@
+import asyncio
+from datetime import date
+
+from app.models.roles_model import get_merchant_by_code, merchant_code_exists
+from app.models.user_model import create_merchant_user
+from app.schemas.user_schema import MerchantCreate
+
+
+def merchant(phone_number="237690000001"):
+    return MerchantCreate(phone_number=phone_number, pin="hashed-pin", username="shop.owner", email="shop@example.com",
+                          first_name="Shop", last_name="Owner", date_of_birth=date(1990, 5, 15),
+                          place_of_birth="Douala", business_name="Shop")
+
+
+def test_register_then_find_by_code(sessions):
+    async def scenario():
+        async with sessions() as db:
+            user = await create_merchant_user(db, merchant(), "123456")
+            assert user.id
+
+        async with sessions() as db:
+            found = await get_merchant_by_code(db, "237690000001", "123456")
+            assert found is not None and found.business_name == "Shop"
+            # Only the digest is stored
+            assert found.merchant_code is None and found.merchant_code_digest != "123456"
+            assert await merchant_code_exists(db, "123456")
+
+            assert await get_merchant_by_code(db, "237690000001", "654321") is None
+            assert await get_merchant_by_code(db, "237690000002", "123456") is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,74 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+from app.models.outbox_model import OUTBOX_FAILED, OUTBOX_PENDING, OUTBOX_SENT, OutboxMessage, outbox_message
+from app.services.outbox import OutboxRelay
+
+
+def add_messages(sessions, *topics):
+    async def add():
+        async with sessions() as db:
+            db.add_all([outbox_message(topic, {"n": n}) for n, topic in enumerate(topics)])
+            await db.commit()
+    asyncio.run(add())
+
+
+def messages(sessions):
+    async def load():
+        async with sessions() as db:
+            return (await db.execute(select(OutboxMessage).order_by(OutboxMessage.id))).scalars().all()
+    return asyncio.run(load())
+
+
+def test_sinks_run_outside_of_any_transaction(sessions):
+    opened = []
+
+    def session_factory():
+        session = sessions()
+        opened.append(session)
+        return session
+
+    async def sink(payload):
+        assert not any(session.in_transaction() for session in opened)
+        # The messages are leased meanwhile, another relay does not take them
+        assert await OutboxRelay({"sms": sink}, sessions).relay_batch() == 0
+
+    add_messages(sessions, "sms", "sms")
+    assert asyncio.run(OutboxRelay({"sms": sink}, session_factory).relay_batch()) == 2
+    assert [(message.status, message.attempts) for message in messages(sessions)] == [(OUTBOX_SENT, 1)] * 2
+
+
+def test_failed_sends_are_retried_then_failed(sessions):
+    async def sink(payload):
+        raise ConnectionError("down")
+
+    add_messages(sessions, "sms", "webhook")
+    before = datetime.utcnow()
+    assert asyncio.run(OutboxRelay({"sms": sink}, sessions, max_attempts=2, retry_backoff=30).relay_batch()) == 2
+    for message in messages(sessions):
+        assert (message.status, message.attempts) == (OUTBOX_PENDING, 1)
+        assert message.available_at >= before + timedelta(seconds=30)
+    assert "No sink for topic webhook" in messages(sessions)[1].error
+
+    async def make_due():
+        async with sessions() as db:
+            await db.execute(update(OutboxMessage).values(available_at=datetime.utcnow()))
+            await db.commit()
+    asyncio.run(make_due())
+    asyncio.run(OutboxRelay({"sms": sink}, sessions, max_attempts=2).relay_batch())
+    assert [(message.status, message.attempts) for message in messages(sessions)] == [(OUTBOX_FAILED, 2)] * 2
+
+
+def test_expired_lease_is_not_recorded(sessions):
+    async def slow_sink(payload):
+        # The lease ran out and another relay took the message
+        async with sessions() as db:
+            await db.execute(update(OutboxMessage).values(available_at=datetime(2000, 1, 1)))
+            await db.commit()
+
+    add_messages(sessions, "sms")
+    asyncio.run(OutboxRelay({"sms": slow_sink}, sessions).relay_batch())
+    [message] = messages(sessions)
+    assert (message.status, message.attempts) == (OUTBOX_PENDING, 0)
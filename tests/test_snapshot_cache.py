@@ -0,0 +1,49 @@
+import asyncio
+from decimal import Decimal
+
+from app.core.rate_cache import RateSnapshot
+from app.core.snapshot_cache import SnapshotCache
+
+ROWS = [("EUR", "XAF", Decimal("655.957")), ("XAF", "EUR", Decimal("0.001524"))]
+
+
+def rate_cache(ttl=60):
+    loads = []
+
+    async def load(db):
+        loads.append(db)
+        return ROWS
+
+    return SnapshotCache(RateSnapshot, load, ttl), loads
+
+
+def test_loads_once_then_serves_the_snapshot():
+    cache, loads = rate_cache()
+    assert cache.snapshot is None
+    first = asyncio.run(cache.get("db"))
+    assert asyncio.run(cache.get("db")) is first
+    assert first.get("EUR", "XAF") == Decimal("655.957")
+    assert loads == ["db"]
+
+
+def test_reloads_on_expiry_and_after_invalidate():
+    cache, loads = rate_cache(ttl=-1)
+    asyncio.run(cache.get("db"))
+    assert cache.snapshot is None
+    asyncio.run(cache.get("db"))
+    assert len(loads) == 2
+
+    cache.ttl = 60
+    cache.invalidate()
+    asyncio.run(cache.get("db"))
+    assert len(loads) == 3
+
+
+def test_swap_replaces_the_snapshot_readers_hold():
+    cache, loads = rate_cache()
+    held = cache.swap(ROWS)
+    cache.swap([("EUR", "XAF", Decimal(656))])
+    assert held.get("EUR", "XAF") == Decimal("655.957")
+    assert cache.snapshot.get("EUR", "XAF") == Decimal(656)
+    assert cache.snapshot.get("XAF", "EUR") is None
+    assert loads == []
@@ -0,0 +1,90 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+
+from app.core.tariff_index import TariffIndex
+from app.models.tarif_model import TARIFF_RECHARGE, TARIFF_TRANSFER, TARIFF_WITHDRAW, compute_fee, tariff_cache
+
+# A grid shaped like the production one: contiguous bands, then a gap, per type and currency
+TARIFFS = [
+    (TARIFF_TRANSFER, "XAF", Decimal(50), Decimal(5000), Decimal(50)),
+    (TARIFF_TRANSFER, "XAF", Decimal(5001), Decimal(50000), Decimal(250)),
+    (TARIFF_TRANSFER, "XAF", Decimal(50001), Decimal(500000), Decimal(1000)),
+    (TARIFF_TRANSFER, "XAF", Decimal(1000000), Decimal(5000000), Decimal(5000)),
+    (TARIFF_WITHDRAW, "XAF", Decimal(100), Decimal(10000), Decimal(100)),
+    (TARIFF_WITHDRAW, "XAF", Decimal(10001), Decimal(1000000), Decimal(500)),
+    (TARIFF_RECHARGE, "XAF", Decimal(100), Decimal(1000000), Decimal(0)),
+    (TARIFF_TRANSFER, "EUR", Decimal("0.50"), Decimal("99.99"), Decimal("0.25")),
+    (TARIFF_TRANSFER, "EUR", Decimal("100.00"), Decimal("10000.00"), Decimal("1.50")),
+]
+
+
+def linear_fee(rows, transaction_type, currency, amount):
+    # What compute_fee did before the index: the first band containing the amount
+    for row_type, row_currency, min_amount, max_amount, fee in rows:
+        if row_type == transaction_type and row_currency == currency and min_amount <= amount <= max_amount:
+            return fee
+    return None
+
+
+@pytest.fixture(scope="module")
+def index():
+    return TariffIndex(TARIFFS)
+
+
+@pytest.mark.parametrize("amount, fee", [
+    (Decimal(50), Decimal(50)),  # min_amount of the first band
+    (Decimal(5000), Decimal(50)),  # max_amount, bounds are included
+    (Decimal(5001), Decimal(250)),  # next band starts right after
+    (Decimal("5000.50"), None),  # between two contiguous bands
+    (Decimal(500000), Decimal(1000)),
+    (Decimal(700000), None),  # gap between 500000 and 1000000
+    (Decimal(1000000), Decimal(5000)),
+    (Decimal(5000000), Decimal(5000)),
+    (Decimal(5000001), None),  # above the top band
+    (Decimal(49), None),  # below the first band
+    (Decimal(0), None),
+])
+def test_band_lookup(index, amount, fee):
+    assert index.fee(TARIFF_TRANSFER, "XAF", amount) == fee
+
+
+def test_bands_are_per_type_and_currency(index):
+    assert index.fee(TARIFF_WITHDRAW, "XAF", Decimal(10000)) == Decimal(100)
+    assert index.fee(TARIFF_TRANSFER, "EUR", Decimal("99.99")) == Decimal("0.25")
+    assert index.fee(TARIFF_TRANSFER, "EUR", Decimal("99.995")) is None
+    assert index.fee(TARIFF_TRANSFER, "USD", Decimal(100)) is None
+    assert index.fee("payment", "XAF", Decimal(100)) is None
+
+
+def test_same_fee_as_the_linear_scan(index):
+    keys = {(row[0], row[1]) for row in TARIFFS}
+    bounds = {amount for row in TARIFFS for amount in (row[2], row[3])}
+    amounts = bounds | {amount + delta for amount in bounds for delta in (Decimal("-0.01"), Decimal("0.01"), Decimal(1))}
+    amounts |= {Decimal(amount) for amount in range(0, 6000000, 997)}
+    for transaction_type, currency in keys:
+        for amount in amounts:
+            assert index.fee(transaction_type, currency, amount) == linear_fee(TARIFFS, transaction_type, currency, amount), \
+                (transaction_type, currency, amount)
+
+
+def test_unsorted_rows():
+    index = TariffIndex(list(reversed(TARIFFS)))
+    assert index.fee(TARIFF_TRANSFER, "XAF", Decimal(5001)) == Decimal(250)
+    assert index.fee(TARIFF_TRANSFER, "XAF", Decimal(49)) is None
+
+
+def test_empty_grid():
+    assert TariffIndex([]).fee(TARIFF_TRANSFER, "XAF", Decimal(1000)) is None
+
+
+def test_compute_fee_reads_the_cached_grid():
+    tariff_cache.swap(TARIFFS)
+    try:
+        # No session needed while the grid is cached
+        assert asyncio.run(compute_fee(None, TARIFF_TRANSFER, Decimal(5000), "XAF")) == Decimal(50)
+        assert asyncio.run(compute_fee(None, TARIFF_TRANSFER, Decimal(700000), "XAF")) == Decimal(0)
+        assert asyncio.run(compute_fee(None, TARIFF_TRANSFER, Decimal(100), "EUR")) == Decimal("1.50")
+    finally:
+        tariff_cache.invalidate()
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from app.core.ussd_engine import Reply, State, UssdMachine
+from app.services.ussd_sessions import DatabaseSessionStore, MemorySessionStore
+
+TEXTS = {"fr": {
+    "amount": "Montant", "confirm": "1 pour confirmer", "done": "Fait",
+    "error": "Erreur", "invalid_option": "Choix invalide", "session_expired": "Session expiree",
+}}
+
+
+def payment_machine(payments: list) -> UssdMachine:
+    async def pay(ctx):
+        # Leaves the event loop like a real transfer, so that concurrent hops interleave
+        await asyncio.sleep(0.01)
+        payments.append(ctx.data["amount"])
+        return Reply(ctx.text("done"))
+
+    async def entry(ctx):
+        return "amount", "fr"
+
+    return UssdMachine([
+        State("amount", "amount", store_as="amount", next="confirm"),
+        State("confirm", "confirm", store_as="confirmed", action=pay),
+    ], TEXTS, entry)
+
+
+@pytest.fixture(params=["memory", "database"])
+def store(request):
+    if request.param == "memory":
+        return MemorySessionStore(ttl=60)
+    return DatabaseSessionStore(ttl=60, session_factory=request.getfixturevalue("sessions"))
+
+
+async def confirming_hop(machine, store):
+    await machine.handle(store, None, "s1", "237690000001", "")
+    await machine.handle(store, None, "s1", "237690000001", "5000")
+
+
+def test_retried_confirmation_pays_once(store):
+    payments = []
+    machine = payment_machine(payments)
+
+    async def scenario():
+        await confirming_hop(machine, store)
+        first = await machine.handle(store, None, "s1", "237690000001", "1")
+        retry = await machine.handle(store, None, "s1", "237690000001", "1")
+        return first, retry
+
+    first, retry = asyncio.run(scenario())
+    assert first == Reply("Fait", end=True)
+    # The session ended with the payment, the retry starts a new one
+    assert retry == Reply("Montant")
+    assert payments == ["5000"]
+
+
+def test_concurrent_confirmations_pay_once(store):
+    payments = []
+    machine = payment_machine(payments)
+
+    async def scenario():
+        await confirming_hop(machine, store)
+        return await asyncio.gather(*(machine.handle(store, None, "s1", "237690000001", "1") for _ in range(2)))
+
+    replies = asyncio.run(scenario())
+    # The other hop either finds the session claimed or already gone (and starts a new one)
+    assert [reply.message for reply in replies].count("Fait") == 1
+    assert payments == ["5000"]
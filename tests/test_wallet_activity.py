@@ -0,0 +1,28 @@
+import asyncio
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+from app.models.statement_model import WalletDailyStat, add_wallet_activity
+
+
+def test_activity_is_added_to_the_day_row(sessions):
+    async def scenario():
+        async with sessions() as db:
+            await add_wallet_activity(db, {1: ["XAF", Decimal(100), Decimal(0), Decimal(0), 1],
+                                           2: ["XAF", Decimal(0), Decimal(100), Decimal(5), 1]})
+            await add_wallet_activity(db, {1: ["XAF", Decimal(50), Decimal(20), Decimal(1), 2]})
+            await db.commit()
+            rows = await db.execute(select(WalletDailyStat.wallet_id, WalletDailyStat.inflow, WalletDailyStat.outflow,
+                                           WalletDailyStat.fees, WalletDailyStat.count).order_by(WalletDailyStat.wallet_id))
+            return rows.all()
+
+    assert asyncio.run(scenario()) == [(1, Decimal(150), Decimal(20), Decimal(1), 3), (2, Decimal(0), Decimal(100), Decimal(5), 1)]
+
+
+def test_other_databases_are_refused():
+    db = SimpleNamespace(get_bind=lambda: SimpleNamespace(dialect=SimpleNamespace(name="postgresql")))
+    with pytest.raises(NotImplementedError):
+        asyncio.run(add_wallet_activity(db, {1: ["XAF", Decimal(1), Decimal(0), Decimal(0), 1]}))